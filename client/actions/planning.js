@@ -1,6 +1,6 @@
 import * as selectors from '../selectors'
 import * as actions from '../actions'
-import { pickBy, cloneDeep, isNil, has, get, isEqual } from 'lodash'
+import { pickBy, pick, cloneDeep, isNil, has, get, isEqual } from 'lodash'
 import { addToCurrentAgenda, selectAgenda,
     fetchSelectedAgendaPlannings } from './agenda'
 import { PRIVILEGES, PLANNING, ITEM_STATE } from '../constants'
@@ -144,55 +144,60 @@ const _savePlanning = (planning) => (
 /**
  * Saves or deletes coverages through the API to
  * the given planning based on the original coverages
+ * All the coverages are sent with a single request if any of them changed,
+ * the server creates, updates and deletes them to match the given list.
+ * The _etag of the coverages is sent so the changes of another user are not overwritten
  * @param {array, object} coverages - An array of coverage objects
  * @param {object} planning - The associated planning item
  * @param {object} originalCoverages - The original version of the coverage list
  * @return Promise
  */
 const _saveAndDeleteCoverages = (coverages, planning, originalCoverages=[]) => (
-    (dispatch, getState, { api }) => {
-        const promises = []
-        // saves coverages
-        if (coverages && coverages.length > 0) {
-            coverages.forEach((coverage) => {
-                // patch or post ? look for an original coverage
-                const originalCoverage = originalCoverages.find((c) => (
-                    c._id === coverage._id
-                ))
-
-                // If the coverage is scheduled, convert it to a moment instance
-                // so the lodash.isEqual function can compare it with the new coverage
-                if (get(originalCoverage, 'planning.scheduled')) {
-                    originalCoverage.planning.scheduled = moment(
-                        originalCoverage.planning.scheduled
-                    )
-                }
+    (dispatch, getState, { api, notify }) => {
+        coverages = coverages || []
+        originalCoverages = originalCoverages || []
+
+        const changed = coverages.some((coverage) => {
+            const originalCoverage = cloneDeep(originalCoverages.find((c) => (
+                c._id === coverage._id
+            )))
+
+            // If the coverage is scheduled, convert it to a moment instance
+            // so the lodash.isEqual function can compare it with the new coverage
+            if (get(originalCoverage, 'planning.scheduled')) {
+                originalCoverage.planning.scheduled = moment(
+                    originalCoverage.planning.scheduled
+                )
+            }
 
-                // Only update the coverage if it has changed
-                if (!isEqual(coverage, originalCoverage)) {
-                    coverage.planning_item = planning._id
-                    promises.push(
-                        api('coverage').save(cloneDeep(originalCoverage || {}), coverage)
-                    )
-                }
-            })
-        }
-        // deletes coverages
-        if (originalCoverages && originalCoverages.length > 0) {
-            originalCoverages.forEach((originalCoverage) => {
-                // if there is a coverage in the original planning that is not anymore
-                // in the planning, we delete it
-                if (coverages.findIndex((c) => (
-                    c._id && c._id === originalCoverage._id
-                )) === -1) {
-                    promises.push(
-                        api('coverage').remove(originalCoverage)
-                    )
-                }
-            })
+            return !isEqual(coverage, originalCoverage)
+        })
+
+        // if there is a coverage in the original planning that is not anymore
+        // in the planning, it gets deleted
+        const deleted = originalCoverages.some((originalCoverage) => (
+            coverages.findIndex((c) => (
+                c._id && c._id === originalCoverage._id
+            )) === -1
+        ))
+
+        if (!changed && !deleted) {
+            return Promise.resolve()
         }
-        // returns the up to date planning when all is done
-        return Promise.all(promises)
+
+        return api('coverage_bulk').save({}, {
+            planning_item: planning._id,
+            coverages: coverages.map((coverage) => (
+                pick(coverage, ['_id', '_etag', 'planning', 'delivery'])
+            )),
+        })
+        .then(null, (error) => {
+            if (get(error, 'status') === 412) {
+                notify.error('The coverages were changed by another user, reload the planning item.')
+            }
+
+            throw error
+        })
     }
 )
 
@@ -530,6 +535,7 @@ const planningNotifications = {
     'coverage:created': onCoverageCreatedOrUpdated,
     'coverage:updated': onCoverageCreatedOrUpdated,
     'coverage:deleted': onCoverageDeleted,
+    'coverage:updated:bulk': onPlanningUpdated,
     'planning:updated': onPlanningUpdated,
     'planning:spiked': onPlanningUpdated,
     'planning:unspiked': onPlanningUpdated,
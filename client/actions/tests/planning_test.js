@@ -381,7 +381,7 @@ describe('planning', () => {
                 apiSpy.save = sinon.spy((() => Promise.resolve()))
             })
 
-            it('only saves new, modified and deleted coverages', (done) => {
+            it('saves all the coverages in one request when some changed', (done) => {
                 coverages[1].planning.scheduled = moment('2017-06-09T12:00:00+0000')
                 coverages.push({
                     _id: 'c3',
@@ -390,31 +390,78 @@ describe('planning', () => {
 
                 return action()
                 .then(() => {
-                    expect(apiSpy.save.callCount).toBe(2)
-
-                    // Coverage C1, is not sent to the server as it has not changed
-
-                    // Update Coverage C2
-                    expect(apiSpy.save.args[0]).toEqual([{
-                        _id: 'c2',
-                        planning: { scheduled: moment('2017-06-08T12:00:00+0000') },
-                        planning_item: 'p1',
-                    }, {
-                        _id: 'c2',
-                        planning: { scheduled: moment('2017-06-09T12:00:00+0000') },
+                    expect(apiSpy.save.callCount).toBe(1)
+                    expect(apiSpy.save.args[0]).toEqual([{}, {
                         planning_item: 'p1',
+                        coverages: [{
+                            _id: 'c1',
+                            planning: { scheduled: moment('2017-06-07T12:00:00+0000') },
+                        }, {
+                            _id: 'c2',
+                            planning: { scheduled: moment('2017-06-09T12:00:00+0000') },
+                        }, {
+                            _id: 'c3',
+                            planning: { scheduled: moment('2017-06-10T13:00:00+0000') },
+                        }],
                     }])
 
-                    // Add new Coverage C3
-                    expect(apiSpy.save.args[1]).toEqual([{}, {
-                        _id: 'c3',
-                        planning: { scheduled: moment('2017-06-10T13:00:00+0000') },
-                        planning_item: 'p1',
+                    // Coverages are deleted by the server
+                    expect(apiSpy.remove.callCount).toBe(0)
+
+                    done()
+                })
+            })
+
+            it('saves the coverages when one is deleted', (done) => {
+                coverages.pop()
+
+                return action()
+                .then(() => {
+                    expect(apiSpy.save.callCount).toBe(1)
+                    expect(apiSpy.save.args[0][1].coverages).toEqual([{
+                        _id: 'c1',
+                        planning: { scheduled: moment('2017-06-07T12:00:00+0000') },
                     }])
 
-                    // No Coverages were deleted
-                    expect(apiSpy.remove.callCount).toBe(0)
+                    done()
+                })
+            })
 
+            it('sends the _etag of the coverages', (done) => {
+                coverages[0]._etag = 'e1'
+                coverages[1].planning.scheduled = moment('2017-06-09T12:00:00+0000')
+
+                return action()
+                .then(() => {
+                    expect(apiSpy.save.args[0][1].coverages[0]).toEqual({
+                        _id: 'c1',
+                        _etag: 'e1',
+                        planning: { scheduled: moment('2017-06-07T12:00:00+0000') },
+                    })
+
+                    done()
+                })
+            })
+
+            it('notifies when the coverages were changed by another user', (done) => {
+                coverages.pop()
+                apiSpy.save = sinon.spy(() => Promise.reject({ status: 412 }))
+
+                return action()
+                .then(() => {}, (error) => {
+                    expect(error).toEqual({ status: 412 })
+                    expect(notify.error.args[0]).toEqual([
+                        'The coverages were changed by another user, reload the planning item.',
+                    ])
+
+                    done()
+                })
+            })
+
+            it('does not save unchanged coverages', (done) => {
+                return action()
+                .then(() => {
+                    expect(apiSpy.save.callCount).toBe(0)
                     done()
                 })
             })
@@ -149,3 +149,52 @@ Feature: Agenda Spike
         Then we get OK response
         When we unspike agenda "#agenda._id#"
         Then we get OK response
+
+    @auth
+    @notification
+    Scenario: Bulk spike and unspike Agendas
+        Given "agenda"
+        """
+        [{
+            "name": "TestAgenda"
+        }]
+        """
+        When we post to "/agenda/bulk_spike"
+        """
+        {"ids": ["#agenda._id#"]}
+        """
+        Then we get new resource
+        """
+        {"items": [{"_id": "#agenda._id#", "result": "spiked"}]}
+        """
+        And we get notifications
+        """
+        [{
+            "event": "agenda:spiked:bulk",
+            "extra": {
+                "items": ["#agenda._id#"],
+                "user": "#CONTEXT_USER_ID#"
+            }
+        }]
+        """
+        When we get "/agenda/#agenda._id#"
+        Then we get existing resource
+        """
+        {"_id": "#agenda._id#", "state": "spiked"}
+        """
+        When we post to "/agenda/bulk_unspike"
+        """
+        {"ids": ["#agenda._id#"]}
+        """
+        Then we get new resource
+        """
+        {"items": [{"_id": "#agenda._id#", "result": "unspiked"}]}
+        """
+        When we get "/agenda_history?where=agenda_id==%22#agenda._id#%22"
+        Then we get list with 2 items
+        """
+        {"_items": [
+            {"operation": "spiked", "update": {"state": "spiked"}},
+            {"operation": "unspiked", "update": {"state": "active"}}
+        ]}
+        """
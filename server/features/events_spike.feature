@@ -257,3 +257,120 @@ Feature: Events Spike
                 "state": "spiked"
             }]}
         """
+
+    @auth
+    @notification
+    Scenario: Bulk spike Events and their associated Planning items
+        Given "events"
+        """
+        [{
+            "guid": "event1",
+            "name": "TestEvent 1",
+            "dates": {
+                "start": "2016-01-02",
+                "end": "2016-01-03"
+            }
+        }, {
+            "guid": "event2",
+            "name": "TestEvent 2",
+            "dates": {
+                "start": "2016-01-02",
+                "end": "2016-01-03"
+            },
+            "state": "spiked"
+        }]
+        """
+        Given "planning"
+        """
+        [{
+            "slugline": "TestPlan 1",
+            "event_item": "event1"
+        }]
+        """
+        When we post to "/events/bulk_spike"
+        """
+        {"ids": ["event1", "event2", "event3"]}
+        """
+        Then we get new resource
+        """
+        {"items": [
+            {"_id": "event1", "result": "spiked"},
+            {"_id": "event2", "result": "unchanged"},
+            {"_id": "event3", "result": "not_found"}
+        ]}
+        """
+        And we get notifications
+        """
+        [{
+            "event": "events:spiked:bulk",
+            "extra": {
+                "items": ["event1"],
+                "user": "#CONTEXT_USER_ID#"
+            }
+        }, {
+            "event": "planning:spiked:bulk",
+            "extra": {
+                "items": ["#planning._id#"],
+                "user": "#CONTEXT_USER_ID#"
+            }
+        }]
+        """
+        When we get "/events/event1"
+        Then we get existing resource
+        """
+        {"_id": "event1", "state": "spiked"}
+        """
+        When we get "/planning/#planning._id#"
+        Then we get existing resource
+        """
+        {"_id": "#planning._id#", "state": "spiked"}
+        """
+        When we get "/events_history?where=event_id==%22event1%22"
+        Then we get list with 1 items
+        """
+        {"_items": [{
+            "event_id": "event1",
+            "operation": "spiked",
+            "update": {"state" : "spiked"}
+        }]}
+        """
+
+    @auth
+    Scenario: Bulk unspike Events by query
+        Given "events"
+        """
+        [{
+            "guid": "event1",
+            "name": "TestEvent 1",
+            "dates": {
+                "start": "2016-01-02",
+                "end": "2016-01-03"
+            },
+            "state": "spiked"
+        }, {
+            "guid": "event2",
+            "name": "TestEvent 2",
+            "dates": {
+                "start": "2016-01-02",
+                "end": "2016-01-03"
+            }
+        }]
+        """
+        When we post to "/events/bulk_unspike"
+        """
+        {"query": {"name": "TestEvent 1"}}
+        """
+        Then we get new resource
+        """
+        {"items": [{"_id": "event1", "result": "unspiked"}]}
+        """
+        When we get "/events/event1"
+        Then we get existing resource
+        """
+        {"_id": "event1", "state": "active"}
+        """
+        When we post to "/events/bulk_unspike"
+        """
+        {}
+        """
+        Then we get error 400
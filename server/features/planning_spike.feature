@@ -206,3 +206,69 @@ Feature: Planning Spike
         }]}
         """
         Then we get OK response
+
+    @auth
+    Scenario: Bulk spike planning is recorded in agenda history
+        When we post to "planning"
+        """
+        [{"slugline": "slugger"}]
+        """
+        Then we get OK response
+        Then we store "planningId" with value "#planning._id#" to context
+        When we post to "agenda" with success
+        """
+        [{"name": "foo"}]
+        """
+        Then we store "agendaId" with value "#agenda._id#" to context
+        When we patch "/agenda/#agendaId#"
+        """
+        {"planning_items": ["#planningId#"]}
+        """
+        Then we get OK response
+        When we post to "/planning/bulk_spike"
+        """
+        {"ids": ["#planningId#", "#agendaId#"]}
+        """
+        Then we get new resource
+        """
+        {"items": [
+            {"_id": "#planningId#", "result": "spiked"},
+            {"_id": "#agendaId#", "result": "not_found"}
+        ]}
+        """
+        When we get "/planning/#planningId#"
+        Then we get existing resource
+        """
+        {"_id": "#planningId#", "state": "spiked"}
+        """
+        When we get "/agenda/#agendaId#"
+        Then we get existing resource
+        """
+        {"_id": "#agendaId#", "state": "active"}
+        """
+        When we get "/agenda_history?where=agenda_id==%22#agendaId#%22"
+        Then we get list with 3 items
+        """
+        {"_items": [{
+            "operation" : "item spiked",
+                "update" : {
+                "planning_items" : "#planningId#"}
+        }]}
+        """
+        When we post to "/planning/bulk_unspike"
+        """
+        {"ids": ["#planningId#"]}
+        """
+        Then we get new resource
+        """
+        {"items": [{"_id": "#planningId#", "result": "unspiked"}]}
+        """
+        When we get "/agenda_history?where=agenda_id==%22#agendaId#%22"
+        Then we get list with 4 items
+        """
+        {"_items": [{
+            "operation" : "item unspiked",
+                "update" : {
+                "planning_items" : "#planningId#"}
+        }]}
+        """
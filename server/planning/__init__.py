@@ -11,24 +11,36 @@
 """Superdesk Planning Plugin."""
 
 import superdesk
+from datetime import timedelta
+from superdesk.celery_app import celery
 from .events import EventsResource, EventsService
-from .events_spike import EventsSpikeResource, EventsSpikeService, EventsUnspikeResource, EventsUnspikeService
+from .events_spike import EventsSpikeResource, EventsSpikeService, EventsUnspikeResource, EventsUnspikeService, \
+    EventsBulkSpikeResource, EventsBulkSpikeService, EventsBulkUnspikeResource, EventsBulkUnspikeService
 from .planning import PlanningResource, PlanningService
-from .planning_spike import PlanningSpikeResource, PlanningSpikeService, PlanningUnspikeResource, PlanningUnspikeService
+from .planning_spike import PlanningSpikeResource, PlanningSpikeService, PlanningUnspikeResource, \
+    PlanningUnspikeService, PlanningBulkSpikeResource, PlanningBulkSpikeService, PlanningBulkUnspikeResource, \
+    PlanningBulkUnspikeService
 from .events_files import EventsFilesResource, EventsFilesService
 from .coverage import CoverageResource, CoverageService
-from .locations import LocationsResource, LocationsService
+from .coverage_bulk import CoverageBulkResource, CoverageBulkService
+from .assignments import AssignmentsResource, AssignmentsService
+from .locations import LocationsResource, LocationsService, LocationsRadiusResource, LocationsRadiusService, \
+    LocationsBoundingBoxResource, LocationsBoundingBoxService, LocationsNearestResource, LocationsNearestService, \
+    LocationsAutocompleteResource, LocationsAutocompleteService, set_autocomplete_settings
+from .geocode import GeocodeResource, GeocodeService, GeocodeCacheResource
 from .agenda import AgendaResource, AgendaService
 from .events_history import EventsHistoryResource, EventsHistoryService
 from .planning_history import PlanningHistoryResource, PlanningHistoryService
 from .agenda_history import AgendaHistoryResource, AgendaHistoryService
-from .agenda_spike import AgendaSpikeResource, AgendaUnspikeResource, AgendaSpikeService, AgendaUnspikeService
+from .agenda_spike import AgendaSpikeResource, AgendaUnspikeResource, AgendaSpikeService, AgendaUnspikeService, \
+    AgendaBulkSpikeResource, AgendaBulkUnspikeResource, AgendaBulkSpikeService, AgendaBulkUnspikeService
 from superdesk.io.registry import register_feeding_service, register_feed_parser
 from .feed_parsers.ics_2_0 import IcsTwoFeedParser
 from .feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
 from .feeding_services.event_file_service import EventFileFeedingService
 from .feeding_services.event_http_service import EventHTTPFeedingService
 from .feeding_services.event_email_service import EventEmailFeedingService
+from .commands import DeleteSpikedItems
 
 
 def init_app(app):
@@ -45,6 +57,12 @@ def init_app(app):
     planning_unspike_service = PlanningUnspikeService('planning_unspike', backend=superdesk.get_backend())
     PlanningUnspikeResource('planning_unspike', app=app, service=planning_unspike_service)
 
+    planning_bulk_spike_service = PlanningBulkSpikeService('planning_bulk_spike', backend=superdesk.get_backend())
+    PlanningBulkSpikeResource('planning_bulk_spike', app=app, service=planning_bulk_spike_service)
+
+    planning_bulk_unspike_service = PlanningBulkUnspikeService('planning_bulk_unspike', backend=superdesk.get_backend())
+    PlanningBulkUnspikeResource('planning_bulk_unspike', app=app, service=planning_bulk_unspike_service)
+
     agenda_search_service = AgendaService('agenda', backend=superdesk.get_backend())
     AgendaResource('agenda', app=app, service=agenda_search_service)
 
@@ -54,9 +72,21 @@ def init_app(app):
     agenda_unspike_service = AgendaUnspikeService('agenda_unspike', backend=superdesk.get_backend())
     AgendaUnspikeResource('agenda_unspike', app=app, service=agenda_unspike_service)
 
+    agenda_bulk_spike_service = AgendaBulkSpikeService('agenda_bulk_spike', backend=superdesk.get_backend())
+    AgendaBulkSpikeResource('agenda_bulk_spike', app=app, service=agenda_bulk_spike_service)
+
+    agenda_bulk_unspike_service = AgendaBulkUnspikeService('agenda_bulk_unspike', backend=superdesk.get_backend())
+    AgendaBulkUnspikeResource('agenda_bulk_unspike', app=app, service=agenda_bulk_unspike_service)
+
     coverage_search_service = CoverageService('coverage', backend=superdesk.get_backend())
     CoverageResource('coverage', app=app, service=coverage_search_service)
 
+    coverage_bulk_service = CoverageBulkService('coverage_bulk', backend=superdesk.get_backend())
+    CoverageBulkResource('coverage_bulk', app=app, service=coverage_bulk_service)
+
+    assignments_service = AssignmentsService('assignments', backend=superdesk.get_backend())
+    AssignmentsResource('assignments', app=app, service=assignments_service)
+
     events_search_service = EventsService('events', backend=superdesk.get_backend())
     EventsResource('events', app=app, service=events_search_service)
 
@@ -66,9 +96,35 @@ def init_app(app):
     events_unspike_service = EventsUnspikeService('events_unspike', backend=superdesk.get_backend())
     EventsUnspikeResource('events_unspike', app=app, service=events_unspike_service)
 
+    events_bulk_spike_service = EventsBulkSpikeService('events_bulk_spike', backend=superdesk.get_backend())
+    EventsBulkSpikeResource('events_bulk_spike', app=app, service=events_bulk_spike_service)
+
+    events_bulk_unspike_service = EventsBulkUnspikeService('events_bulk_unspike', backend=superdesk.get_backend())
+    EventsBulkUnspikeResource('events_bulk_unspike', app=app, service=events_bulk_unspike_service)
+
     locations_search_service = LocationsService('locations', backend=superdesk.get_backend())
     LocationsResource('locations', app=app, service=locations_search_service)
 
+    locations_radius_service = LocationsRadiusService('locations_radius', backend=superdesk.get_backend())
+    LocationsRadiusResource('locations_radius', app=app, service=locations_radius_service)
+
+    locations_bbox_service = LocationsBoundingBoxService('locations_bbox', backend=superdesk.get_backend())
+    LocationsBoundingBoxResource('locations_bbox', app=app, service=locations_bbox_service)
+
+    locations_nearest_service = LocationsNearestService('locations_nearest', backend=superdesk.get_backend())
+    LocationsNearestResource('locations_nearest', app=app, service=locations_nearest_service)
+
+    locations_autocomplete_service = LocationsAutocompleteService('locations_autocomplete',
+                                                                  backend=superdesk.get_backend())
+    LocationsAutocompleteResource('locations_autocomplete', app=app, service=locations_autocomplete_service)
+    set_autocomplete_settings(app.config.setdefault('ELASTICSEARCH_SETTINGS', {}))
+
+    geocode_cache_service = superdesk.Service('geocode_cache', backend=superdesk.get_backend())
+    GeocodeCacheResource('geocode_cache', app=app, service=geocode_cache_service)
+
+    geocode_service = GeocodeService('geocode', backend=superdesk.get_backend())
+    GeocodeResource('geocode', app=app, service=geocode_service)
+
     files_service = EventsFilesService('events_files', backend=superdesk.get_backend())
     EventsFilesResource('events_files', app=app, service=files_service)
 
@@ -98,6 +154,8 @@ def init_app(app):
     app.on_updated_planning_spike += planning_history_service.on_spike
     app.on_updated_planning_unspike += planning_history_service.on_unspike
 
+    set_delete_spiked_schedule(app)
+
     superdesk.privilege(
         name='planning',
         label='Planning',
@@ -159,6 +217,27 @@ def init_app(app):
     )
 
 
+def set_delete_spiked_schedule(app):
+    """Add the deletion of the expired spiked items to the celery beat schedule
+
+    Celery is configured from the app config before the plugins are initialized,
+    so the entry is added to the celery config too.
+    """
+    entry = {
+        'task': 'planning.delete_spiked_items',
+        'schedule': timedelta(minutes=app.config.get('PLANNING_DELETE_SPIKED_SCHEDULE_MINUTES', 30))
+    }
+    app.config.setdefault('CELERYBEAT_SCHEDULE', {})['planning:delete_spiked'] = entry
+    schedule = dict(celery.conf.get('CELERYBEAT_SCHEDULE') or {})
+    schedule['planning:delete_spiked'] = entry
+    celery.conf['CELERYBEAT_SCHEDULE'] = schedule
+
+
+@celery.task(soft_time_limit=600)
+def delete_spiked_items():
+    DeleteSpikedItems().run()
+
+
 register_feeding_service(
     EventFileFeedingService.NAME,
     EventFileFeedingService(),
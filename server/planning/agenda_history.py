@@ -35,11 +35,10 @@ class AgendaHistoryService(HistoryService):
     """Service for keeping track of the history of a planning agenda
     """
 
-    def _save_history(self, agenda, update, operation):
-        history = {
+    def _get_history(self, agenda, update, operation):
+        return {
             'agenda_id': agenda[config.ID_FIELD],
             'user_id': self.get_user_id(),
             'operation': operation,
             'update': self._remove_unwanted_fields(update)
         }
-        self.post([history])
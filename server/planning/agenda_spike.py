@@ -10,10 +10,11 @@
 
 from .agenda import AgendaResource
 from .common import ITEM_EXPIRY, ITEM_STATE, ITEM_SPIKED, ITEM_ACTIVE, set_item_expiry
+from .bulk_spike import bulk_spike_schema, BulkSpikeService, BulkUnspikeService
 from superdesk.services import BaseService
 from superdesk.notification import push_notification
 from apps.auth import get_user
-from superdesk import config
+from superdesk import config, Resource
 
 
 class AgendaSpikeResource(AgendaResource):
@@ -58,3 +59,37 @@ class AgendaUnspikeService(BaseService):
         item = self.backend.update(self.datasource, id, updates, original)
         push_notification('agenda:unspiked', item=str(id), user=str(user.get(config.ID_FIELD)))
         return item
+
+
+class AgendaBulkSpikeResource(Resource):
+    url = 'agenda/bulk_spike'
+    resource_title = endpoint_name = 'agenda_bulk_spike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_agenda_spike'}
+
+
+class AgendaBulkSpikeService(BulkSpikeService):
+    resource = 'agenda'
+    lookup = {'planning_type': 'agenda'}
+    history_service = 'agenda_history'
+    notification = 'agenda:spiked:bulk'
+
+
+class AgendaBulkUnspikeResource(Resource):
+    url = 'agenda/bulk_unspike'
+    resource_title = endpoint_name = 'agenda_bulk_unspike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_agenda_unspike'}
+
+
+class AgendaBulkUnspikeService(BulkUnspikeService):
+    resource = 'agenda'
+    lookup = {'planning_type': 'agenda'}
+    history_service = 'agenda_history'
+    notification = 'agenda:unspiked:bulk'
@@ -0,0 +1,137 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Assignments queue, the coverages assigned to a user or a desk"""
+
+import base64
+import json
+import superdesk
+from bson import ObjectId
+from bson.errors import InvalidId
+from dateutil.parser import parse as parse_date
+from eve.utils import config
+from superdesk.errors import SuperdeskApiError
+from superdesk.utc import utcnow
+from superdesk.utils import ListCursor
+from apps.archive.common import get_user
+from .common import get_collection
+
+SCHEDULED = 'planning.scheduled'
+ASSIGNED_USER = 'planning.assigned_to.user'
+ASSIGNED_DESK = 'planning.assigned_to.desk'
+
+
+class AssignmentsCursor(ListCursor):
+    """Page of the assignments, with the counts of the queue and the cursor of the next page"""
+
+    def __init__(self, docs, counts, next_cursor):
+        """Create the page from its coverages"""
+        super().__init__(docs)
+        self.counts = counts
+        self.next_cursor = next_cursor
+
+    def extra(self, response):
+        response['_counts'] = self.counts
+        response['_next'] = self.next_cursor
+
+
+class AssignmentsService(superdesk.Service):
+    """Get the coverages assigned to the `user` or `desk` given, or to the current user
+
+    The coverages are sorted by their scheduled date, the unscheduled ones first. Pages are fetched
+    with the `_next` cursor of the previous page given as `after`, which uses the compound indexes
+    on the assignee and the scheduled date instead of skipping the previous pages.
+    The counts of the whole queue are given in `_counts`.
+    """
+
+    def get(self, req, lookup):
+        args = getattr(req, 'args', None) or {}
+        query = self.get_assignee_query(args)
+        max_results = getattr(req, 'max_results', None) or 25
+
+        page_query = dict(query)
+        if args.get('after'):
+            page_query.update(get_after_query(*decode_cursor(args['after'])))
+
+        collection = get_collection('coverage')
+        docs = list(collection.find(page_query).sort([(SCHEDULED, 1), (config.ID_FIELD, 1)]).limit(max_results + 1))
+        next_cursor = encode_cursor(docs[max_results - 1]) if len(docs) > max_results else None
+        return AssignmentsCursor(docs[:max_results], get_counts(collection, query), next_cursor)
+
+    def get_assignee_query(self, args):
+        if args.get('user') and args.get('desk'):
+            raise SuperdeskApiError.badRequestError(message='Assignments are for either a user or a desk.')
+
+        if args.get('desk'):
+            return {ASSIGNED_DESK: args['desk']}
+
+        user = args.get('user') or str((get_user() or {}).get(config.ID_FIELD) or '')
+        if not user:
+            raise SuperdeskApiError.badRequestError(message='user or desk is required.')
+        return {ASSIGNED_USER: user}
+
+
+def get_counts(collection, query):
+    """Count the coverages of the queue, by the state of their schedule"""
+    now = utcnow()
+    scheduled = '$' + SCHEDULED
+    result = list(collection.aggregate([
+        {'$match': query},
+        {'$group': {
+            '_id': None,
+            'total': {'$sum': 1},
+            # null and missing dates are lower than any date
+            'unscheduled': {'$sum': {'$cond': [{'$gt': [scheduled, None]}, 0, 1]}},
+            'overdue': {'$sum': {'$cond': [{'$and': [{'$gt': [scheduled, None]}, {'$lt': [scheduled, now]}]}, 1, 0]}},
+        }},
+    ]))
+    counts = result[0] if result else {'total': 0, 'unscheduled': 0, 'overdue': 0}
+    return {
+        'total': counts['total'],
+        'unscheduled': counts['unscheduled'],
+        'overdue': counts['overdue'],
+        'upcoming': counts['total'] - counts['unscheduled'] - counts['overdue'],
+    }
+
+
+def get_after_query(scheduled, _id):
+    """Get the query of the coverages sorted after the given scheduled date and id"""
+    if scheduled is None:
+        return {'$or': [
+            {SCHEDULED: None, config.ID_FIELD: {'$gt': _id}},
+            {SCHEDULED: {'$ne': None}},
+        ]}
+    return {'$or': [
+        {SCHEDULED: scheduled, config.ID_FIELD: {'$gt': _id}},
+        {SCHEDULED: {'$gt': scheduled}},
+    ]}
+
+
+def encode_cursor(doc):
+    scheduled = (doc.get('planning') or {}).get('scheduled')
+    value = [scheduled.isoformat() if scheduled else None, str(doc[config.ID_FIELD])]
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Get the scheduled date and the id of the last coverage of the previous page"""
+    try:
+        scheduled, _id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return (parse_date(scheduled) if scheduled else None), ObjectId(_id)
+    except (ValueError, TypeError, InvalidId):
+        raise SuperdeskApiError.badRequestError(message='Invalid cursor.')
+
+
+class AssignmentsResource(superdesk.Resource):
+    url = 'assignments'
+    schema = {}
+    datasource = {'source': 'coverage'}
+    resource_methods = ['GET']
+    item_methods = []
@@ -0,0 +1,70 @@
+from datetime import timedelta
+from bson import ObjectId
+from eve.utils import ParsedRequest
+from superdesk import get_resource_service
+from superdesk.errors import SuperdeskApiError
+from superdesk.utc import utcnow
+from planning.common import get_collection
+from planning.tests import TestCase
+
+
+def get_request(max_results=2, **args):
+    req = ParsedRequest()
+    req.args = args
+    req.max_results = max_results
+    return req
+
+
+class AssignmentsTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = utcnow().replace(microsecond=0)
+        self.coverages = [
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user1'}}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user1'}, 'scheduled': now - timedelta(days=1)}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user1'}, 'scheduled': now + timedelta(days=1)}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user1'}, 'scheduled': now + timedelta(days=1)}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user1'}, 'scheduled': now + timedelta(days=2)}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'desk': 'desk1'}, 'scheduled': now}},
+            {'_id': ObjectId(), 'planning': {'assigned_to': {'user': 'user2'}, 'scheduled': now}},
+        ]
+
+    def test_get_assignments_by_pages(self):
+        with self.app.app_context():
+            get_collection('coverage').insert_many(self.coverages)
+            service = get_resource_service('assignments')
+
+            ids = []
+            after = None
+            while True:
+                args = {'user': 'user1'}
+                if after:
+                    args['after'] = after
+                cursor = service.get(get_request(**args), {})
+                self.assertTrue(cursor.count() <= 2)
+                ids.extend(doc['_id'] for doc in cursor)
+
+                response = {}
+                cursor.extra(response)
+                self.assertEqual({'total': 5, 'unscheduled': 1, 'overdue': 1, 'upcoming': 3}, response['_counts'])
+                after = response['_next']
+                if not after:
+                    break
+
+            # the coverages scheduled at the same time are sorted by id
+            self.assertEqual([coverage['_id'] for coverage in self.coverages[:5]], ids)
+
+    def test_get_desk_assignments(self):
+        with self.app.app_context():
+            get_collection('coverage').insert_many(self.coverages)
+            cursor = get_resource_service('assignments').get(get_request(desk='desk1'), {})
+            self.assertEqual([self.coverages[5]['_id']], [doc['_id'] for doc in cursor])
+
+    def test_get_assignments_errors(self):
+        with self.app.app_context():
+            service = get_resource_service('assignments')
+            with self.assertRaises(SuperdeskApiError):
+                service.get(get_request(user='user1', desk='desk1'), {})
+            with self.assertRaises(SuperdeskApiError):
+                service.get(get_request(user='user1', after='not a cursor'), {})
@@ -0,0 +1,143 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Superdesk Planning - Bulk Spike"""
+
+import json
+from .common import ITEM_EXPIRY, ITEM_STATE, ITEM_SPIKED, ITEM_ACTIVE, set_item_expiry, bulk_update_items
+from superdesk.services import BaseService
+from superdesk.errors import SuperdeskApiError
+from superdesk.notification import push_notification
+from apps.auth import get_user
+from superdesk import config, get_resource_service
+from eve.utils import ParsedRequest
+
+BULK_RESULT_NOT_FOUND = 'not_found'
+BULK_RESULT_UNCHANGED = 'unchanged'
+
+bulk_spike_schema = {
+    # The items to spike/unspike, either by their ids
+    'ids': {
+        'type': 'list',
+        'schema': {'type': 'string'}
+    },
+    # or by a mongo query (same syntax as the `where` parameter)
+    'query': {
+        'type': 'dict'
+    },
+
+    # The result of the operation for every item, i.e. [{"_id": "id1", "result": "spiked"}]
+    'items': {
+        'type': 'list',
+        'readonly': True
+    }
+}
+
+
+class BulkSpikeService(BaseService):
+    """Provide common methods for spiking or unspiking many items with a single request
+
+    The state and expiry of all the matching items are changed with one bulk update,
+    their history is saved with one write and a single notification is sent for all of them.
+    """
+
+    # Name of the resource the items belong to, i.e. `events`
+    resource = None
+    # Filter applied on top of the ids/query, i.e. to only match agendas in the planning collection
+    lookup = {}
+    # The state the items are moved to, and the name of the operation (`spiked` or `unspiked`)
+    state = ITEM_SPIKED
+    operation = 'spiked'
+    history_service = None
+    notification = None
+
+    def create(self, docs, **kwargs):
+        user = get_user(required=True)
+        ids = []
+        for doc in docs:
+            if not doc.get('ids') and not doc.get('query'):
+                raise SuperdeskApiError.badRequestError(message='Either ids or query is required.')
+
+            doc['items'] = self.update_state(self._get_lookup(doc), doc.get('ids'), doc.get('query'), user)
+            ids.append(len(ids))
+        return ids
+
+    def update_state(self, lookup, ids=None, query=None, user=None):
+        """Change the state of all the items matching the lookup/query
+
+        :param dict lookup: mongo lookup for the items
+        :param list ids: ids requested by the client, used to report the ones not found
+        :param dict query: mongo query from the client, sanitized the same way as the `where` parameter
+        :param dict user: the user performing the operation
+        :return list: per item results
+        """
+        req = ParsedRequest()
+        if query:
+            req.where = json.dumps(query)
+
+        items = list(get_resource_service(self.resource).get_from_mongo(req=req, lookup=lookup))
+        updated = [item for item in items if self.can_update(item)]
+
+        updates = self.get_updates()
+        bulk_update_items(self.resource, [item[config.ID_FIELD] for item in updated], updates)
+
+        if updated:
+            self.on_bulk_updated(updates, updated, user)
+
+        results = {str(item[config.ID_FIELD]): BULK_RESULT_UNCHANGED for item in items}
+        results.update({str(item[config.ID_FIELD]): self.operation for item in updated})
+        for _id in ids or []:
+            results.setdefault(str(_id), BULK_RESULT_NOT_FOUND)
+
+        return [{config.ID_FIELD: _id, 'result': result} for _id, result in results.items()]
+
+    def can_update(self, item):
+        return item.get(ITEM_STATE) != ITEM_SPIKED
+
+    def get_updates(self):
+        updates = {ITEM_STATE: self.state}
+        if self.state == ITEM_SPIKED:
+            set_item_expiry(updates)
+        else:
+            updates[ITEM_EXPIRY] = None
+        return updates
+
+    def on_bulk_updated(self, updates, originals, user=None):
+        """Save the history of the items and notify the clients
+
+        :param dict updates: changes applied to every item
+        :param list originals: the items before they were updated
+        :param dict user: the user performing the operation
+        """
+        history_service = get_resource_service(self.history_service)
+        if self.state == ITEM_SPIKED:
+            history_service.on_items_spiked(updates, originals)
+        else:
+            history_service.on_items_unspiked(updates, originals)
+
+        push_notification(
+            self.notification,
+            items=[str(item[config.ID_FIELD]) for item in originals],
+            user=str((user or {}).get(config.ID_FIELD, ''))
+        )
+
+    def _get_lookup(self, doc):
+        lookup = dict(self.lookup)
+        if doc.get('ids'):
+            lookup[config.ID_FIELD] = {'$in': doc['ids']}
+        return lookup
+
+
+class BulkUnspikeService(BulkSpikeService):
+    state = ITEM_ACTIVE
+    operation = 'unspiked'
+
+    def can_update(self, item):
+        return item.get(ITEM_STATE) == ITEM_SPIKED
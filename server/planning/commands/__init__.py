@@ -0,0 +1,16 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from .delete_spiked_items import DeleteSpikedItems  # noqa
+from .email_idle import EmailIdle  # noqa
+from .ingest_benchmark import IngestBenchmark  # noqa
+from .set_location_address_keys import SetLocationAddressKeys  # noqa
+from .set_location_geo import SetLocationGeo  # noqa
+from .update_locations_mapping import UpdateLocationsMapping  # noqa
@@ -0,0 +1,171 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import time
+import logging
+import superdesk
+from flask import current_app as app
+from eve.utils import config
+from superdesk import get_resource_service
+from superdesk.celery_task_utils import get_lock_id
+from superdesk.lock import lock, unlock
+from superdesk.stats import stats
+from superdesk.utc import utcnow
+from planning.common import ITEM_EXPIRY, ITEM_STATE, ITEM_SPIKED, get_collection, bulk_delete_items, \
+    bulk_index_items
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_MAX_CHUNKS = 50
+DEFAULT_CHUNK_DELAY = 1.0
+
+
+class DeleteSpikedItems(superdesk.Command):
+    """Delete the spiked Events, Planning items and Agendas which have expired.
+
+    Expired items are deleted in chunks of ``PLANNING_DELETE_SPIKED_CHUNK_SIZE`` items, waiting
+    ``PLANNING_DELETE_SPIKED_CHUNK_DELAY`` seconds between two chunks and stopping after
+    ``PLANNING_DELETE_SPIKED_MAX_CHUNKS`` chunks, so a large backlog is purged over several runs
+    without hammering mongo and elastic. Linked coverages, history and files are deleted with them.
+
+    Example:
+    ::
+
+        $ python manage.py planning:delete_spiked
+        $ python manage.py planning:delete_spiked --chunk-size 500 --max-chunks 10
+
+    """
+
+    option_list = [
+        superdesk.Option('--chunk-size', '-c', dest='chunk_size', type=int),
+        superdesk.Option('--max-chunks', '-m', dest='max_chunks', type=int),
+        superdesk.Option('--delay', '-d', dest='delay', type=float),
+    ]
+
+    log_msg = ''
+
+    def run(self, chunk_size=None, max_chunks=None, delay=None):
+        now = utcnow()
+        self.log_msg = 'Expiry Time: {}.'.format(now)
+        logger.info('{} Starting to delete spiked planning items.'.format(self.log_msg))
+
+        chunk_size = chunk_size or app.config.get('PLANNING_DELETE_SPIKED_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        max_chunks = max_chunks or app.config.get('PLANNING_DELETE_SPIKED_MAX_CHUNKS', DEFAULT_MAX_CHUNKS)
+        if delay is None:
+            delay = app.config.get('PLANNING_DELETE_SPIKED_CHUNK_DELAY', DEFAULT_CHUNK_DELAY)
+
+        lock_name = get_lock_id('planning', 'delete_spiked')
+        if not lock(lock_name, expire=610):
+            logger.info('{} Delete spiked items task is already running.'.format(self.log_msg))
+            return
+
+        try:
+            self.delete_spiked_items(now, chunk_size, max_chunks, delay)
+        finally:
+            unlock(lock_name)
+
+        logger.info('{} Completed deleting spiked planning items.'.format(self.log_msg))
+
+    def delete_spiked_items(self, expiry_datetime, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=DEFAULT_MAX_CHUNKS,
+                            delay=0):
+        """Delete the spiked Events, Planning items and Agendas expired before `expiry_datetime`
+
+        :return dict: metrics of the run for each resource
+        """
+        return {
+            'events': self._delete_expired_items('events', {}, expiry_datetime, chunk_size, max_chunks, delay),
+            'planning': self._delete_expired_items('planning', {'planning_type': {'$ne': 'agenda'}},
+                                                   expiry_datetime, chunk_size, max_chunks, delay),
+            'agenda': self._delete_expired_items('agenda', {'planning_type': 'agenda'},
+                                                 expiry_datetime, chunk_size, max_chunks, delay),
+        }
+
+    def _delete_expired_items(self, resource, lookup, expiry_datetime, chunk_size, max_chunks, delay):
+        """Delete the expired spiked items of a resource, one chunk at a time
+
+        :param str resource: name of the resource
+        :param dict lookup: filter for the items of the resource in its collection
+        :param datetime expiry_datetime: items expired before this time are deleted
+        :param int chunk_size: number of items deleted at once
+        :param int max_chunks: maximum number of chunks deleted by this run
+        :param float delay: seconds to wait between two chunks
+        :return dict: metrics for the run, number of items deleted, rate and remaining backlog
+        """
+        query = dict(lookup)
+        query[ITEM_STATE] = ITEM_SPIKED
+        query[ITEM_EXPIRY] = {'$lte': expiry_datetime}
+
+        collection = get_collection(resource)
+        on_delete = getattr(self, '_on_delete_{}'.format(resource))
+        deleted = 0
+        start = time.time()
+
+        for chunk in range(max_chunks):
+            if chunk and delay:
+                time.sleep(delay)
+
+            items = list(collection.find(query, projection={'files': 1}).sort(ITEM_EXPIRY, 1).limit(chunk_size))
+            if not items:
+                break
+
+            ids = [item[config.ID_FIELD] for item in items]
+            # linked items are deleted first, if this fails the parents are still there for the next run
+            on_delete(items, ids)
+            deleted += bulk_delete_items(resource, ids)
+
+            if len(items) < chunk_size:
+                break
+
+        elapsed = time.time() - start
+        metrics = {
+            'deleted': deleted,
+            'seconds': round(elapsed, 3),
+            'items_per_second': round(deleted / elapsed, 2) if elapsed else 0,
+            'backlog': collection.count(query),
+        }
+
+        stats.incr('planning.delete_spiked.{}'.format(resource), deleted)
+        stats.gauge('planning.delete_spiked.{}.backlog'.format(resource), metrics['backlog'])
+        logger.info('{} Deleted {deleted} spiked {resource} items in {seconds}s ({items_per_second} items/s), '
+                    '{backlog} expired items remaining.'.format(self.log_msg, resource=resource, **metrics))
+        return metrics
+
+    def _on_delete_events(self, items, ids):
+        get_resource_service('events_history').delete({'event_id': {'$in': ids}})
+
+        file_ids = [file_id for item in items for file_id in item.get('files') or []]
+        if file_ids:
+            files_service = get_resource_service('events_files')
+            for events_file in files_service.get_from_mongo(req=None, lookup={config.ID_FIELD: {'$in': file_ids}}):
+                if events_file.get('media'):
+                    app.media.delete(events_file['media'])
+            files_service.delete({config.ID_FIELD: {'$in': file_ids}})
+
+    def _on_delete_planning(self, items, ids):
+        get_resource_service('coverage').delete({'planning_item': {'$in': ids}})
+        get_resource_service('planning_history').delete({'planning_id': {'$in': ids}})
+
+        # remove the planning items from the agendas
+        agendas = get_collection('agenda')
+        agenda_ids = [agenda[config.ID_FIELD] for agenda in agendas.find({'planning_items': {'$in': ids}},
+                                                                         projection={config.ID_FIELD: 1})]
+        if agenda_ids:
+            agendas.update_many({config.ID_FIELD: {'$in': agenda_ids}},
+                                {'$pull': {'planning_items': {'$in': ids}}})
+            bulk_index_items('agenda', agenda_ids)
+
+    def _on_delete_agenda(self, items, ids):
+        # Unlike deleting an agenda through the API, the planning items are kept:
+        # spiking an agenda does not spike its planning items
+        get_resource_service('agenda_history').delete({'agenda_id': {'$in': ids}})
+
+
+superdesk.command('planning:delete_spiked', DeleteSpikedItems())
@@ -0,0 +1,80 @@
+from datetime import timedelta
+from bson import ObjectId
+from superdesk import get_resource_service
+from superdesk.celery_app import celery
+from superdesk.utc import utcnow
+from planning.commands import DeleteSpikedItems
+from planning.tests import TestCase
+
+
+class DeleteSpikedItemsTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = utcnow()
+        self.expired = self.now - timedelta(minutes=5)
+        self.not_expired = self.now + timedelta(minutes=5)
+
+    def insert(self, resource, docs):
+        with self.app.app_context():
+            self.app.data.insert(resource, docs)
+
+    def get_ids(self, resource, lookup=None):
+        with self.app.app_context():
+            items = get_resource_service(resource).get_from_mongo(None, lookup or {})
+            return sorted(str(item['_id']) for item in items)
+
+    def test_delete_expired_spiked_items(self):
+        plan_expired, plan_active = ObjectId(), ObjectId()
+        self.insert('events', [
+            {'_id': 'e1', 'name': 'e1', 'state': 'spiked', 'expiry': self.expired},
+            {'_id': 'e2', 'name': 'e2', 'state': 'spiked', 'expiry': self.not_expired},
+            {'_id': 'e3', 'name': 'e3', 'state': 'active', 'expiry': self.expired},
+        ])
+        self.insert('planning', [
+            {'_id': plan_expired, 'slugline': 'p1', 'state': 'spiked', 'expiry': self.expired},
+            {'_id': plan_active, 'slugline': 'p2', 'state': 'active'},
+        ])
+        self.insert('agenda', [
+            {'name': 'a1', 'planning_type': 'agenda', 'planning_items': [plan_expired, plan_active]},
+        ])
+        self.insert('coverage', [
+            {'planning_item': plan_expired},
+            {'planning_item': plan_active},
+        ])
+        self.insert('events_history', [{'event_id': 'e1', 'operation': 'spiked'}])
+
+        with self.app.app_context():
+            metrics = DeleteSpikedItems().delete_spiked_items(self.now, chunk_size=1, max_chunks=10)
+
+            self.assertEqual(1, metrics['events']['deleted'])
+            self.assertEqual(0, metrics['events']['backlog'])
+            self.assertEqual(1, metrics['planning']['deleted'])
+            self.assertEqual(0, metrics['agenda']['deleted'])
+
+            agenda = get_resource_service('agenda').find_one(req=None, name='a1')
+            self.assertEqual([plan_active], agenda['planning_items'])
+            coverages = list(get_resource_service('coverage').get_from_mongo(None, {}))
+            self.assertEqual([plan_active], [coverage['planning_item'] for coverage in coverages])
+            self.assertEqual(0, get_resource_service('events_history').get_from_mongo(None, {}).count())
+
+        self.assertEqual(['e2', 'e3'], self.get_ids('events'))
+        self.assertEqual([str(plan_active)], self.get_ids('planning', {'planning_type': {'$ne': 'agenda'}}))
+
+    def test_max_chunks_leaves_a_backlog(self):
+        self.insert('events', [
+            {'_id': 'e{}'.format(i), 'name': 'e', 'state': 'spiked', 'expiry': self.expired} for i in range(5)
+        ])
+
+        with self.app.app_context():
+            metrics = DeleteSpikedItems().delete_spiked_items(self.now, chunk_size=2, max_chunks=2)
+
+        self.assertEqual(4, metrics['events']['deleted'])
+        self.assertEqual(1, metrics['events']['backlog'])
+        self.assertEqual(1, len(self.get_ids('events')))
+
+    def test_beat_schedule(self):
+        schedule = celery.conf['CELERYBEAT_SCHEDULE']
+        self.assertIn('planning:delete_spiked', schedule)
+        self.assertEqual('planning.delete_spiked_items', schedule['planning:delete_spiked']['task'])
+        self.assertEqual(timedelta(minutes=30), schedule['planning:delete_spiked']['schedule'])
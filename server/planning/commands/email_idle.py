@@ -0,0 +1,123 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import logging
+import threading
+import superdesk
+from flask import current_app as app
+from superdesk import get_resource_service
+from superdesk.io.commands.update_ingest import update_provider, is_closed, get_provider_rule_set, \
+    get_provider_routing_scheme, get_task_ttl
+from planning.feeding_services.event_email_service import EventEmailFeedingService, IMAPSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 25 * 60
+DEFAULT_MIN_BACKOFF = 5
+DEFAULT_MAX_BACKOFF = 300
+
+
+class EmailIdle(superdesk.Command):
+    """Ingest event emails as soon as they arrive, using IMAP IDLE.
+
+    A connection is kept open to the mailbox of every event email provider, waiting for new messages
+    with the IDLE command. When a message arrives the update of the provider is queued straight away
+    instead of waiting for the next scheduled update. Lost connections are opened again, waiting
+    ``PLANNING_EMAIL_IDLE_MIN_BACKOFF`` seconds at first and up to ``PLANNING_EMAIL_IDLE_MAX_BACKOFF``
+    seconds after consecutive failures. Providers whose server does not support IDLE are only
+    updated by the scheduled updates.
+
+    Example:
+    ::
+
+        $ python manage.py planning:email_idle
+        $ python manage.py planning:email_idle --provider "Events mailbox"
+
+    """
+
+    option_list = [
+        superdesk.Option('--provider', '-p', dest='provider_name'),
+    ]
+
+    def __init__(self):
+        """Create the command, the watchers are started by `run`"""
+        super().__init__()
+        self.stopped = threading.Event()
+
+    def run(self, provider_name=None):
+        lookup = {'feeding_service': EventEmailFeedingService.NAME}
+        if provider_name:
+            lookup['name'] = provider_name
+
+        providers = [provider for provider in get_resource_service('ingest_providers').get(req=None, lookup=lookup)
+                     if not is_closed(provider)]
+        if not providers:
+            logger.info('No event email provider to watch.')
+            return
+
+        threads = [threading.Thread(target=self.watch, args=(app._get_current_object(), provider), daemon=True)
+                   for provider in providers]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stopped.set()
+
+    def watch(self, flask_app, provider):
+        """Wait for new messages of a provider until stopped, opening the connection again when it is lost"""
+        with flask_app.app_context():
+            timeout = app.config.get('PLANNING_EMAIL_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+            min_backoff = app.config.get('PLANNING_EMAIL_IDLE_MIN_BACKOFF', DEFAULT_MIN_BACKOFF)
+            max_backoff = app.config.get('PLANNING_EMAIL_IDLE_MAX_BACKOFF', DEFAULT_MAX_BACKOFF)
+            backoff = min_backoff
+
+            while not self.stopped.is_set():
+                session = IMAPSession(provider)
+                try:
+                    imap = session.get_connection()
+                    if not session.supports_idle():
+                        logger.warning('IMAP server of provider {} does not support IDLE, '
+                                       'it is only updated by the scheduled updates.'.format(provider.get('name')))
+                        return
+
+                    imap.select(provider.get('config', {}).get('mailbox', None), readonly=True)
+                    backoff = min_backoff
+                    while not self.stopped.is_set():
+                        if session.idle(timeout):
+                            self.on_new_messages(provider)
+                except Exception as ex:
+                    logger.warning('IDLE connection of provider {} lost ({}), connecting again in {}s.'.format(
+                        provider.get('name'), ex, backoff))
+                    self.stopped.wait(backoff)
+                    backoff = min(backoff * 2, max_backoff)
+                finally:
+                    session.logout()
+
+    def on_new_messages(self, provider):
+        """Queue the update of the provider, skipped by `update_provider` if one is already running"""
+        logger.info('New messages for provider {}, updating it.'.format(provider.get('name')))
+        # the provider is fetched again for its last sync state
+        provider = get_resource_service('ingest_providers').find_one(req=None, _id=provider['_id'])
+        if not provider or is_closed(provider):
+            return
+
+        kwargs = {
+            'provider': provider,
+            'rule_set': get_provider_rule_set(provider),
+            'routing_scheme': get_provider_routing_scheme(provider)
+        }
+        update_provider.apply_async(expires=get_task_ttl(provider), kwargs=kwargs)
+
+
+superdesk.command('planning:email_idle', EmailIdle())
@@ -0,0 +1,53 @@
+import imaplib
+from mock import patch
+from planning.commands import EmailIdle
+from planning.tests import TestCase
+from planning.commands.local_imap import LocalIMAP
+
+
+class EmailIdleTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = {'_id': 'p1', 'name': 'events', 'config': {'server': 'localhost', 'mailbox': 'INBOX'}}
+
+    def test_watch_backoff(self):
+        command = EmailIdle()
+        delays = []
+
+        def wait(delay):
+            delays.append(delay)
+            if len(delays) == 4:
+                command.stopped.set()
+
+        with patch.object(imaplib, 'IMAP4_SSL', side_effect=OSError('connection refused')), \
+                patch.object(command.stopped, 'wait', wait):
+            self.app.config['PLANNING_EMAIL_IDLE_MAX_BACKOFF'] = 30
+            command.watch(self.app, self.provider)
+
+        self.assertEqual([5, 10, 20, 30], delays)
+
+    def test_watch_without_idle(self):
+        imap = LocalIMAP()
+        imap.capabilities = ('IMAP4REV1',)
+        command = EmailIdle()
+        with patch.object(imaplib, 'IMAP4_SSL', imap), patch.object(command, 'on_new_messages') as on_new_messages:
+            command.watch(self.app, self.provider)
+
+        self.assertFalse(on_new_messages.called)
+        self.assertEqual(('LOGOUT',), imap.commands[-1])
+
+    @patch('planning.feeding_services.event_email_service.wait_for_data', lambda imap, timeout: bool(imap.lines))
+    def test_watch_new_messages(self):
+        imap = LocalIMAP()
+        command = EmailIdle()
+
+        def on_new_messages(provider):
+            command.stopped.set()
+
+        imap.add_message('Subject: event\n\nhello')
+        imap.select = lambda *args, **kwargs: ('OK', [b'1'])
+        with patch.object(imaplib, 'IMAP4_SSL', imap), patch.object(command, 'on_new_messages', on_new_messages):
+            command.watch(self.app, self.provider)
+
+        self.assertTrue(command.stopped.is_set())
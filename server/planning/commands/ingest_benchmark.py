@@ -0,0 +1,278 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import datetime
+import http.server
+import io
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from xml.sax.saxutils import escape
+
+import superdesk
+from superdesk.utc import utcnow
+from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
+from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
+from planning.feeding_services.event_file_service import EventFileFeedingService
+from planning.feeding_services.event_http_service import EventHTTPFeedingService
+from planning.feeding_services.event_email_service import EventEmailFeedingService
+from planning.commands.local_imap import LocalIMAP
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = '10,1000,10000'
+FORMATS = ('ics', 'xml')
+TARGETS = ('parser', 'file', 'http', 'email')
+FEED_PARSERS = {'ics': 'ics20', 'xml': 'ntb_event_xml'}
+EXTENSIONS = {'ics': '.ics', 'xml': '.xml'}
+CONTENT_TYPES = {'ics': 'text/calendar', 'xml': 'text/xml'}
+
+#: Number of events in every message of the email benchmark
+EVENTS_PER_MESSAGE = 1000
+
+
+class IngestBenchmark(superdesk.Command):
+    """Measure the throughput of the event parsers and feeding services.
+
+    Synthetic ics calendars (with recurring rules, attendees and geo positions) and NTB xml exports
+    are generated for every size, then parsed by the parsers and ingested by the file, http and
+    email feeding services, using a temporary directory, a local http server and an in-memory
+    mailbox. The items are checked against the ingested events but not saved.
+
+    For every run, the events per second, the 95th percentile of the time taken by every batch
+    and the peak resident memory of the run are logged. Every run is done in a forked process where
+    fork is available, so its peak memory is not the one of the previous runs.
+
+    Example:
+    ::
+
+        $ python manage.py planning:ingest_benchmark
+        $ python manage.py planning:ingest_benchmark --sizes 10,100000 --formats ics --targets parser,file
+
+    """
+
+    option_list = [
+        superdesk.Option('--sizes', '-s', dest='sizes', default=DEFAULT_SIZES),
+        superdesk.Option('--formats', '-f', dest='formats', default=','.join(FORMATS)),
+        superdesk.Option('--targets', '-t', dest='targets', default=','.join(TARGETS)),
+    ]
+
+    def run(self, sizes=DEFAULT_SIZES, formats=None, targets=None):
+        formats = [name for name in (formats or ','.join(FORMATS)).split(',') if name in FORMATS]
+        targets = [name for name in (targets or ','.join(TARGETS)).split(',') if name in TARGETS]
+
+        results = []
+        for size in [int(size) for size in sizes.split(',')]:
+            for name in formats:
+                for target in targets:
+                    result = run_isolated(target, name, size)
+                    logger.info('Ingest benchmark {format} {target} {size}: {seconds:.2f}s, '
+                                '{events_per_second:.0f} events/s, p95 batch {p95_batch_ms:.1f}ms, '
+                                'peak RSS {peak_rss_mb:.1f}MB'.format(**result))
+                    results.append(result)
+        return results
+
+
+def run_isolated(target, name, size):
+    """Run a benchmark in a forked process, so the peak memory reported is the one of this run only
+
+    The runs are done in this process where fork is not available.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return run_benchmark(target, name, size)
+
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(run_benchmark, (target, name, size))
+
+
+def run_benchmark(target, name, size):
+    """Generate a corpus of `size` events in the `name` format and ingest it with `target`
+
+    :param str target: `parser`, `file`, `http` or `email`
+    :param str name: `ics` or `xml`
+    :param int size: number of events
+    :return dict: the measures of the run
+    """
+    path = tempfile.mkdtemp()
+    try:
+        corpus = os.path.join(path, 'corpus' + EXTENSIONS[name])
+        with open(corpus, 'wb') as f:
+            write_corpus(name, f, size)
+
+        runner = {'parser': parse_corpus, 'file': ingest_file, 'http': ingest_http, 'email': ingest_email}[target]
+        start = time.time()
+        events, durations = measure_batches(runner(name, corpus, size))
+        seconds = time.time() - start
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    return {
+        'format': name,
+        'target': target,
+        'size': size,
+        'events': events,
+        'seconds': seconds,
+        'events_per_second': events / seconds if seconds else 0,
+        'p95_batch_ms': get_percentile(durations, 95) * 1000,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure_batches(batches):
+    """Consume the batches, timing every one of them
+
+    :return tuple: number of events and list of the seconds taken by every batch
+    """
+    events = 0
+    durations = []
+    start = time.time()
+    for items in batches:
+        events += len(items)
+        now = time.time()
+        durations.append(now - start)
+        start = now
+    return events, durations
+
+
+def get_percentile(values, percentile):
+    """Get the nearest-rank percentile of the values"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
+
+
+def get_provider(name, **config):
+    return {'name': 'benchmark', 'feed_parser': FEED_PARSERS[name], 'config': config}
+
+
+def parse_corpus(name, corpus, size):
+    parser = IcsTwoFeedParser() if name == 'ics' else NTBEventXMLFeedParser()
+    with open(corpus, 'rb') as f:
+        yield from parser.parse_stream(f, get_provider(name))
+
+
+def ingest_file(name, corpus, size):
+    path = os.path.join(os.path.dirname(corpus), 'drop')
+    os.mkdir(path)
+    shutil.copy(corpus, path)
+    yield from EventFileFeedingService()._update(get_provider(name, path=path), {})
+
+
+def ingest_http(name, corpus, size):
+    handler = type('CorpusHandler', (http.server.SimpleHTTPRequestHandler,), {
+        'log_message': lambda self, *args: None,
+        'translate_path': lambda self, path: corpus,
+    })
+    server = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/corpus{}'.format(server.server_port, EXTENSIONS[name])
+        yield from EventHTTPFeedingService()._update(get_provider(name, url=url), {})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def ingest_email(name, corpus, size):
+    imap = LocalIMAP()
+    for index in range(0, size, EVENTS_PER_MESSAGE):
+        attachment = generate_corpus(name, min(EVENTS_PER_MESSAGE, size - index), start=index)
+        message = MIMEMultipart()
+        message['Subject'] = 'Events {}'.format(index)
+        part = MIMEApplication(attachment, _subtype=CONTENT_TYPES[name].split('/')[1])
+        part.replace_header('Content-Type', CONTENT_TYPES[name])
+        part.add_header('Content-Disposition', 'attachment', filename='events' + EXTENSIONS[name])
+        message.attach(part)
+        imap.add_message(message.as_bytes())
+
+    provider = get_provider(name, server='localhost', user='benchmark', password='', mailbox='INBOX',
+                            filter='(UNSEEN)')
+    yield from EventEmailFeedingService(imap_class=imap)._update(provider, {})
+
+
+def write_corpus(name, f, count, start=0):
+    """Write a synthetic corpus of `count` events to a file opened in binary mode"""
+    writer = write_ics if name == 'ics' else write_ntb_xml
+    writer(f, count, start)
+
+
+def generate_corpus(name, count, start=0):
+    """Get a synthetic corpus of `count` events as bytes"""
+    f = io.BytesIO()
+    write_corpus(name, f, count, start)
+    return f.getvalue()
+
+
+def write_ics(f, count, start=0):
+    """Write a calendar of `count` future events, every 10th one being recurring
+
+    Every event has two attendees and a geo position.
+    """
+    first = utcnow().replace(microsecond=0) + datetime.timedelta(days=1)
+    stamp = first.strftime('%Y%m%dT%H%M%SZ')
+    f.write(b'BEGIN:VCALENDAR\r\nPRODID:-//Superdesk//Planning benchmark//EN\r\nVERSION:2.0\r\n')
+    for index in range(start, start + count):
+        event_start = first + datetime.timedelta(hours=index)
+        lines = [
+            'BEGIN:VEVENT',
+            'DTSTART:{}'.format(event_start.strftime('%Y%m%dT%H%M%SZ')),
+            'DTEND:{}'.format((event_start + datetime.timedelta(hours=1)).strftime('%Y%m%dT%H%M%SZ')),
+            'DTSTAMP:{}'.format(stamp),
+            'UID:benchmark-{}@superdesk'.format(index),
+            'CREATED:{}'.format(stamp),
+            'LAST-MODIFIED:{}'.format(stamp),
+            'SUMMARY:Benchmark event {}'.format(index),
+            'DESCRIPTION:Synthetic event {} generated for the ingest benchmark'.format(index),
+            'LOCATION:Venue {}\\, Oslo'.format(index % 100),
+            'GEO:{:.6f};{:.6f}'.format(59.9 + (index % 100) / 1000, 10.7 + (index % 100) / 1000),
+            'ORGANIZER;CN=Organizer:mailto:organizer@example.com',
+            'ATTENDEE;CN=First attendee:mailto:first{}@example.com'.format(index),
+            'ATTENDEE;CN=Second attendee:mailto:second{}@example.com'.format(index),
+        ]
+        if not index % 10:
+            lines.append('RRULE:FREQ=WEEKLY;COUNT=4')
+        lines.append('END:VEVENT')
+        f.write(('\r\n'.join(lines) + '\r\n').encode('utf-8'))
+    f.write(b'END:VCALENDAR\r\n')
+
+
+def write_ntb_xml(f, count, start=0):
+    """Write an NTB xml export of `count` events, with a geo position for every event"""
+    first = utcnow().replace(microsecond=0, tzinfo=None) + datetime.timedelta(days=1)
+    f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<events>\n')
+    for index in range(start, start + count):
+        event_start = first + datetime.timedelta(hours=index)
+        f.write((
+            '<event><guid>benchmark-{index}</guid><title>Benchmark event {index}</title>'
+            '<location>{location}</location><timeStart>{start}</timeStart><timeEnd>{end}</timeEnd>'
+            '<content>Synthetic event {index} generated for the ingest benchmark</content>'
+            '<geo><latitude>{latitude:.6f}</latitude><longitude>{longitude:.6f}</longitude></geo></event>\n'
+        ).format(
+            index=index,
+            location=escape('Venue {} & co, Oslo'.format(index % 100)),
+            start=event_start.isoformat(),
+            end=(event_start + datetime.timedelta(hours=1)).isoformat(),
+            latitude=59.9 + (index % 100) / 1000,
+            longitude=10.7 + (index % 100) / 1000,
+        ).encode('utf-8'))
+    f.write(b'</events>\n')
+
+
+superdesk.command('planning:ingest_benchmark', IngestBenchmark())
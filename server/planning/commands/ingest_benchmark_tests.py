@@ -0,0 +1,41 @@
+import io
+from planning.commands.ingest_benchmark import IngestBenchmark, generate_corpus, run_benchmark, get_percentile
+from planning.feed_parsers.ics_2_0 import iter_vevents
+from planning.feed_parsers.ntb_event_xml import iter_events
+from planning.tests import TestCase
+
+
+class IngestBenchmarkTestCase(TestCase):
+
+    def test_generate_ics(self):
+        with self.app.app_context():
+            events = list(iter_vevents(io.BytesIO(generate_corpus('ics', 20))))
+        self.assertEqual(20, len(events))
+        self.assertEqual(2, len([event for event in events if event.get('rrule')]))
+        self.assertEqual(2, len(events[0].get('attendee')))
+        self.assertIsNotNone(events[0].get('geo'))
+
+    def test_generate_ntb_xml(self):
+        with self.app.app_context():
+            corpus = generate_corpus('xml', 20, start=100)
+        guids = [element.find('guid').text for element in iter_events(io.BytesIO(corpus))]
+        self.assertEqual(['benchmark-{}'.format(index) for index in range(100, 120)], guids)
+
+    def test_run_benchmark(self):
+        with self.app.app_context():
+            for target in ('parser', 'file', 'http', 'email'):
+                result = run_benchmark(target, 'xml', 10)
+                self.assertEqual(10, result['events'], target)
+                self.assertTrue(result['events_per_second'] > 0)
+                self.assertTrue(result['peak_rss_mb'] > 0)
+
+    def test_run(self):
+        with self.app.app_context():
+            results = IngestBenchmark().run(sizes='5,10', formats='xml', targets='parser')
+        self.assertEqual([5, 10], [result['events'] for result in results])
+        self.assertTrue(all(result['peak_rss_mb'] > 0 for result in results))
+
+    def test_get_percentile(self):
+        self.assertEqual(0, get_percentile([], 95))
+        self.assertEqual(95, get_percentile(list(range(1, 101)), 95))
+        self.assertEqual(3, get_percentile([3, 1, 2], 95))
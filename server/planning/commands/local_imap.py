@@ -0,0 +1,227 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""A local stand-in for :class:`imaplib.IMAP4_SSL`, used by the ingest benchmark and the tests of the email services
+
+It keeps the messages of a single mailbox in memory and answers the commands used by the
+feeding services (UID SEARCH/FETCH/STORE) with the same data structures as imaplib.
+The commands sent are recorded in `commands` so the tests can check the round trips.
+IDLE is answered through `send` and `readline`, reporting the messages added since the last SELECT.
+"""
+
+import email
+import email.utils
+import re
+from collections import OrderedDict
+from email.message import Message
+
+
+class LocalIMAP:
+    """In memory mailbox answering like an `imaplib.IMAP4_SSL` connection"""
+
+    def __init__(self, messages=None, uidvalidity=1):
+        """Create the mailbox with the given messages, as bytes, str or `email.message.Message`"""
+        self.uidvalidity = uidvalidity
+        self.messages = OrderedDict()
+        self.next_uid = 1
+        self.commands = []
+        self.untagged = {}
+        self.capabilities = ('IMAP4REV1', 'IDLE')
+        self.lines = []
+        self.new_messages = False
+        for message in messages or []:
+            self.add_message(message)
+
+    def __call__(self, *args, **kwargs):
+        """Allow the instance to replace the `IMAP4_SSL` class"""
+        return self
+
+    def add_message(self, message, flags=None):
+        if isinstance(message, bytes):
+            message = email.message_from_bytes(message)
+        elif not isinstance(message, Message):
+            message = email.message_from_string(message)
+
+        uid = self.next_uid
+        self.next_uid += 1
+        self.messages[uid] = {'message': message, 'flags': set(flags or [])}
+        self.new_messages = True
+        return uid
+
+    def login(self, user, password):
+        self.commands.append(('LOGIN', user))
+        return 'OK', [b'Logged in']
+
+    def select(self, mailbox='INBOX', readonly=False):
+        self.commands.append(('SELECT', mailbox))
+        self.untagged['UIDVALIDITY'] = [str(self.uidvalidity).encode()]
+        self.new_messages = False
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, self.untagged.pop(code.upper(), [None])
+
+    def noop(self):
+        return 'OK', [b'NOOP completed']
+
+    def close(self):
+        self.commands.append(('CLOSE',))
+        return 'OK', [b'Closed']
+
+    def logout(self):
+        self.commands.append(('LOGOUT',))
+        return 'BYE', [b'Logging out']
+
+    def _new_tag(self):
+        return b'LOCAL1'
+
+    def send(self, data):
+        command = data.split()[-1].decode()
+        self.commands.append((command,))
+        if command == 'IDLE':
+            self.lines.append(b'+ idling')
+            if self.new_messages:
+                self.lines.append('* {} EXISTS'.format(len(self.messages)).encode())
+                self.new_messages = False
+        elif command == 'DONE':
+            self.lines.append(self._new_tag() + b' OK IDLE terminated')
+
+    def readline(self):
+        return self.lines.pop(0) + b'\r\n' if self.lines else b''
+
+    def uid(self, command, *args):
+        command = command.upper()
+        self.commands.append((command,) + args)
+        return getattr(self, '_uid_{}'.format(command.lower()))(*args)
+
+    def _uid_search(self, *criteria):
+        tokens = ' '.join(c for c in criteria if c).replace('(', ' ').replace(')', ' ').upper().split()
+        uids = list(self.messages)
+        while tokens:
+            token = tokens.pop(0)
+            if token == 'UID':
+                uid_set = self._get_uids(tokens.pop(0))
+                uids = [uid for uid in uids if uid in uid_set]
+            elif token == 'UNSEEN':
+                uids = [uid for uid in uids if '\\Seen' not in self.messages[uid]['flags']]
+            elif token == 'SEEN':
+                uids = [uid for uid in uids if '\\Seen' in self.messages[uid]['flags']]
+        return 'OK', [' '.join(str(uid) for uid in uids).encode()]
+
+    def _uid_fetch(self, uid_set, items):
+        names = items.strip('()').split()
+        data = []
+        for seq, uid in enumerate(self.messages, 1):
+            if uid not in self._get_uids(uid_set):
+                continue
+
+            message = self.messages[uid]['message']
+            line = '{} (UID {}'.format(seq, uid).encode()
+            literals = []
+            for name in names:
+                name = name.upper()
+                if name == 'BODYSTRUCTURE':
+                    line += b' BODYSTRUCTURE ' + get_bodystructure(message).encode()
+                elif name == 'FLAGS':
+                    line += ' FLAGS ({})'.format(' '.join(sorted(self.messages[uid]['flags']))).encode()
+                else:
+                    if name == 'RFC822':
+                        content = message.as_bytes()
+                    else:
+                        match = re.match(r'BODY(?:\.PEEK)?\[(.*)\](?:<(\d+)\.(\d+)>)?', name)
+                        content = get_part_content(message, match.group(1))
+                        name = 'BODY[{}]'.format(match.group(1))
+                        if match.group(2):
+                            start = int(match.group(2))
+                            content = content[start:start + int(match.group(3))]
+                            name += '<{}>'.format(start)
+                    literals.append((line + ' {} {{{}}}'.format(name, len(content)).encode(), content))
+                    line = b''
+
+            line += b')'
+            if literals:
+                data.extend(literals)
+                data.append(line)
+            else:
+                data.append(line)
+        return 'OK', data
+
+    def _uid_store(self, uid_set, command, flags):
+        data = []
+        for uid in self._get_uids(uid_set):
+            if uid in self.messages:
+                self.messages[uid]['flags'].update(flags.strip('()').split())
+                data.append('{} (UID {} FLAGS ({}))'.format(
+                    uid, uid, ' '.join(sorted(self.messages[uid]['flags']))).encode())
+        return 'OK', data
+
+    def _get_uids(self, uid_set):
+        last = max(self.messages) if self.messages else 0
+        uids = set()
+        for item in uid_set.split(','):
+            start, _, end = item.partition(':')
+            start = last if start == '*' else int(start)
+            end = start if not end else (last if end == '*' else int(end))
+            uids.update(range(min(start, end), max(start, end) + 1))
+        return uids
+
+
+def get_part(message, part):
+    for index in part.split('.'):
+        if message.is_multipart():
+            message = message.get_payload()[int(index) - 1]
+    return message
+
+
+def get_part_content(message, part):
+    payload = get_part(message, part).get_payload()
+    return payload.encode('utf-8') if isinstance(payload, str) else b''
+
+
+def get_bodystructure(message):
+    """Get the BODYSTRUCTURE of a message, message/rfc822 parts are described as any other single part"""
+    if message.is_multipart():
+        parts = ''.join(get_bodystructure(part) for part in message.get_payload())
+        params = get_params(message.get_params()[1:])
+        return '({} {} {} NIL NIL NIL)'.format(parts, quote(message.get_content_subtype()), params)
+
+    payload = message.get_payload()
+    fields = [
+        quote(message.get_content_maintype()),
+        quote(message.get_content_subtype()),
+        get_params(message.get_params()[1:] if message.get_params() else []),
+        quote(message.get('Content-ID')),
+        quote(message.get('Content-Description')),
+        quote(message.get('Content-Transfer-Encoding', '7bit')),
+        str(len(payload)),
+    ]
+    if message.get_content_maintype() == 'text':
+        fields.append(str(payload.count('\n') + 1))
+
+    disposition = 'NIL'
+    if message.get('Content-Disposition'):
+        params = message.get_params(header='Content-Disposition')
+        disposition = '({} {})'.format(quote(params[0][0]), get_params(params[1:]))
+
+    fields.extend(['NIL', disposition, 'NIL', 'NIL'])
+    return '({})'.format(' '.join(fields))
+
+
+def get_params(params):
+    if not params:
+        return 'NIL'
+    return '({})'.format(' '.join('{} {}'.format(quote(key), quote(email.utils.collapse_rfc2231_value(value)))
+                                  for key, value in params))
+
+
+def quote(value):
+    if value is None:
+        return 'NIL'
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
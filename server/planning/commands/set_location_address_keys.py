@@ -0,0 +1,65 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import logging
+import superdesk
+from eve.utils import config
+from pymongo.errors import DuplicateKeyError
+from planning.common import get_collection, bulk_index_items
+from planning.locations import ADDRESS_KEY_FIELD, get_address_key
+
+logger = logging.getLogger(__name__)
+
+#: Number of locations indexed again with one bulk request
+CHUNK_SIZE = 500
+
+
+class SetLocationAddressKeys(superdesk.Command):
+    """Set the address key of the locations created before the keys were added.
+
+    New locations are matched against the existing ones by their address key, so the locations
+    without key would still get duplicates. The locations are processed in their created order:
+    of the existing locations with the same address, the oldest one gets the key and the others
+    are logged to be merged by hand.
+
+    Example:
+    ::
+
+        $ python manage.py planning:set_location_address_keys
+
+    """
+
+    def run(self):
+        collection = get_collection('locations')
+        ids = []
+        duplicates = 0
+        for doc in collection.find({ADDRESS_KEY_FIELD: {'$exists': False}}).sort(config.DATE_CREATED, 1):
+            key = get_address_key(doc)
+            if not key:
+                continue
+
+            try:
+                collection.update_one({config.ID_FIELD: doc[config.ID_FIELD]}, {'$set': {ADDRESS_KEY_FIELD: key}})
+            except DuplicateKeyError:
+                duplicates += 1
+                logger.warning('Location {} ({}) has the address of another location.'.format(
+                    doc.get('name'), doc[config.ID_FIELD]))
+                continue
+
+            ids.append(doc[config.ID_FIELD])
+            if len(ids) % CHUNK_SIZE == 0:
+                bulk_index_items('locations', ids[-CHUNK_SIZE:])
+
+        bulk_index_items('locations', ids[len(ids) - len(ids) % CHUNK_SIZE:])
+        logger.info('Set the address key of {} locations, {} duplicates.'.format(len(ids), duplicates))
+        return {'updated': len(ids), 'duplicates': duplicates}
+
+
+superdesk.command('planning:set_location_address_keys', SetLocationAddressKeys())
@@ -0,0 +1,31 @@
+from planning.commands import SetLocationAddressKeys
+from planning.common import get_collection
+from planning.locations import get_address_key
+from planning.tests import TestCase
+
+
+class SetLocationAddressKeysTestCase(TestCase):
+
+    def test_set_address_keys(self):
+        with self.app.app_context():
+            collection = get_collection('locations')
+            # as created for the locations resource
+            collection.create_index([('address_key', 1)], unique=True,
+                                    partialFilterExpression={'address_key': {'$type': 'string'}})
+            collection.insert_many([
+                {'_id': 'first', 'name': 'Stortinget', '_created': 1},
+                {'_id': 'duplicate', 'name': 'stortinget', '_created': 2},
+                {'_id': 'unnamed', 'name': ' ', '_created': 3},
+                {'_id': 'keyed', 'name': 'Karl Johans gate 22', 'address_key': 'key', '_created': 4},
+            ])
+
+            result = SetLocationAddressKeys().run()
+
+            self.assertEqual({'updated': 1, 'duplicates': 1}, result)
+            keys = {doc['_id']: doc.get('address_key') for doc in collection.find()}
+            self.assertEqual({
+                'first': get_address_key({'name': 'Stortinget'}),
+                'duplicate': None,
+                'unnamed': None,
+                'keyed': 'key',
+            }, keys)
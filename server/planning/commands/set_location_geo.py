@@ -0,0 +1,62 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import logging
+import superdesk
+from flask import current_app as app
+from eve.utils import config
+from planning.common import get_collection, bulk_index_items
+from planning.locations import GEO_FIELD, get_geo_point, locations_schema
+
+logger = logging.getLogger(__name__)
+
+#: Number of locations indexed again with one bulk request
+CHUNK_SIZE = 500
+
+
+class SetLocationGeo(superdesk.Command):
+    """Set the geo point of the locations created before the geo searches were added.
+
+    The radius, bounding box and nearest searches match the ``geo`` field, which is only set
+    when a location is saved. The ``geo_point`` mapping is added to the existing locations index,
+    then the ``geo`` field is set from the position of the locations without it, which are
+    indexed again.
+
+    Example:
+    ::
+
+        $ python manage.py planning:set_location_geo
+
+    """
+
+    def run(self):
+        search_backend = app.data._search_backend('locations')
+        es_args = search_backend._es_args('locations')
+        search_backend.elastic('locations').indices.put_mapping(
+            index=es_args['index'], doc_type=es_args['doc_type'],
+            body={es_args['doc_type']: {'properties': {GEO_FIELD: locations_schema[GEO_FIELD]['mapping']}}})
+
+        collection = get_collection('locations')
+        ids = []
+        for doc in collection.find({GEO_FIELD: None, 'position': {'$ne': None}}, {'position': 1}):
+            geo = get_geo_point(doc['position'])
+            if geo is None:
+                continue
+
+            collection.update_one({config.ID_FIELD: doc[config.ID_FIELD]}, {'$set': {GEO_FIELD: geo}})
+            ids.append(doc[config.ID_FIELD])
+
+        for start in range(0, len(ids), CHUNK_SIZE):
+            bulk_index_items('locations', ids[start:start + CHUNK_SIZE])
+        logger.info('Set the geo point of {} locations.'.format(len(ids)))
+        return len(ids)
+
+
+superdesk.command('planning:set_location_geo', SetLocationGeo())
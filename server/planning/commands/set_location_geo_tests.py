@@ -0,0 +1,31 @@
+from mock import MagicMock, patch
+from planning.commands import SetLocationGeo
+from planning.common import get_collection
+from planning.tests import TestCase
+
+
+class SetLocationGeoTestCase(TestCase):
+
+    @patch('planning.commands.set_location_geo.bulk_index_items')
+    def test_set_geo(self, bulk_index_items):
+        search_backend = MagicMock()
+        search_backend._es_args.return_value = {'index': 'sptest', 'doc_type': 'locations'}
+        es = search_backend.elastic.return_value
+        with self.app.app_context():
+            collection = get_collection('locations')
+            collection.insert_many([
+                {'_id': 'old', 'name': 'Oslo', 'position': {'latitude': 59.91, 'longitude': 10.75}},
+                {'_id': 'invalid', 'name': 'Nowhere', 'position': {'latitude': 91}},
+                {'_id': 'unplaced', 'name': 'Stortinget'},
+                {'_id': 'new', 'name': 'Bergen', 'position': {'latitude': 60.39, 'longitude': 5.32},
+                 'geo': [5.32, 60.39]},
+            ])
+            with patch.object(self.app.data, '_search_backend', return_value=search_backend):
+                self.assertEqual(1, SetLocationGeo().run())
+
+            geo = {doc['_id']: doc.get('geo') for doc in collection.find()}
+
+        self.assertEqual({'old': [10.75, 59.91], 'invalid': None, 'unplaced': None, 'new': [5.32, 60.39]}, geo)
+        self.assertEqual({'type': 'geo_point'},
+                         es.indices.put_mapping.call_args[1]['body']['locations']['properties']['geo'])
+        bulk_index_items.assert_called_once_with('locations', ['old'])
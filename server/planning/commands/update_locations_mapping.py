@@ -0,0 +1,62 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import logging
+import superdesk
+from flask import current_app as app
+from eve.utils import config
+from planning.common import get_collection, bulk_index_items
+from planning.locations import AUTOCOMPLETE_ANALYSIS, get_autocomplete_properties
+
+logger = logging.getLogger(__name__)
+
+#: Number of locations indexed again with one bulk request
+CHUNK_SIZE = 500
+
+
+class UpdateLocationsMapping(superdesk.Command):
+    """Add the autocomplete analyzers and fields to an existing locations index.
+
+    The analyzers are only added to the settings of new indices, so an index created before the
+    locations autocomplete can't get the autocomplete fields. The index is closed while its analysis
+    settings are updated, then the fields are added to the mapping and all the locations are indexed
+    again to fill them. The index is unavailable while it is closed, so run it when idle.
+
+    Example:
+    ::
+
+        $ python manage.py planning:update_locations_mapping
+
+    """
+
+    def run(self):
+        search_backend = app.data._search_backend('locations')
+        es = search_backend.elastic('locations')
+        es_args = search_backend._es_args('locations')
+        index = es_args['index']
+
+        es.indices.close(index=index)
+        try:
+            es.indices.put_settings(index=index, body={'analysis': AUTOCOMPLETE_ANALYSIS})
+        finally:
+            es.indices.open(index=index)
+        es.cluster.health(index=index, wait_for_status='yellow')
+
+        es.indices.put_mapping(index=index, doc_type=es_args['doc_type'],
+                               body={es_args['doc_type']: {'properties': get_autocomplete_properties()}})
+
+        ids = [doc[config.ID_FIELD] for doc in get_collection('locations').find({}, {config.ID_FIELD: 1})]
+        for start in range(0, len(ids), CHUNK_SIZE):
+            bulk_index_items('locations', ids[start:start + CHUNK_SIZE])
+        logger.info('Updated the mapping of {} and indexed {} locations again.'.format(index, len(ids)))
+        return len(ids)
+
+
+superdesk.command('planning:update_locations_mapping', UpdateLocationsMapping())
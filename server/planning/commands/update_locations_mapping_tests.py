@@ -0,0 +1,29 @@
+from mock import MagicMock, patch
+from planning.commands import UpdateLocationsMapping
+from planning.common import get_collection
+from planning.tests import TestCase
+
+
+class UpdateLocationsMappingTestCase(TestCase):
+
+    @patch('planning.commands.update_locations_mapping.bulk_index_items')
+    def test_update_mapping(self, bulk_index_items):
+        search_backend = MagicMock()
+        search_backend._es_args.return_value = {'index': 'sptest', 'doc_type': 'locations'}
+        es = search_backend.elastic.return_value
+        with self.app.app_context():
+            get_collection('locations').insert_many([{'_id': 'first', 'name': 'Stortinget'},
+                                                     {'_id': 'second', 'name': 'Karl Johans gate 22'}])
+            with patch.object(self.app.data, '_search_backend', return_value=search_backend):
+                self.assertEqual(2, UpdateLocationsMapping().run())
+
+        # the analysis settings can only be changed on a closed index
+        self.assertEqual(['close', 'put_settings', 'open', 'put_mapping'],
+                         [name for name, _, _ in es.indices.method_calls])
+        analysis = es.indices.put_settings.call_args[1]['body']['analysis']
+        self.assertIn('location_autocomplete', analysis['analyzer'])
+
+        properties = es.indices.put_mapping.call_args[1]['body']['locations']['properties']
+        self.assertIn('autocomplete', properties['name']['fields'])
+        self.assertIn('autocomplete', properties['address']['properties']['line']['fields'])
+        self.assertEqual(['first', 'second'], sorted(bulk_index_items.call_args[0][1]))
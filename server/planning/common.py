@@ -8,10 +8,18 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+import logging
+import threading
+import time
+from collections import OrderedDict
 from flask import current_app as app
 from superdesk.utc import utcnow
+from eve.utils import config, document_etag
+from elasticsearch.helpers import bulk, streaming_bulk
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
 
 NOT_ANALYZED = {'type': 'string', 'index': 'not_analyzed'}
 
@@ -27,6 +35,10 @@ ITEM_STATE = 'state'
 ITEM_SPIKED = 'spiked'
 ITEM_ACTIVE = 'active'
 
+#: Default number of documents in every bulk request to elastic,
+#: can be changed with the ``PLANNING_ELASTIC_BULK_SIZE`` setting
+ELASTIC_BULK_SIZE = 500
+
 
 def set_item_expiry(doc):
     expiry_minutes = app.settings.get('PLANNING_EXPIRY_MINUTES', None)
@@ -34,3 +46,278 @@ def set_item_expiry(doc):
         doc[ITEM_EXPIRY] = utcnow() + timedelta(minutes=expiry_minutes)
     else:
         doc[ITEM_EXPIRY] = None
+
+
+def bulk_update_items(resource, ids, updates):
+    """Apply the same updates to all the items with the given ids
+
+    The items are written with a single ``update_many`` in mongo, then re-indexed
+    with a single bulk request to elastic, instead of one round trip per item.
+
+    :param str resource: name of the resource the items belong to
+    :param list ids: list of mongo ids of the items to update
+    :param dict updates: changes to apply to every item
+    :return int: the number of items modified in mongo
+    """
+    if not ids:
+        return 0
+
+    updates.setdefault(config.LAST_UPDATED, utcnow())
+    # Changing the etag forces clients to re-fetch the items before patching them again
+    updates.setdefault(config.ETAG, document_etag({'ids': [str(_id) for _id in ids], 'updates': updates}))
+
+    result = get_collection(resource).update_many({config.ID_FIELD: {'$in': ids}}, {'$set': updates})
+    bulk_index_items(resource, ids)
+    return result.modified_count
+
+
+def bulk_index_items(resource, ids):
+    """Re-index the items with the given ids from mongo to elastic with a single bulk request
+
+    :param str resource: name of the resource the items belong to
+    :param list ids: list of mongo ids of the items to index
+    """
+    search_backend = app.data._search_backend(resource)
+    if search_backend and ids:
+        docs = list(get_collection(resource).find({config.ID_FIELD: {'$in': ids}}))
+        search_backend.bulk_insert(resource, docs)
+
+
+def bulk_index_docs(resource, docs, refresh=None):
+    """Index documents written to mongo in elastic with bulk requests
+
+    Documents are sent in requests of ``PLANNING_ELASTIC_BULK_SIZE`` documents and the index is
+    refreshed once all are sent, unless `refresh` or ``PLANNING_ELASTIC_BULK_REFRESH`` is False.
+    The documents which could not be indexed are logged with their error.
+
+    :param str resource: name of the resource the documents belong to
+    :param list docs: documents with their mongo id
+    :param bool refresh: refresh the index once the documents are sent, defaults to the setting
+    :return list: ids of the documents which could not be indexed
+    """
+    search_backend = app.data._search_backend(resource)
+    if not search_backend or not docs:
+        return []
+
+    es_args = search_backend._es_args(resource)
+    actions = ({
+        '_op_type': 'index',
+        '_index': es_args['index'],
+        '_type': es_args['doc_type'],
+        '_id': str(doc[config.ID_FIELD]),
+        '_source': {key: value for key, value in doc.items() if key != config.ID_FIELD}
+    } for doc in docs)
+
+    failed = []
+    for ok, result in streaming_bulk(search_backend.elastic(resource), actions,
+                                     chunk_size=app.config.get('PLANNING_ELASTIC_BULK_SIZE', ELASTIC_BULK_SIZE),
+                                     raise_on_error=False, raise_on_exception=False):
+        if not ok:
+            info = result.get('index', {})
+            failed.append(info.get('_id'))
+            logger.error('Failed to index {} {}: {}'.format(resource, info.get('_id'), info.get('error')))
+
+    if refresh is None:
+        refresh = app.config.get('PLANNING_ELASTIC_BULK_REFRESH', True)
+    if refresh:
+        refresh_index(resource)
+    return failed
+
+
+def refresh_index(resource):
+    search_backend = app.data._search_backend(resource)
+    if search_backend:
+        search_backend.elastic(resource).indices.refresh(search_backend._es_args(resource)['index'])
+
+
+# buffers of the documents created during an ingest update, by resource, active in the current thread
+bulk_index_buffers = threading.local()
+
+
+class BulkIndexBuffer:
+    """Buffer of the documents of a resource created during an ingest update
+
+    The ingest of superdesk indexes the items it saved in a batch with one bulk request, once the whole
+    batch was saved. While the buffer is active in a thread, :func:`index_created_docs` adds the created
+    documents to the buffer instead of indexing them again, with their `on_indexed` callback, and
+    :func:`index_updated_items` leaves the updated items to the ingest.
+
+    Once the batch was saved, :meth:`flush` indexes the documents the ingest did not index, removes
+    the ones which could not be indexed from mongo and only then runs the callbacks with the others,
+    so no notification is sent for a document which does not exist anymore.
+    """
+
+    def __init__(self, resource):
+        """Create an empty buffer for the resource, not active yet"""
+        self.resource = resource
+        self.entries = []
+        self.indexed = False
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(bulk_index_buffers, self.resource, None)
+        setattr(bulk_index_buffers, self.resource, self)
+        return self
+
+    def __exit__(self, *args):
+        setattr(bulk_index_buffers, self.resource, self.previous)
+        self.flush()
+        if self.indexed:
+            refresh_index(self.resource)
+
+    def add(self, docs, on_indexed=None):
+        self.entries.append((docs, on_indexed))
+
+    def flush(self):
+        """Index the buffered documents missing in elastic and run the callbacks of the indexed ones"""
+        entries, self.entries = self.entries, []
+        docs = [doc for entry_docs, _ in entries for doc in entry_docs]
+        if not docs:
+            return
+
+        indexed = get_indexed_ids(self.resource, [str(doc[config.ID_FIELD]) for doc in docs])
+        missing = [doc for doc in docs if str(doc[config.ID_FIELD]) not in indexed]
+        failed = set(index_docs(self.resource, missing, refresh=False)) if missing else set()
+        self.indexed = self.indexed or bool(missing)
+
+        for entry_docs, on_indexed in entries:
+            entry_docs = [doc for doc in entry_docs if str(doc[config.ID_FIELD]) not in failed]
+            if on_indexed and entry_docs:
+                on_indexed(entry_docs)
+
+
+def get_bulk_index_buffer(resource):
+    return getattr(bulk_index_buffers, resource, None)
+
+
+def get_indexed_ids(resource, ids):
+    """Get the ids of the documents found in the elastic index of the resource, with one request"""
+    search_backend = app.data._search_backend(resource)
+    if not search_backend or not ids:
+        return set(ids)
+
+    es_args = search_backend._es_args(resource)
+    result = search_backend.elastic(resource).mget(body={'ids': ids}, index=es_args['index'],
+                                                   doc_type=es_args['doc_type'], _source=False)
+    return {doc['_id'] for doc in result['docs'] if doc.get('found')}
+
+
+def index_created_docs(resource, docs, refresh=None, on_indexed=None):
+    """Index documents created in mongo, or add them to the active buffer of the resource
+
+    Documents which could not be indexed are removed from mongo, so both stores stay consistent
+    and ingested items are ingested again on the next update.
+
+    :param callable on_indexed: called with the documents indexed, once they are
+    :return list: ids of the documents which could not be indexed, empty if they were buffered
+    """
+    buffer = get_bulk_index_buffer(resource)
+    if buffer is not None:
+        buffer.add(docs, on_indexed)
+        return []
+
+    failed = index_docs(resource, docs, refresh=refresh)
+    indexed = [doc for doc in docs if str(doc[config.ID_FIELD]) not in failed]
+    if on_indexed and indexed:
+        on_indexed(indexed)
+    return failed
+
+
+def index_docs(resource, docs, refresh=None):
+    failed = bulk_index_docs(resource, docs, refresh=refresh)
+    if failed:
+        get_collection(resource).delete_many({config.ID_FIELD: {'$in': failed}})
+    return failed
+
+
+def index_updated_items(resource, ids):
+    """Index again the items updated in mongo, unless the ingest indexes them with its batch"""
+    if get_bulk_index_buffer(resource) is None:
+        bulk_index_items(resource, ids)
+
+
+def bulk_index_batches(resource, batches):
+    """Yield the batches of an ingest update, checking the items created by the ingest were indexed
+
+    The ingest saves every item of a batch before asking for the next one, and indexes them with
+    a bulk request. The created items it did not index are indexed once per batch, and the index is
+    refreshed once at the end of the update if any were.
+
+    :param str resource: name of the resource the ingested items belong to
+    :param batches: iterable of the lists of items to ingest
+    """
+    with BulkIndexBuffer(resource) as buffer:
+        for items in batches:
+            yield items
+            buffer.flush()
+
+
+def bulk_delete_items(resource, ids):
+    """Delete the items with the given ids with one bulk request to elastic and one write to mongo
+
+    Items are removed from elastic first so they don't show up in searches anymore,
+    items missing in elastic are ignored.
+
+    :param str resource: name of the resource the items belong to
+    :param list ids: list of mongo ids of the items to delete
+    :return int: the number of items deleted from mongo
+    """
+    if not ids:
+        return 0
+
+    search_backend = app.data._search_backend(resource)
+    if search_backend:
+        es_args = search_backend._es_args(resource)
+        bulk(search_backend.elastic(resource), [{
+            '_op_type': 'delete',
+            '_index': es_args['index'],
+            '_type': es_args['doc_type'],
+            '_id': str(_id)
+        } for _id in ids], raise_on_error=False)
+
+    return get_collection(resource).delete_many({config.ID_FIELD: {'$in': ids}}).deleted_count
+
+
+def get_collection(resource):
+    """Get the mongo collection used by the given resource"""
+    return app.data.get_mongo_collection(app.data.datasource(resource)[0])
+
+
+class LRUCache:
+    """Thread safe in-process cache keeping the `size` most recently used values
+
+    Values older than `ttl` seconds are expired, so processes which did not see a write
+    stop serving stale values after a while.
+    """
+
+    def __init__(self, size, ttl=None):
+        """Create an empty cache, keeping values forever if `ttl` is not set"""
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.values:
+                return default
+            value, expiry = self.values[key]
+            if expiry is not None and expiry < time.time():
+                del self.values[key]
+                return default
+            self.values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = (value, time.time() + self.ttl if self.ttl else None)
+            self.values.move_to_end(key)
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
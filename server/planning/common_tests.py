@@ -0,0 +1,33 @@
+import time
+from mock import patch
+from planning.common import LRUCache
+from planning.tests import TestCase
+
+
+class LRUCacheTestCase(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('first', 1)
+        cache.set('second', 2)
+        self.assertEqual(1, cache.get('first'))
+
+        cache.set('third', 3)
+        self.assertIsNone(cache.get('second'))
+        self.assertEqual(1, cache.get('first'))
+        self.assertEqual(3, cache.get('third'))
+        self.assertEqual(2, len(cache))
+
+        cache.clear()
+        self.assertEqual('missing', cache.get('first', 'missing'))
+
+    def test_expires_values(self):
+        cache = LRUCache(2, ttl=10)
+        now = time.time()
+        with patch('planning.common.time.time', return_value=now):
+            cache.set('first', 1)
+        with patch('planning.common.time.time', return_value=now + 5):
+            self.assertEqual(1, cache.get('first'))
+        with patch('planning.common.time.time', return_value=now + 11):
+            self.assertIsNone(cache.get('first'))
+        self.assertEqual(0, len(cache))
@@ -289,6 +289,10 @@ class CoverageResource(superdesk.Resource):
     resource_methods = ['GET', 'POST']
     item_methods = ['GET', 'PATCH', 'PUT', 'DELETE']
     public_methods = ['GET']
+    mongo_indexes = {
+        'assigned_to_user_scheduled': [('planning.assigned_to.user', 1), ('planning.scheduled', 1), ('_id', 1)],
+        'assigned_to_desk_scheduled': [('planning.assigned_to.desk', 1), ('planning.scheduled', 1), ('_id', 1)],
+    }
     privileges = {'POST': 'planning',
                   'PATCH': 'planning',
                   'DELETE': 'planning'}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Superdesk Planning - Bulk Coverage"""
+
+import datetime
+from pymongo import InsertOne, UpdateOne
+from eve.utils import config, document_etag
+from superdesk import Resource, get_resource_service
+from superdesk.errors import SuperdeskApiError
+from superdesk.metadata.utils import generate_guid
+from superdesk.metadata.item import GUID_NEWSML
+from superdesk.notification import push_notification
+from superdesk.services import BaseService
+from superdesk.utc import utcnow
+from apps.archive.common import set_original_creator, get_user
+from .common import bulk_index_docs, bulk_delete_items, get_collection
+from .coverage import coverage_schema
+
+BULK_RESULT_CREATED = 'created'
+BULK_RESULT_UPDATED = 'updated'
+BULK_RESULT_UNCHANGED = 'unchanged'
+BULK_RESULT_DELETED = 'deleted'
+
+# The fields of the coverages set by the clients
+COVERAGE_FIELDS = ('planning', 'delivery')
+
+coverage_bulk_schema = {
+    'planning_item': Resource.rel('planning', required=True),
+
+    # The coverages the planning item must have, the ones with the _id of an existing coverage
+    # update it, the others are created and the existing coverages not listed are deleted.
+    # The _etag of an existing coverage is the one of the version edited, like the If-Match header
+    'coverages': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'allow_unknown': True,
+            'schema': {
+                config.ID_FIELD: {'type': 'string'},
+                config.ETAG: {'type': 'string'},
+                'planning': coverage_schema['planning'],
+                'delivery': coverage_schema['delivery'],
+            }
+        }
+    },
+
+    # The result of the operation for every coverage, i.e. [{"_id": "id1", "result": "updated"}]
+    'items': {
+        'type': 'list',
+        'readonly': True
+    }
+}
+
+
+class CoverageBulkService(BaseService):
+    """Save all the coverages of a planning item with a single request
+
+    The differences with the existing coverages are computed here and written with one bulk write
+    to mongo and bulk requests to elastic, then a single notification is sent for all of them.
+    A coverage changed by someone else since the `_etag` given for it is not overwritten, the request
+    fails with a 412 error instead.
+    """
+
+    def create(self, docs, **kwargs):
+        user = get_user()
+        ids = []
+        for doc in docs:
+            doc['items'] = self.save_coverages(doc['planning_item'], doc.get('coverages') or [], user)
+            ids.append(len(ids))
+        return ids
+
+    def save_coverages(self, planning_id, coverages, user=None):
+        """Create, update and delete the coverages of the planning item to match the given ones
+
+        :param planning_id: id of the planning item
+        :param list coverages: all the coverages the planning item must have
+        :param dict user: the user performing the operation
+        :return list: per coverage results
+        :raises SuperdeskApiError: 412 error listing the coverages changed since their given `_etag`
+        """
+        coverage_service = get_resource_service('coverage')
+        collection = get_collection('coverage')
+        existing = {str(coverage[config.ID_FIELD]): coverage
+                    for coverage in collection.find({'planning_item': planning_id})}
+
+        now = utcnow()
+        operations = []
+        created = []
+        updated = []
+        etags = {}
+        results = {}
+        stale = get_stale_coverages(coverages, existing)
+        if stale:
+            raise_stale_coverages(stale)
+
+        for coverage in coverages:
+            values = {field: coverage[field] for field in COVERAGE_FIELDS if field in coverage}
+            original = existing.get(str(coverage.get(config.ID_FIELD) or ''))
+            if original is None:
+                doc = dict(values, planning_item=planning_id, guid=generate_guid(type=GUID_NEWSML))
+                set_original_creator(doc)
+                coverage_service._set_assignment_information(doc)
+                doc[config.DATE_CREATED] = doc[config.LAST_UPDATED] = now
+                doc[config.ETAG] = document_etag(doc)
+                operations.append(InsertOne(doc))
+                created.append(doc)
+                continue
+
+            _id = original[config.ID_FIELD]
+            updates = {field: value for field, value in values.items()
+                       if get_comparable(value) != get_comparable(original.get(field))}
+            results[str(_id)] = BULK_RESULT_UPDATED if updates else BULK_RESULT_UNCHANGED
+            if not updates:
+                continue
+
+            # the assignment information only changes with the assignee
+            if 'planning' in updates and get_assignee(updates['planning']) != get_assignee(original.get('planning')):
+                coverage_service._set_assignment_information(updates)
+            if user and user.get(config.ID_FIELD):
+                updates['version_creator'] = user[config.ID_FIELD]
+            updates[config.LAST_UPDATED] = now
+            updates[config.ETAG] = document_etag(dict(original, **updates))
+            # not written if the coverage changed since it was read
+            operations.append(UpdateOne({config.ID_FIELD: _id, config.ETAG: original.get(config.ETAG)},
+                                        {'$set': updates}))
+            updated.append(_id)
+            etags[_id] = updates[config.ETAG]
+
+        deleted = [coverage[config.ID_FIELD] for key, coverage in existing.items() if key not in results]
+
+        if operations:
+            write_result = collection.bulk_write(operations)
+            updated_docs = list(collection.find({config.ID_FIELD: {'$in': updated}})) if updated else []
+            # the coverages changed between the read and the write are left out
+            if write_result.matched_count < len(updated):
+                written = {doc[config.ID_FIELD] for doc in updated_docs
+                           if doc.get(config.ETAG) == etags[doc[config.ID_FIELD]]}
+                stale = [str(_id) for _id in updated if _id not in written]
+                updated = [_id for _id in updated if _id in written]
+                updated_docs = [doc for doc in updated_docs if doc[config.ID_FIELD] in written]
+            bulk_index_docs('coverage', created + updated_docs)
+        bulk_delete_items('coverage', deleted)
+
+        results.update({str(doc[config.ID_FIELD]): BULK_RESULT_CREATED for doc in created})
+        results.update({str(_id): BULK_RESULT_DELETED for _id in deleted})
+
+        if created or updated or deleted:
+            push_notification(
+                'coverage:updated:bulk',
+                item=str(planning_id),
+                created=[str(doc[config.ID_FIELD]) for doc in created],
+                updated=[str(_id) for _id in updated],
+                deleted=[str(_id) for _id in deleted],
+                user=str((user or {}).get(config.ID_FIELD, ''))
+            )
+
+        if stale:
+            raise_stale_coverages(stale)
+        return [{config.ID_FIELD: _id, 'result': result} for _id, result in results.items()]
+
+
+def raise_stale_coverages(ids):
+    raise SuperdeskApiError(message='Coverages were changed by another user, reload them.',
+                            status_code=412, payload={'coverages': ids})
+
+
+def get_stale_coverages(coverages, existing):
+    """Get the ids of the coverages which changed since the `_etag` given for them"""
+    stale = []
+    for coverage in coverages:
+        original = existing.get(str(coverage.get(config.ID_FIELD) or ''))
+        if original and coverage.get(config.ETAG) and coverage[config.ETAG] != original.get(config.ETAG):
+            stale.append(str(original[config.ID_FIELD]))
+    return stale
+
+
+def get_assignee(planning):
+    assigned_to = (planning or {}).get('assigned_to') or {}
+    return assigned_to.get('user'), assigned_to.get('desk')
+
+
+def get_comparable(value):
+    """Get a value comparable with the one stored in mongo, as dates are stored in utc to the millisecond"""
+    if isinstance(value, dict):
+        return {key: get_comparable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [get_comparable(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.astimezone(datetime.timezone.utc).replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+class CoverageBulkResource(Resource):
+    url = 'coverage/bulk'
+    resource_title = endpoint_name = 'coverage_bulk'
+
+    schema = coverage_bulk_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning'}
@@ -0,0 +1,140 @@
+from datetime import timedelta
+from bson import ObjectId
+from mock import MagicMock, patch
+from superdesk import get_resource_service
+from superdesk.errors import SuperdeskApiError
+from superdesk.utc import utcnow
+from planning.common import get_collection
+from planning.tests import TestCase
+
+
+class CoverageBulkTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.planning_id = ObjectId()
+        self.scheduled = utcnow().replace(microsecond=0) + timedelta(days=1)
+        self.coverages = [{
+            '_id': ObjectId(),
+            'planning_item': self.planning_id,
+            'planning': {'ednote': 'first', 'scheduled': self.scheduled},
+        }, {
+            '_id': ObjectId(),
+            'planning_item': self.planning_id,
+            'planning': {'ednote': 'second', 'assigned_to': {'user': 'user1', 'desk': None}},
+        }, {
+            '_id': ObjectId(),
+            'planning_item': self.planning_id,
+            'planning': {'ednote': 'third'},
+        }]
+
+    @patch('planning.coverage_bulk.push_notification')
+    def test_save_coverages(self, push_notification):
+        with self.app.app_context():
+            collection = get_collection('coverage')
+            collection.insert_many(self.coverages)
+            first, second, third = self.coverages
+
+            items = get_resource_service('coverage_bulk').save_coverages(self.planning_id, [
+                {'_id': str(first['_id']), 'planning': {'ednote': 'first',
+                                                        'scheduled': self.scheduled.replace(tzinfo=None)}},
+                {'_id': str(second['_id']), 'planning': {'ednote': 'changed',
+                                                         'assigned_to': {'user': 'user1', 'desk': None}}},
+                {'planning': {'ednote': 'new', 'assigned_to': {'desk': 'desk1'}}},
+            ])
+
+            results = {item['_id']: item['result'] for item in items}
+            created = [_id for _id, result in results.items() if result == 'created']
+            self.assertEqual(1, len(created))
+            self.assertEqual({
+                str(first['_id']): 'unchanged',
+                str(second['_id']): 'updated',
+                str(third['_id']): 'deleted',
+                created[0]: 'created',
+            }, results)
+
+            coverages = {str(coverage['_id']): coverage for coverage in collection.find()}
+            self.assertEqual({str(first['_id']), str(second['_id']), created[0]}, set(coverages))
+            self.assertEqual('changed', coverages[str(second['_id'])]['planning']['ednote'])
+            # the assignee did not change
+            self.assertNotIn('assigned_date', coverages[str(second['_id'])]['planning']['assigned_to'])
+            self.assertEqual(self.planning_id, coverages[created[0]]['planning_item'])
+            self.assertIn('assigned_date', coverages[created[0]]['planning']['assigned_to'])
+
+            self.assertEqual(1, push_notification.call_count)
+            self.assertEqual('coverage:updated:bulk', push_notification.call_args[0][0])
+            self.assertEqual(str(self.planning_id), push_notification.call_args[1]['item'])
+
+    @patch('planning.coverage_bulk.push_notification')
+    def test_save_unchanged_coverages(self, push_notification):
+        with self.app.app_context():
+            get_collection('coverage').insert_many(self.coverages)
+            items = get_resource_service('coverage_bulk').save_coverages(self.planning_id, [
+                {'_id': str(coverage['_id']), 'planning': coverage['planning']} for coverage in self.coverages
+            ])
+
+            self.assertEqual({'unchanged'}, {item['result'] for item in items})
+            self.assertEqual(0, push_notification.call_count)
+
+    def test_save_coverages_assigned_to_user_and_desk(self):
+        with self.app.app_context():
+            get_collection('coverage').insert_many(self.coverages)
+            with self.assertRaises(SuperdeskApiError):
+                get_resource_service('coverage_bulk').save_coverages(self.planning_id, [
+                    {'planning': {'assigned_to': {'user': 'user1', 'desk': 'desk1'}}},
+                ])
+            self.assertEqual(3, get_collection('coverage').count())
+
+    @patch('planning.coverage_bulk.push_notification')
+    def test_save_stale_coverages(self, push_notification):
+        for coverage in self.coverages:
+            coverage['_etag'] = 'etag-{}'.format(coverage['planning']['ednote'])
+        first, second, third = self.coverages
+        with self.app.app_context():
+            collection = get_collection('coverage')
+            collection.insert_many(self.coverages)
+            service = get_resource_service('coverage_bulk')
+
+            with self.assertRaises(SuperdeskApiError) as error:
+                service.save_coverages(self.planning_id, [
+                    {'_id': str(first['_id']), '_etag': 'etag-first', 'planning': {'ednote': 'changed'}},
+                    {'_id': str(second['_id']), '_etag': 'etag-old', 'planning': {'ednote': 'changed'}},
+                ])
+            self.assertEqual(412, error.exception.status_code)
+            self.assertEqual({'coverages': [str(second['_id'])]}, error.exception.payload)
+            self.assertEqual(3, collection.count())
+            self.assertEqual('first', collection.find_one({'_id': first['_id']})['planning']['ednote'])
+
+            items = service.save_coverages(self.planning_id, [
+                {'_id': str(first['_id']), '_etag': 'etag-first', 'planning': {'ednote': 'changed'}},
+            ])
+            self.assertEqual({str(first['_id']): 'updated', str(second['_id']): 'deleted',
+                              str(third['_id']): 'deleted'}, {item['_id']: item['result'] for item in items})
+
+    @patch('planning.coverage_bulk.push_notification')
+    def test_save_coverages_changed_meanwhile(self, push_notification):
+        first, second, third = self.coverages
+        with self.app.app_context():
+            collection = get_collection('coverage')
+            collection.insert_many(self.coverages)
+
+            def find(query, *args, **kwargs):
+                docs = list(collection.find(query, *args, **kwargs))
+                if 'planning_item' in query:
+                    # another user saves the second coverage after it was read
+                    collection.update_one({'_id': second['_id']}, {'$set': {'_etag': 'other'}})
+                return docs
+
+            proxy = MagicMock(wraps=collection)
+            proxy.find.side_effect = find
+            with patch('planning.coverage_bulk.get_collection', return_value=proxy):
+                with self.assertRaises(SuperdeskApiError) as error:
+                    get_resource_service('coverage_bulk').save_coverages(self.planning_id, [
+                        {'_id': str(coverage['_id']), 'planning': {'ednote': 'changed'}}
+                        for coverage in self.coverages
+                    ])
+
+            self.assertEqual({'coverages': [str(second['_id'])]}, error.exception.payload)
+            ednotes = {coverage['_id']: coverage['planning']['ednote'] for coverage in collection.find()}
+            self.assertEqual({first['_id']: 'changed', second['_id']: 'second', third['_id']: 'changed'}, ednotes)
+            self.assertEqual([str(first['_id']), str(third['_id'])], push_notification.call_args[1]['updated'])
@@ -17,7 +17,9 @@ from superdesk.metadata.utils import generate_guid
 from superdesk.metadata.item import GUID_NEWSML
 from superdesk.notification import push_notification
 from apps.archive.common import set_original_creator, get_user
-from .common import STATE_SCHEMA
+from .common import STATE_SCHEMA, index_created_docs, index_updated_items
+from .sequences import sequence_blocks, DEFAULT_BLOCK_SIZE
+from .locations import increment_usage, get_location_qcodes
 from dateutil.rrule import rrule, YEARLY, MONTHLY, WEEKLY, DAILY, MO, TU, WE, TH, FR, SA, SU
 from eve.defaults import resolve_default_values
 from eve.methods.common import resolve_document_etag
@@ -49,27 +51,49 @@ class EventsService(superdesk.Service):
     """Service class for the events model."""
 
     def post_in_mongo(self, docs, **kwargs):
+        """Create ingested events in mongo and index them in elastic with bulk requests
+
+        During an ingest update, the events are indexed by the ingest with the whole batch,
+        see :func:`planning.common.bulk_index_batches`. Events which could not be indexed are
+        removed from mongo, so both stay consistent and the events are ingested again on the next update.
+        The notifications and usage counts of `on_created` are only done for the indexed events.
+        """
         for doc in docs:
             resolve_default_values(doc, app.config['DOMAIN'][self.datasource]['defaults'])
         self.on_create(docs)
         resolve_document_etag(docs, self.datasource)
         ids = self.backend.create_in_mongo(self.datasource, docs, **kwargs)
-        self.on_created(docs)
+
+        failed = index_created_docs(self.datasource, docs, on_indexed=self.on_created)
+        if failed:
+            docs[:] = [doc for doc in docs if str(doc[config.ID_FIELD]) not in failed]
+            ids = [_id for _id in ids if str(_id) not in failed]
         return ids
 
     def patch_in_mongo(self, id, document, original):
+        """Update an ingested event in mongo and index it again in elastic
+
+        The ingest sets the expiry of the item as if it was new, the event keeps its own expiry
+        so it is not reset for spiked or edited events every time they are ingested again.
+        """
+        if 'expiry' in original:
+            document['expiry'] = original['expiry']
         res = self.backend.update_in_mongo(self.datasource, id, document, original)
+        index_updated_items(self.datasource, [id])
         return res
 
     def set_ingest_provider_sequence(self, item, provider):
         """Sets the value of ingest_provider_sequence in item.
 
+        The numbers are reserved in blocks of ``PLANNING_INGEST_SEQUENCE_BLOCK_SIZE``.
+
         :param item: object to which ingest_provider_sequence to be set
         :param provider: ingest_provider object, used to build the key name of sequence
         """
-        sequence_number = get_resource_service('sequences').get_next_sequence_number(
+        sequence_number = sequence_blocks.get_next_sequence_number(
             key_name='ingest_providers_{_id}'.format(_id=provider[config.ID_FIELD]),
-            max_seq_number=app.config['MAX_VALUE_OF_INGEST_SEQUENCE']
+            max_seq_number=app.config['MAX_VALUE_OF_INGEST_SEQUENCE'],
+            block_size=app.config.get('PLANNING_INGEST_SEQUENCE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
         )
         item['ingest_provider_sequence'] = str(sequence_number)
 
@@ -148,6 +172,13 @@ class EventsService(superdesk.Service):
                 user=user_id
             )
 
+        increment_usage([qcode for doc in docs for qcode in get_location_qcodes(doc)])
+
+    def on_updated(self, updates, original):
+        if 'location' in updates:
+            original_qcodes = get_location_qcodes(original)
+            increment_usage([qcode for qcode in get_location_qcodes(updates) if qcode not in original_qcodes])
+
     def on_update(self, updates, original):
         if 'skip_on_update' in updates:
             # this is an recursive update(see below)
@@ -309,6 +340,9 @@ events_schema = {
         'type': 'string',
         'mapping': not_analyzed
     },
+    'ingest_fingerprint': {     # Hashes of the ingested content, to only update the events which changed
+        'type': 'dict'
+    },
     'event_created': {
         'type': 'datetime'
     },
@@ -536,6 +570,10 @@ class EventsResource(superdesk.Resource):
     }
     item_methods = ['GET', 'PATCH', 'PUT']
     public_methods = ['GET']
+    mongo_indexes = {
+        'state_1_expiry_1': [('state', 1), ('expiry', 1)],
+        'original_source_1_dates.start_1': [('original_source', 1), ('dates.start', 1)],
+    }
     privileges = {'POST': 'planning_event_management',
                   'PATCH': 'planning_event_management'}
 
@@ -34,11 +34,10 @@ class EventsHistoryService(HistoryService):
         lookup = {'event_id': doc[config.ID_FIELD]}
         self.delete(lookup=lookup)
 
-    def _save_history(self, event, update, operation):
-        history = {
+    def _get_history(self, event, update, operation):
+        return {
             'event_id': event[config.ID_FIELD],
             'user_id': self.get_user_id(),
             'operation': operation,
             'update': self._remove_unwanted_fields(update)
         }
-        self.post([history])
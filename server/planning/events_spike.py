@@ -10,10 +10,11 @@
 
 from .events import EventsResource
 from .common import ITEM_EXPIRY, ITEM_STATE, ITEM_SPIKED, ITEM_ACTIVE, set_item_expiry
+from .bulk_spike import bulk_spike_schema, BulkSpikeService, BulkUnspikeService
 from superdesk.services import BaseService
 from superdesk.notification import push_notification
 from apps.auth import get_user
-from superdesk import config, get_resource_service
+from superdesk import config, get_resource_service, Resource
 
 
 class EventsSpikeResource(EventsResource):
@@ -39,11 +40,12 @@ class EventsSpikeService(BaseService):
         return item
 
     def on_updated(self, updates, original):
-        planning_service = get_resource_service('planning')
-        spike_service = get_resource_service('planning_spike')
-
-        for planning in list(planning_service.find(where={'event_item': original[config.ID_FIELD]})):
-            spike_service.patch(planning[config.ID_FIELD], {})
+        # spike all the linked planning items with one query and one bulk update,
+        # instead of patching them one by one
+        get_resource_service('planning_bulk_spike').update_state(
+            {'event_item': original[config.ID_FIELD]},
+            user=get_user(required=True)
+        )
 
 
 class EventsUnspikeResource(EventsResource):
@@ -66,3 +68,42 @@ class EventsUnspikeService(BaseService):
         item = self.backend.update(self.datasource, id, updates, original)
         push_notification('events:unspiked', item=str(id), user=str(user.get(config.ID_FIELD)))
         return item
+
+
+class EventsBulkSpikeResource(Resource):
+    url = 'events/bulk_spike'
+    resource_title = endpoint_name = 'events_bulk_spike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_event_spike'}
+
+
+class EventsBulkSpikeService(BulkSpikeService):
+    resource = 'events'
+    history_service = 'events_history'
+    notification = 'events:spiked:bulk'
+
+    def on_bulk_updated(self, updates, originals, user=None):
+        super().on_bulk_updated(updates, originals, user)
+
+        # spike all the planning items linked to these events at once
+        event_ids = [event[config.ID_FIELD] for event in originals]
+        get_resource_service('planning_bulk_spike').update_state({'event_item': {'$in': event_ids}}, user=user)
+
+
+class EventsBulkUnspikeResource(Resource):
+    url = 'events/bulk_unspike'
+    resource_title = endpoint_name = 'events_bulk_unspike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_event_unspike'}
+
+
+class EventsBulkUnspikeService(BulkUnspikeService):
+    resource = 'events'
+    history_service = 'events_history'
+    notification = 'events:unspiked:bulk'
@@ -1,5 +1,9 @@
 import unittest
+from mock import patch
+from superdesk import get_resource_service
+from planning.common import get_collection, bulk_index_batches
 from planning.events import generate_recurring_dates
+from planning.tests import TestCase
 import datetime
 import pytz
 
@@ -70,3 +74,87 @@ class EventTestCase(unittest.TestCase):
             datetime.datetime(2016, 11, 24, 23, 00),  # it's friday in Berlin
             datetime.datetime(2016, 12, 1, 23, 00),  # it's friday in Berlin
         ])
+
+
+class EventsServiceTestCase(TestCase):
+
+    def get_event(self, guid):
+        start = datetime.datetime(2029, 1, 1, 10, tzinfo=pytz.utc)
+        return {
+            'guid': guid,
+            'name': guid,
+            'dates': {'start': start, 'end': start + datetime.timedelta(hours=1), 'tz': ''}
+        }
+
+    def test_post_in_mongo_indexes_events(self):
+        with self.app.app_context():
+            ids = get_resource_service('events').post_in_mongo([self.get_event('e1'), self.get_event('e2')])
+            self.assertEqual(['e1', 'e2'], sorted(ids))
+            search_backend = self.app.data._search_backend('events')
+            self.assertEqual('e1', search_backend.find_one_raw('events', 'e1')['name'])
+            self.assertEqual('e2', search_backend.find_one_raw('events', 'e2')['name'])
+
+    @patch('planning.common.streaming_bulk')
+    def test_post_in_mongo_removes_events_not_indexed(self, streaming_bulk):
+        streaming_bulk.return_value = [
+            (True, {'index': {'_id': 'e1'}}),
+            (False, {'index': {'_id': 'e2', 'error': 'MapperParsingException'}}),
+        ]
+        with self.app.app_context():
+            ids = get_resource_service('events').post_in_mongo([self.get_event('e1'), self.get_event('e2')])
+            self.assertEqual(['e1'], ids)
+            self.assertIsNotNone(get_collection('events').find_one({'_id': 'e1'}))
+            self.assertIsNone(get_collection('events').find_one({'_id': 'e2'}))
+
+    def test_patch_in_mongo_keeps_expiry(self):
+        expiry = datetime.datetime(2029, 1, 2, tzinfo=pytz.utc)
+        with self.app.app_context():
+            service = get_resource_service('events')
+            service.post_in_mongo([dict(self.get_event('e1'), expiry=expiry)])
+            original = get_collection('events').find_one({'_id': 'e1'})
+
+            # as ingested again, with the expiry of a new item
+            service.patch_in_mongo('e1', {'name': 'changed', 'expiry': expiry + datetime.timedelta(days=2)},
+                                   original)
+
+            event = get_collection('events').find_one({'_id': 'e1'})
+            self.assertEqual('changed', event['name'])
+            self.assertEqual(expiry, event['expiry'].replace(tzinfo=pytz.utc))
+
+    @patch('planning.common.refresh_index')
+    @patch('planning.common.streaming_bulk')
+    def test_bulk_index_batches(self, streaming_bulk, refresh_index):
+        streaming_bulk.return_value = []
+        with self.app.app_context():
+            service = get_resource_service('events')
+            for index, guids in enumerate(bulk_index_batches('events', [['e1', 'e2'], ['e3']])):
+                for guid in guids:
+                    service.post_in_mongo([self.get_event(guid)])
+                # the events of a batch are indexed once all are saved, when the next batch is asked for
+                self.assertEqual(index, streaming_bulk.call_count)
+
+            self.assertEqual(2, streaming_bulk.call_count)
+            self.assertEqual(['e1', 'e2'], [action['_id'] for action in streaming_bulk.call_args_list[0][0][1]])
+            self.assertEqual(1, refresh_index.call_count)
+
+    @patch('planning.events.push_notification')
+    @patch('planning.common.get_indexed_ids')
+    @patch('planning.common.streaming_bulk')
+    def test_bulk_index_batches_indexes_missing_events(self, streaming_bulk, get_indexed_ids, push_notification):
+        # e1 was indexed by the ingest, e3 can't be indexed
+        get_indexed_ids.return_value = {'e1'}
+        streaming_bulk.return_value = [
+            (True, {'index': {'_id': 'e2'}}),
+            (False, {'index': {'_id': 'e3', 'error': 'MapperParsingException'}}),
+        ]
+        with self.app.app_context():
+            service = get_resource_service('events')
+            for guids in bulk_index_batches('events', [['e1', 'e2', 'e3']]):
+                for guid in guids:
+                    service.post_in_mongo([self.get_event(guid)])
+                # the events are notified once indexed
+                self.assertEqual(0, push_notification.call_count)
+
+            self.assertEqual(['e2', 'e3'], [action['_id'] for action in streaming_bulk.call_args[0][1]])
+            self.assertIsNone(get_collection('events').find_one({'_id': 'e3'}))
+            self.assertEqual(['e1', 'e2'], [call[1]['item'] for call in push_notification.call_args_list])
@@ -8,22 +8,36 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+import hashlib
+import json
 import logging
 import datetime
+from collections import Counter
 
 from superdesk.errors import ParserError
 from superdesk.io.feed_parsers import FileFeedParser
 from superdesk.metadata.utils import generate_guid
 from superdesk.metadata.item import ITEM_TYPE, CONTENT_TYPE, GUID_FIELD, GUID_NEWSML, FORMAT, FORMATS
 from superdesk.utc import utcnow
-from icalendar import vRecur, vCalAddress, vGeo
+from icalendar import Event, vRecur, vCalAddress, vGeo
 from icalendar.parser import tzid_from_dt
-from superdesk import get_resource_service
+from flask import current_app as app
+from planning.common import get_collection
 import pytz
 
 utc = pytz.UTC
 logger = logging.getLogger(__name__)
 
+#: Default number of events in each batch yielded by :meth:`IcsTwoFeedParser.parse_stream`,
+#: can be changed with the ``PLANNING_INGEST_BATCH_SIZE`` setting
+BATCH_SIZE = 100
+
+#: Field of the ingested events storing the fingerprint of their content
+FINGERPRINT_FIELD = 'ingest_fingerprint'
+#: Fields compared to find out if an ingested event changed
+FINGERPRINT_FIELDS = ('name', 'definition_short', 'definition_long', 'dates', 'participants', 'organizer',
+                      'location')
+
 
 class IcsTwoFeedParser(FileFeedParser):
     """ICS specific parser.
@@ -41,123 +55,322 @@ class IcsTwoFeedParser(FileFeedParser):
 
     def parse(self, cal, provider=None):
 
+        try:
+            items = [self.parse_event(component) for component in cal.walk() if component.name == "VEVENT"]
+            return self.filter_items(items, provider)
+        except Exception as ex:
+            raise ParserError.parseMessageError(ex, provider)
+
+    def parse_stream(self, lines, provider=None, batch_size=None, dedup=True):
+        """Parse a calendar one VEVENT at a time, yielding the events to ingest in batches
+
+        Unlike :meth:`parse`, the whole calendar is never loaded: only the current VEVENT
+        and the current batch are kept in memory, whatever the size of the calendar.
+
+        :param lines: iterable of the calendar lines, i.e. a file opened in binary mode
+            or `response.iter_lines()`
+        :param dict provider: ingest provider
+        :param int batch_size: maximum number of parsed events in each batch
+        :param bool dedup: if False, the batches are not filtered with :meth:`filter_items`
+        :return: generator of lists of events
+        """
+        batch_size = batch_size or app.config.get('PLANNING_INGEST_BATCH_SIZE', BATCH_SIZE)
         try:
             items = []
+            batches = 0
+            for component in iter_vevents(lines):
+                items.append(self.parse_event(component))
+                if len(items) >= batch_size:
+                    yield self.filter_items(items, provider) if dedup else items
+                    items = []
+                    batches += 1
 
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    item = {
-                        ITEM_TYPE: CONTENT_TYPE.TEXT,
-                        GUID_FIELD: generate_guid(type=GUID_NEWSML),
-                        FORMAT: FORMATS.PRESERVED
-                    }
-                    item['name'] = component.get('summary')
-                    item['definition_short'] = component.get('summary')
-                    item['definition_long'] = component.get('description')
-                    item['original_source'] = component.get('uid')
-
-                    # add dates
-                    # check if component .dt return date instead of datetime, if so, convert to datetime
-                    dtstart = component.get('dtstart').dt
-                    dates_start = dtstart if isinstance(dtstart, datetime.datetime) \
-                        else datetime.datetime.combine(dtstart, datetime.datetime.min.time())
-                    if not dates_start.tzinfo:
-                        dates_start = utc.localize(dates_start)
-                    try:
-                        dtend = component.get('dtend').dt
-                        dates_end = dtend if isinstance(dtend, datetime.datetime) \
-                            else datetime.datetime.combine(dtend, datetime.datetime.min.time())
-                        if not dates_end.tzinfo:
-                            dates_end = utc.localize(dates_end)
-                    except AttributeError as e:
-                        dates_end = None
-                    item['dates'] = {
-                        'start': dates_start,
-                        'end': dates_end,
-                        'tz': '',
-                        'recurring_rule': {}
-                    }
-                    # parse ics RRULE to fit eventsML recurring_rule
-                    r_rule = component.get('rrule')
-                    if isinstance(r_rule, vRecur):
-                        r_rule_dict = vRecur.from_ical(r_rule)
-                        if 'FREQ' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['frequency'] = ''.join(r_rule_dict.get('FREQ'))
-                        if 'INTERVAL' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['interval'] = r_rule_dict.get('INTERVAL')[0]
-                        if 'UNTIL' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['until'] = r_rule_dict.get('UNTIL')[0]
-                        if 'COUNT' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['count'] = r_rule_dict.get('COUNT')
-                        if 'BYMONTH' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['bymonth'] = ' '.join(r_rule_dict.get('BYMONTH'))
-                        if 'BYDAY' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['byday'] = ' '.join(r_rule_dict.get('BYDAY'))
-                        if 'BYHOUR' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['byhour'] = ' '.join(r_rule_dict.get('BYHOUR'))
-                        if 'BYMIN' in r_rule_dict.keys():
-                            item['dates']['recurring_rule']['bymin'] = ' '.join(r_rule_dict.get('BYMIN'))
-
-                    # set timezone info if date is a datetime
-                    if isinstance(component.get('dtstart').dt, datetime.datetime):
-                        item['dates']['tz'] = tzid_from_dt(component.get('dtstart').dt)
-
-                    # add participants
-                    item['participants'] = []
-                    if component.get('attendee'):
-                        for attendee in component.get('attendee'):
-                            if isinstance(attendee, vCalAddress):
-                                item['participants'].append({
-                                    'name': vCalAddress.from_ical(attendee),
-                                    'qcode': ''
-                                })
-
-                    # add organizers
-                    item['organizer'] = [{
-                        'name': component.get('organizer', ''),
-                        'qcode': ''
-                    }]
-
-                    # add location
-                    item['location'] = [{
-                        'name': component.get('location', ''),
-                        'qcode': '',
-                        'geo': ''
-                    }]
-                    if component.get('geo'):
-                        item['location'][0]['geo'] = vGeo.from_ical(component.get('geo').to_ical())
-
-                    # IMPORTANT: firstcreated must be less than 2 days past
-                    # we must preserve the original event created and updated in some other fields
-                    if component.get('created'):
-                        item['event_created'] = component.get('created').dt
-                    if component.get('last-modified'):
-                        item['event_lastmodified'] = component.get('last-modified').dt
-                    item['firstcreated'] = utcnow()
-                    item['versioncreated'] = utcnow()
-                    items.append(item)
-            original_source_ids = [_['original_source'] for _ in items if _.get('original_source', None)]
-            existing_items = list(get_resource_service('events').get_from_mongo(req=None, lookup={
-                'original_source': {'$in': original_source_ids}
-            }))
-
-            def original_source_exists(item):
-                """Return true if the item exists in `existing_items`"""
-                for c in existing_items:
-                    if c['original_source'] == item['original_source']:
-                        if c['dates']['start'] == item['dates']['start']:
-                            return True
-                return False
-
-            def is_future(item):
-                """Return true if the item is reccuring or in the future"""
-                if not item['dates'].get('recurring_rule'):
-                    if item['dates']['start'] < utcnow() - datetime.timedelta(days=1):
-                        return False
-                return True
-
-            items = [_ for _ in items if is_future(_)]
-            items = [_ for _ in items if not original_source_exists(_)]
-            return items
+            # like `parse`, a calendar gives at least one (maybe empty) list
+            if items or not batches:
+                yield self.filter_items(items, provider) if dedup else items
         except Exception as ex:
             raise ParserError.parseMessageError(ex, provider)
+
+    def parse_event(self, component, guid=None):
+        """Convert a VEVENT component to an event item
+
+        :param component: VEVENT component
+        :param str guid: guid of the event, generated if not given
+        """
+        item = {
+            ITEM_TYPE: CONTENT_TYPE.TEXT,
+            GUID_FIELD: guid or generate_guid(type=GUID_NEWSML),
+            FORMAT: FORMATS.PRESERVED
+        }
+        item['name'] = component.get('summary')
+        item['definition_short'] = component.get('summary')
+        item['definition_long'] = component.get('description')
+        item['original_source'] = component.get('uid')
+
+        # add dates
+        # check if component .dt return date instead of datetime, if so, convert to datetime
+        dtstart = component.get('dtstart').dt
+        dates_start = dtstart if isinstance(dtstart, datetime.datetime) \
+            else datetime.datetime.combine(dtstart, datetime.datetime.min.time())
+        if not dates_start.tzinfo:
+            dates_start = utc.localize(dates_start)
+        try:
+            dtend = component.get('dtend').dt
+            dates_end = dtend if isinstance(dtend, datetime.datetime) \
+                else datetime.datetime.combine(dtend, datetime.datetime.min.time())
+            if not dates_end.tzinfo:
+                dates_end = utc.localize(dates_end)
+        except AttributeError:
+            dates_end = None
+        item['dates'] = {
+            'start': dates_start,
+            'end': dates_end,
+            'tz': '',
+            'recurring_rule': {}
+        }
+        # parse ics RRULE to fit eventsML recurring_rule
+        r_rule = component.get('rrule')
+        if isinstance(r_rule, vRecur):
+            r_rule_dict = vRecur.from_ical(r_rule)
+            if 'FREQ' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['frequency'] = ''.join(r_rule_dict.get('FREQ'))
+            if 'INTERVAL' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['interval'] = r_rule_dict.get('INTERVAL')[0]
+            if 'UNTIL' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['until'] = r_rule_dict.get('UNTIL')[0]
+            if 'COUNT' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['count'] = r_rule_dict.get('COUNT')
+            if 'BYMONTH' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['bymonth'] = ' '.join(r_rule_dict.get('BYMONTH'))
+            if 'BYDAY' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['byday'] = ' '.join(r_rule_dict.get('BYDAY'))
+            if 'BYHOUR' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['byhour'] = ' '.join(r_rule_dict.get('BYHOUR'))
+            if 'BYMIN' in r_rule_dict.keys():
+                item['dates']['recurring_rule']['bymin'] = ' '.join(r_rule_dict.get('BYMIN'))
+
+        # set timezone info if date is a datetime
+        if isinstance(component.get('dtstart').dt, datetime.datetime):
+            item['dates']['tz'] = tzid_from_dt(component.get('dtstart').dt)
+
+        # add participants
+        item['participants'] = []
+        if component.get('attendee'):
+            for attendee in component.get('attendee'):
+                if isinstance(attendee, vCalAddress):
+                    item['participants'].append({
+                        'name': vCalAddress.from_ical(attendee),
+                        'qcode': ''
+                    })
+
+        # add organizers
+        item['organizer'] = [{
+            'name': component.get('organizer', ''),
+            'qcode': ''
+        }]
+
+        # add location
+        item['location'] = [{
+            'name': component.get('location', ''),
+            'qcode': '',
+            'geo': ''
+        }]
+        if component.get('geo'):
+            item['location'][0]['geo'] = vGeo.from_ical(component.get('geo').to_ical())
+
+        # IMPORTANT: firstcreated must be less than 2 days past
+        # we must preserve the original event created and updated in some other fields
+        if component.get('created'):
+            item['event_created'] = component.get('created').dt
+        if component.get('last-modified'):
+            item['event_lastmodified'] = component.get('last-modified').dt
+        item['firstcreated'] = utcnow()
+        item['versioncreated'] = utcnow()
+        return item
+
+    def filter_items(self, items, provider=None):
+        """Remove the past events and the events which have already been ingested without changes
+
+        Ingested events are looked up with one query and matched by `original_source` and start date,
+        or by `original_source` only if it identifies a single event, i.e. when its dates changed.
+        The content fingerprints of the parsed items are compared to the ones of the ingested events:
+        unchanged events are removed and changed ones are replaced by a patch of the changed fields.
+
+        :param list items: parsed events
+        :param dict provider: ingest provider
+        :return list: the new events and the patches of the changed events
+        """
+        future_items = [item for item in items if is_future(item)]
+        sources = Counter(item['original_source'] for item in future_items if item.get('original_source'))
+        existing_events = get_existing_events(list(sources))
+
+        new_items = []
+        unchanged = 0
+        changed = 0
+        for item in future_items:
+            item[FINGERPRINT_FIELD] = get_fingerprint(item)
+            event = get_existing_event(item, existing_events, sources)
+            if event is None:
+                new_items.append(item)
+            elif event.get(FINGERPRINT_FIELD) == item[FINGERPRINT_FIELD]:
+                unchanged += 1
+            else:
+                new_items.append(get_event_patch(item, event))
+                changed += 1
+
+        logger.info('Parsed %d events from %s: %d in the past, %d unchanged, %d changed, %d new',
+                    len(items), (provider or {}).get('name', 'ics'), len(items) - len(future_items),
+                    unchanged, changed, len(new_items) - changed)
+        return new_items
+
+
+def iter_vevents(lines):
+    """Tokenize the VEVENT blocks of a calendar incrementally
+
+    Lines are consumed one at a time and every VEVENT block (including its nested
+    components, i.e. VALARM) is parsed on its own as soon as its END line is read.
+
+    :param lines: iterable of the calendar lines, as bytes or str
+    :return: generator of VEVENT components
+    """
+    for block in iter_vevent_blocks(lines):
+        yield Event.from_ical(block)
+
+
+def iter_vevent_blocks(lines):
+    """Split a calendar into its raw VEVENT blocks, to be parsed with `Event.from_ical`
+
+    :param lines: iterable of the calendar lines, as bytes or str
+    :return: generator of the VEVENT blocks, as bytes
+    """
+    block = []
+    depth = 0
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        line = line.rstrip(b'\r\n')
+        # folded lines start with a whitespace, so they never match BEGIN/END
+        token = line.upper()
+
+        if not block:
+            if token.strip() == b'BEGIN:VEVENT':
+                block.append(line)
+                depth = 1
+            continue
+
+        block.append(line)
+        if token.startswith(b'BEGIN:'):
+            depth += 1
+        elif token.startswith(b'END:'):
+            depth -= 1
+            if not depth:
+                yield b'\r\n'.join(block) + b'\r\n'
+                block = []
+
+
+def is_future(item):
+    """Return true if the item is reccuring or in the future"""
+    if not item['dates'].get('recurring_rule'):
+        if item['dates']['start'] < utcnow() - datetime.timedelta(days=1):
+            return False
+    return True
+
+
+def get_event_key(item):
+    """Get the key identifying an ingested event: its `original_source` and its start date in UTC"""
+    start = item.get('dates', {}).get('start')
+    if isinstance(start, datetime.datetime):
+        start = utc.localize(start) if not start.tzinfo else start.astimezone(utc)
+    return item.get('original_source'), start
+
+
+def get_existing_events(original_sources):
+    """Get the events already ingested with any of the given `original_source`
+
+    Only the fields needed to identify the events and compare their content are fetched from mongo.
+
+    :param list original_sources: list of `original_source` values
+    :return dict: lists of existing events by `original_source`
+    """
+    if not original_sources:
+        return {}
+
+    cursor = get_collection('events').find(
+        {'original_source': {'$in': list(set(original_sources))}},
+        projection={'original_source': 1, 'dates.start': 1, GUID_FIELD: 1, 'state': 1, FINGERPRINT_FIELD: 1}
+    )
+    events = {}
+    for event in cursor:
+        events.setdefault(event['original_source'], []).append(event)
+    return events
+
+
+def get_existing_event(item, existing_events, sources):
+    """Find the ingested event of a parsed item
+
+    :param dict item: parsed event
+    :param dict existing_events: lists of existing events by `original_source`
+    :param Counter sources: number of parsed items of every `original_source`
+    :return dict: the existing event or None
+    """
+    events = existing_events.get(item.get('original_source')) or []
+    key = get_event_key(item)
+    for event in events:
+        if get_event_key(event) == key:
+            return event
+
+    # the dates of the event changed
+    if len(events) == 1 and sources[item['original_source']] == 1:
+        return events[0]
+    return None
+
+
+def normalize_value(value):
+    """Convert a parsed value to a json value which only changes if the content changes"""
+    if isinstance(value, dict):
+        return {str(key): normalize_value(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(val) for val in value]
+    if isinstance(value, datetime.datetime):
+        value = utc.localize(value) if not value.tzinfo else value.astimezone(utc)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return ' '.join(str(value).split())
+
+
+def get_fingerprint(item):
+    """Get the content fingerprint of an event: a short hash of every field compared on ingest"""
+    return {
+        field: hashlib.sha1(json.dumps(normalize_value(item.get(field)), sort_keys=True).encode('utf-8'))
+        .hexdigest()[:16]
+        for field in FINGERPRINT_FIELDS
+    }
+
+
+def get_event_patch(item, event):
+    """Get the patch of an ingested event with only the fields which changed
+
+    The patch has the guid of the event so it is applied to it by the ingest.
+    """
+    fingerprint = event.get(FINGERPRINT_FIELD) or {}
+    patch = {field: item.get(field) for field in FINGERPRINT_FIELDS
+             if item[FINGERPRINT_FIELD].get(field) != fingerprint.get(field)}
+    patch.update({
+        ITEM_TYPE: item[ITEM_TYPE],
+        GUID_FIELD: event[GUID_FIELD],
+        FORMAT: item[FORMAT],
+        FINGERPRINT_FIELD: item[FINGERPRINT_FIELD],
+        'versioncreated': item['versioncreated'],
+    })
+    if event.get('state'):
+        # otherwise the ingest sets the state of the event back to ingested
+        patch['state'] = event['state']
+    if event.get('expiry'):
+        # nor the expiry, which is kept by the events service as the ingest sets it again
+        patch['expiry'] = event['expiry']
+    return patch
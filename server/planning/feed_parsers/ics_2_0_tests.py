@@ -1,6 +1,7 @@
-
-from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
+from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser, get_event_key, iter_vevents
 import os
+import datetime
+import pytz
 from icalendar import Calendar
 from planning.tests import TestCase
 
@@ -20,3 +21,86 @@ class IcsTwoFeedParserTestCase(TestCase):
         with self.app.app_context():
             events = IcsTwoFeedParser().parse(self.calendar)
             self.assertTrue(len(events) >= 2)
+
+    def test_ics_feed_parser_skips_ingested_events(self):
+        with self.app.app_context():
+            events = IcsTwoFeedParser().parse(self.calendar)
+            self.assertTrue(len(events) > 0)
+            self.app.data.insert('events', events)
+            self.assertEqual([], IcsTwoFeedParser().parse(self.calendar))
+
+    def test_ics_feed_parser_patches_changed_events(self):
+        with self.app.app_context():
+            events = IcsTwoFeedParser().parse(self.calendar)
+            expiry = datetime.datetime(2029, 1, 1, tzinfo=pytz.utc)
+            for event in events:
+                event['expiry'] = expiry
+            self.app.data.insert('events', events)
+            guids = {event['original_source']: event['guid'] for event in events}
+
+            for component in self.calendar.walk('VEVENT'):
+                component['description'] = 'Changed description'
+            patches = IcsTwoFeedParser().parse(self.calendar)
+            self.assertEqual(len(events), len(patches))
+            for patch in patches:
+                self.assertIn(patch['guid'], guids.values())
+                self.assertEqual('Changed description', patch['definition_long'])
+                self.assertEqual(expiry, patch['expiry'].replace(tzinfo=pytz.utc))
+                self.assertNotIn('name', patch)
+                self.assertNotIn('location', patch)
+
+    def test_ics_feed_parser_patches_moved_events(self):
+        with self.app.app_context():
+            events = IcsTwoFeedParser().parse(self.calendar)
+            self.app.data.insert('events', events)
+
+            component = self.calendar.walk('VEVENT')[0]
+            component['dtstart'].dt += datetime.timedelta(days=1)
+            patches = IcsTwoFeedParser().parse(self.calendar)
+            self.assertEqual(1, len(patches))
+            self.assertEqual(component.get('uid'), [event['original_source'] for event in events
+                                                    if event['guid'] == patches[0]['guid']][0])
+            self.assertIn('dates', patches[0])
+
+    def test_event_key_is_in_utc(self):
+        berlin = pytz.timezone('Europe/Berlin')
+        start = datetime.datetime(2017, 5, 11, 10, 0)
+        self.assertEqual(
+            get_event_key({'original_source': 'uid', 'dates': {'start': berlin.localize(start)}}),
+            get_event_key({'original_source': 'uid', 'dates': {'start': start - datetime.timedelta(hours=2)}})
+        )
+
+    def test_ics_feed_parser_parse_stream(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        with self.app.app_context():
+            with open(os.path.join(dir_path, 'events.ics'), 'rb') as f:
+                batches = list(IcsTwoFeedParser().parse_stream(f, batch_size=1))
+
+            events = IcsTwoFeedParser().parse(self.calendar)
+            self.assertTrue(len(batches) >= len(events))
+            self.assertTrue(all(len(batch) <= 1 for batch in batches))
+            self.assertEqual(
+                [event['original_source'] for event in events],
+                [event['original_source'] for batch in batches for event in batch]
+            )
+
+    def test_iter_vevents(self):
+        lines = [
+            'BEGIN:VCALENDAR',
+            'BEGIN:VEVENT',
+            'UID:event1',
+            'SUMMARY:A long summary which is',
+            '  folded',
+            'BEGIN:VALARM',
+            'ACTION:DISPLAY',
+            'END:VALARM',
+            'END:VEVENT',
+            'BEGIN:VEVENT',
+            'UID:event2',
+            'END:VEVENT',
+            'END:VCALENDAR',
+        ]
+        events = list(iter_vevents(lines))
+        self.assertEqual(['event1', 'event2'], [event.get('uid') for event in events])
+        self.assertEqual('A long summary which is folded', events[0].get('summary'))
+        self.assertEqual(['VALARM'], [alarm.name for alarm in events[0].subcomponents])
@@ -15,9 +15,14 @@ from superdesk.io.feed_parsers import XMLFeedParser
 from superdesk.metadata.item import ITEM_TYPE, CONTENT_TYPE, GUID_FIELD, GUID_NEWSML, FORMAT, FORMATS
 from superdesk.metadata.utils import generate_guid
 from superdesk.utc import utcnow
+from flask import current_app as app
+from planning.feed_parsers.ics_2_0 import BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
+#: Tags of the event elements, under the root element of documents exported in bulk
+EVENT_TAGS = ('event', 'document')
+
 
 class NTBEventXMLFeedParser(XMLFeedParser):
     """NTB Event XML parser.
@@ -34,43 +39,108 @@ class NTBEventXMLFeedParser(XMLFeedParser):
         return True
 
     def parse(self, xml, provider=None, content=None):
-        items = []
         try:
             # parse xml file, only expecting one event per file
-            if not ET.iselement(xml.find('guid')):
-                guid = generate_guid(type=GUID_NEWSML)
-            else:
-                guid = xml.find('guid').text
-
-            item = {
-                ITEM_TYPE: CONTENT_TYPE.TEXT,
-                GUID_FIELD: guid,
-                FORMAT: FORMATS.PRESERVED
-            }
-            item['name'] = xml.find('title').text
-            item['definition_short'] = xml.find('title').text
-            item['definition_long'] = xml.find('content').text
-            item['dates'] = {
-                'start': xml.find('timeStart').text,
-                'end': xml.find('timeEnd').text,
-                'tz': '',
-                'recurring_rule': {}
-            }
-            # add location
-            item['location'] = [{
-                'name': xml.find('location').text,
-                'qcode': '',
-                'geo': ''
-            }]
-            if ET.iselement(xml.find('geo')):
-                geo = xml.find('geo')
-                item['location'][0]['geo'] = '%s, %s' % (geo.find('latitude').text, geo.find('longitude').text)
-            # IMPORTANT: firstcreated must be less than 2 days past
-            # we must preserve the original event created and updated in some other fields
-            item['firstcreated'] = utcnow()
-            item['versioncreated'] = utcnow()
-            items.append(item)
-
-            return items
+            return [self.parse_event(xml)]
         except Exception as ex:
             raise ParserError.parseMessageError(ex, provider)
+
+    def parse_stream(self, source, provider=None, batch_size=None):
+        """Parse a document with one or many events, yielding the events in batches
+
+        The document is read with `iterparse` and every event element is cleared once parsed,
+        so only the current event and the current batch are kept in memory.
+
+        :param source: file name or file object opened in binary mode
+        :param dict provider: ingest provider
+        :param int batch_size: maximum number of parsed events in each batch
+        :return: generator of lists of events
+        """
+        batch_size = batch_size or app.config.get('PLANNING_INGEST_BATCH_SIZE', BATCH_SIZE)
+        try:
+            items = []
+            for element in iter_events(source):
+                items.append(self.parse_event(element))
+                if len(items) >= batch_size:
+                    yield items
+                    items = []
+
+            if items:
+                yield items
+        except Exception as ex:
+            raise ParserError.parseMessageError(ex, provider)
+
+    def parse_event(self, xml, guid=None):
+        """Convert an event element to an event item
+
+        :param xml: event element
+        :param str guid: guid of the event if the element has none, generated if not given
+        """
+        if ET.iselement(xml.find('guid')):
+            guid = xml.find('guid').text
+        elif not guid:
+            guid = generate_guid(type=GUID_NEWSML)
+
+        item = {
+            ITEM_TYPE: CONTENT_TYPE.TEXT,
+            GUID_FIELD: guid,
+            FORMAT: FORMATS.PRESERVED
+        }
+        item['name'] = xml.find('title').text
+        item['definition_short'] = xml.find('title').text
+        item['definition_long'] = xml.find('content').text
+        item['dates'] = {
+            'start': xml.find('timeStart').text,
+            'end': xml.find('timeEnd').text,
+            'tz': '',
+            'recurring_rule': {}
+        }
+        # add location
+        item['location'] = [{
+            'name': xml.find('location').text,
+            'qcode': '',
+            'geo': ''
+        }]
+        if ET.iselement(xml.find('geo')):
+            geo = xml.find('geo')
+            item['location'][0]['geo'] = '%s, %s' % (geo.find('latitude').text, geo.find('longitude').text)
+        # IMPORTANT: firstcreated must be less than 2 days past
+        # we must preserve the original event created and updated in some other fields
+        item['firstcreated'] = utcnow()
+        item['versioncreated'] = utcnow()
+        return item
+
+
+def iter_events(source):
+    """Iterate over the event elements of a document, clearing them once processed
+
+    The root element is the event of single event documents, i.e. ``<document>``. Documents
+    exported in bulk have an event element (``<event>`` or ``<document>``) for every event
+    under their root element. The root of a document without any event element is parsed
+    as an event whatever its tag.
+
+    :param source: file name or file object opened in binary mode
+    :return: generator of event elements, only valid until the next one is read
+    """
+    root = None
+    depth = 0
+    found = False
+    for action, element in ET.iterparse(source, events=('start', 'end')):
+        if action == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1 and element.tag in EVENT_TAGS:
+            found = True
+            yield element
+            # drop the processed events, and anything read before them, from the tree
+            element.clear()
+            root.clear()
+        elif depth == 0 and not found and (element.tag in EVENT_TAGS or len(element)):
+            # like `parse`, a document without event elements is a single event whatever its root
+            if element.tag not in EVENT_TAGS:
+                logger.info('Parsing the <{}> root element as an event'.format(element.tag))
+            yield element
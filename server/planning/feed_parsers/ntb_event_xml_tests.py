@@ -1,6 +1,7 @@
 
+import io
 import xml.etree.ElementTree as ET
-from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
+from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser, iter_events
 from planning.tests import TestCase
 
 
@@ -57,3 +58,32 @@ class NTBEventXMLFeedParserTestCase(TestCase):
             self.assertEqual(
                 {'end': '2016-09-16T16:00:00', 'tz': '', 'start': '2016-09-05T09:00:00', 'recurring_rule': {}},
                 self.event[0].get('dates'))
+
+    def test_ntb_event_xml_feed_parser_parse_stream(self):
+        events = ''.join('<event><title>Event {0}</title><location>Oslo</location><content>Event {0}.</content>'
+                         '<timeStart>2016-09-05T09:00:00</timeStart><timeEnd>2016-09-05T10:00:00</timeEnd></event>'
+                         .format(index) for index in range(5))
+        document = '<?xml version="1.0" encoding="UTF-8"?><events>{}</events>'.format(events).encode('utf-8')
+        with self.app.app_context():
+            batches = list(NTBEventXMLFeedParser().parse_stream(io.BytesIO(document), batch_size=2))
+            self.assertEqual([2, 2, 1], [len(items) for items in batches])
+            self.assertEqual(['Event {}'.format(index) for index in range(5)],
+                             [item['name'] for items in batches for item in items])
+
+            # a single event document gives one event
+            batches = list(NTBEventXMLFeedParser().parse_stream(io.BytesIO(ET.tostring(self.xml))))
+            self.assertEqual(['MARKS XML TEST'], [item['name'] for items in batches for item in items])
+            self.assertEqual('69.65482639999999, 18.96509590000005', batches[0][0]['location'][0]['geo'])
+
+    def test_iter_events_clears_processed_events(self):
+        document = b'<events><event><title>1</title></event><event><title>2</title></event></events>'
+        elements = []
+        for element in iter_events(io.BytesIO(document)):
+            self.assertEqual(element.find('title').text, str(len(elements) + 1))
+            elements.append(element)
+        self.assertEqual([0, 0], [len(element) for element in elements])
+
+    def test_iter_events_any_root(self):
+        document = b'<item><title>1</title><location>Oslo</location></item>'
+        self.assertEqual(['1'], [element.find('title').text for element in iter_events(io.BytesIO(document))])
+        self.assertEqual([], list(iter_events(io.BytesIO(b'<events></events>'))))
@@ -8,23 +8,216 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+import codecs
 import imaplib
-import email
 import io
+import json
 import logging
+import select
+import ssl
+import threading
+import time
 
 from superdesk.errors import IngestEmailError
 from superdesk.io.feeding_services import FeedingService
 from superdesk.upload import url_for_media
-from superdesk.media.media_operations import process_file_from_stream
 from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
 from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
-from xml.etree import ElementTree
-from icalendar import Calendar
+from planning.common import bulk_index_batches
+from planning.feeding_services import pipeline
+from planning.feeding_services.imap_utils import parse_fetch, get_attachment_parts, get_extension, decode_part, \
+    get_uid_set
+from flask import current_app as app
 
 
 logger = logging.getLogger(__name__)
 
+#: Provider field storing the UIDVALIDITY of the mailbox and the last UID ingested
+EMAIL_SYNC = 'email_sync'
+#: Default number of messages fetched with one command, can be changed with ``PLANNING_EMAIL_FETCH_BATCH_SIZE``
+FETCH_BATCH_SIZE = 50
+
+CALENDAR_TYPE = 'text/calendar'
+XML_TYPE = 'text/xml'
+#: Number of bytes fetched to check the type of attachments sent as application/octet-stream
+SNIFF_SIZE = 96
+
+# attachments fetched for each parser, by content type or file extension, and the type of their content
+ATTACHMENT_TYPES = {
+    NTBEventXMLFeedParser: ({XML_TYPE, 'application/xml'}, {'.xml'}, XML_TYPE),
+    IcsTwoFeedParser: ({CALENDAR_TYPE, 'application/ics'}, {'.ics', '.ical', '.icalendar'}, CALENDAR_TYPE),
+}
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+
+def sniff_content_type(content):
+    """Get the type of an attachment from its first bytes
+
+    :param bytes content: the content of the attachment, or its first bytes
+    :return str: `text/calendar`, `text/xml` or None for any other content
+    """
+    head = (content or b'')[:SNIFF_SIZE]
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            head = head[len(bom):].decode(encoding, 'ignore').encode('utf-8')
+            break
+
+    head = head.lstrip().lower()
+    if head.startswith(b'begin:vcalendar'):
+        return CALENDAR_TYPE
+    if head.startswith(b'<') and not head.startswith((b'<!doctype html', b'<html')):
+        return XML_TYPE
+    return None
+
+
+#: Seconds after which the session of a provider not updated anymore is logged out
+SESSION_IDLE_TIMEOUT = 60 * 60
+
+# logged in connections kept between the updates by provider, with the config they were opened for and their last use
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(provider, imap_class=None):
+    """Get the logged in session of a provider
+
+    The session is opened again when the config of the provider changed, and the sessions of the
+    providers not updated for `SESSION_IDLE_TIMEOUT` seconds (i.e. deleted or closed providers) are logged out.
+    """
+    config = provider.get('config') or {}
+    key = str(provider.get('_id') or provider.get('name'))
+    config_key = json.dumps(config, sort_keys=True, default=str)
+    now = time.time()
+
+    with sessions_lock:
+        stale = [k for k, (session_config, _, last_used) in sessions.items()
+                 if (k == key and session_config != config_key) or last_used < now - SESSION_IDLE_TIMEOUT]
+        for k in stale:
+            sessions.pop(k)[1].logout()
+
+        session = sessions[key][1] if key in sessions else IMAPSession(provider, imap_class)
+        session.provider = provider
+        sessions[key] = (config_key, session, now)
+    return session
+
+
+def close_sessions():
+    """Log out all the sessions of this worker"""
+    with sessions_lock:
+        while sessions:
+            sessions.popitem()[1][1].logout()
+
+
+def has_buffered_data(imap):
+    """Check if the connection has data to read without waiting
+
+    imaplib reads the socket through the buffered `imap.file`, so lines sent by the server along with
+    the previous ones may already be in its buffer, where `select` can't see them. The socket is made
+    non blocking while peeking, so the buffer is only filled with what was already received.
+    """
+    sock = imap.sock
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(imap.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def wait_for_data(imap, timeout):
+    """Wait until the server sent something on the connection, without consuming it"""
+    if has_buffered_data(imap):
+        return True
+    return bool(select.select([imap.sock], [], [], timeout)[0])
+
+
+class IMAPSession:
+    """Logged in connection to the mailbox of an email provider
+
+    The connection is checked with NOOP before being reused and opened again if the server closed it.
+    """
+
+    def __init__(self, provider, imap_class=None):
+        """Create a session for the given email ingest provider, not connected yet
+
+        It connects with `imap_class` if given, or `imaplib.IMAP4_SSL`.
+        """
+        self.provider = provider
+        self.imap_class = imap_class
+        self.imap = None
+
+    def get_connection(self):
+        if self.imap is not None:
+            try:
+                if self.imap.noop()[0] == 'OK':
+                    return self.imap
+            except Exception:
+                pass
+            self.logout()
+        return self.connect()
+
+    def connect(self):
+        config = self.provider.get('config', {})
+        imap_class = self.imap_class or imaplib.IMAP4_SSL
+        imap = imap_class(host=config.get('server', ''), port=int(config.get('port', 993)))
+        try:
+            imap.login(config.get('user', None), config.get('password', None))
+        except imaplib.IMAP4.error:
+            raise IngestEmailError.emailLoginError(imaplib.IMAP4.error, self.provider)
+        self.imap = imap
+        return imap
+
+    def logout(self):
+        imap, self.imap = self.imap, None
+        if imap is not None:
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+    def supports_idle(self):
+        return 'IDLE' in getattr(self.imap, 'capabilities', ())
+
+    def idle(self, timeout):
+        """Wait for new messages in the selected mailbox with the IDLE command (RFC 2177)
+
+        :param float timeout: seconds to wait, servers drop IDLE connections after 30 minutes
+        :return bool: True if new messages arrived before the timeout
+        """
+        imap = self.imap
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        if not imap.readline().startswith(b'+'):
+            raise imaplib.IMAP4.error('IDLE was refused')
+
+        received = False
+        deadline = time.time() + timeout
+        while not received:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not wait_for_data(imap, remaining):
+                break
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort('connection closed while idle')
+            received = line.rstrip().upper().endswith((b'EXISTS', b'RECENT'))
+
+        imap.send(b'DONE\r\n')
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort('connection closed while idle')
+            if line.startswith(tag):
+                if line.split()[1].upper() != b'OK':
+                    raise imaplib.IMAP4.error(line.decode('utf-8', 'replace'))
+                return received
+
 
 class EventEmailFeedingService(FeedingService):
     """
@@ -42,73 +235,256 @@ class EventEmailFeedingService(FeedingService):
     """
     service = 'events'
 
+    def __init__(self, imap_class=None):
+        """Create the service, connecting with `imap_class` instead of `imaplib.IMAP4_SSL` if given"""
+        super().__init__()
+        self.imap_class = imap_class
+
+    def update(self, provider, update):
+        # the events saved by the ingest are indexed in elastic once per batch, with bulk requests
+        return bulk_index_batches(self.service, super().update(provider, update))
+
     def _update(self, provider, update):
         config = provider.get('config', {})
-        server = config.get('server', '')
-        port = int(config.get('port', 993))
 
+        # with PLANNING_EMAIL_KEEP_ALIVE, the connection is kept logged in between the updates
+        keep_alive = app.config.get('PLANNING_EMAIL_KEEP_ALIVE', False)
+        session = get_session(provider, self.imap_class) if keep_alive else IMAPSession(provider, self.imap_class)
         try:
-            imap = imaplib.IMAP4_SSL(host=server, port=port)
-            try:
-                imap.login(config.get('user', None), config.get('password', None))
-            except imaplib.IMAP4.error:
-                raise IngestEmailError.emailLoginError(imaplib.IMAP4.error, provider)
-
+            imap = session.get_connection()
             rv, data = imap.select(config.get('mailbox', None), readonly=False)
             if rv == 'OK':
-                rv, data = imap.search(None, config.get('filter', '(UNSEEN)'))
-                if rv == 'OK':
-                    new_items = []
-                    for num in data[0].split():
-                        rv, data = imap.fetch(num, '(RFC822)')
-                        if rv == 'OK':
-                            try:
-                                logger.info('Ingesting events from email')
-                                parser = self.get_feed_parser(provider, data)
-                                for response_part in data:
-                                    if isinstance(response_part, tuple):
-                                        if isinstance(response_part[1], bytes):
-                                            msg = email.message_from_bytes(response_part[1])
-                                        else:
-                                            msg = email.message_from_string(response_part[1])
-                                        # this will loop through all the available multiparts in email
-                                        for part in msg.walk():
-                                            # parse attached files only
-                                            if part.get('Content-Disposition') is None:
-                                                continue
-                                            fileName = part.get_filename()
-                                            if bool(fileName):
-                                                attachment = part.get_payload(decode=True)
-                                                content = io.BytesIO(attachment)
-                                                res = process_file_from_stream(content, part.get_content_type())
-                                                file_name, content_type, metadata = res
-                                                if isinstance(parser, NTBEventXMLFeedParser):
-                                                    if content_type != 'text/xml':
-                                                        continue
-                                                    content.seek(0)
-                                                    xml = ElementTree.parse(content)
-                                                    logger.info('Ingesting events with xml parser')
-                                                    new_items.append(parser.parse(xml.getroot(), provider))
-                                                elif isinstance(parser, IcsTwoFeedParser):
-                                                    if content_type != 'text/calendar':
-                                                        continue
-                                                    content.seek(0)
-                                                    cal = Calendar.from_ical(content.read())
-                                                    logger.info('Ingesting events with ics parser')
-                                                    new_items.append(parser.parse(cal, provider))
-                                                else:
-                                                    logger.warn('Ingesting events with unknown parser')
-                                                    new_items.append(parser.parse(data, provider))
-                                rv, data = imap.store(num, '+FLAGS', '\\Seen')
-                            except IngestEmailError:
-                                continue
-                imap.close()
-            imap.logout()
+                yield from self._ingest_messages(imap, provider, update)
+                if not keep_alive:
+                    imap.close()
+            if not keep_alive:
+                session.logout()
+        except GeneratorExit:
+            # the update was stopped before all the messages were ingested
+            session.logout()
+            raise
         except IngestEmailError:
+            session.logout()
             raise
         except Exception as ex:
+            session.logout()
             raise IngestEmailError.emailError(ex, provider)
-        return new_items
+
+    def _ingest_messages(self, imap, provider, update):
+        """Yield the items of the new messages of the selected mailbox, message by message
+
+        The messages are flagged as seen once their items were saved, i.e. once the next items are
+        asked for, with one command for every batch of messages fetched. If the update stops before,
+        the messages not flagged yet are ingested again on the next update.
+        """
+        sync = self._get_sync_state(provider, imap)
+        uids = self._search(imap, provider.get('config', {}), sync)
+        parser = self.get_feed_parser(provider)
+        batch_size = app.config.get('PLANNING_EMAIL_FETCH_BATCH_SIZE', FETCH_BATCH_SIZE)
+        failed = []
+        if pipeline.is_enabled() and isinstance(parser, tuple(ATTACHMENT_TYPES)):
+            yield from self._ingest_messages_pipeline(imap, provider, parser, uids, batch_size, failed)
+        else:
+            for index in range(0, len(uids), batch_size):
+                ingested = []
+                for uid, attachments in self._fetch_attachments(imap, parser, uids[index:index + batch_size]):
+                    try:
+                        logger.info('Ingesting events from email')
+                        for attachment in attachments:
+                            yield from self._parse_attachment(parser, provider, attachment)
+                        ingested.append(uid)
+                    except IngestEmailError:
+                        failed.append(uid)
+
+                if ingested:
+                    imap.uid('STORE', get_uid_set(ingested), '+FLAGS', '(\\Seen)')
+
+        # failed messages are searched again on the next update
+        if update is not None:
+            update[EMAIL_SYNC] = {
+                'uidvalidity': sync['uidvalidity'],
+                'last_uid': min(failed) - 1 if failed else max(uids + [sync['last_uid']])
+            }
+
+    def _ingest_messages_pipeline(self, imap, provider, parser, uids, batch_size, failed):
+        """Yield the items of the messages with an :class:`IngestPipeline`
+
+        The messages are fetched by the fetch stage while the messages fetched before are parsed and
+        saved, the connection being used by one thread at a time.
+        """
+        lock = threading.Lock()
+        ingested = []
+
+        def fetch():
+            for index in range(0, len(uids), batch_size):
+                with lock:
+                    messages = self._fetch_attachments(imap, parser, uids[index:index + batch_size])
+                yield from messages
+
+        def parse(message):
+            logger.info('Ingesting events from email')
+            for attachment in message[1]:
+                yield from self._parse_attachment(parser, provider, attachment, dedup=False)
+
+        def flag_messages():
+            with lock:
+                imap.uid('STORE', get_uid_set(ingested), '+FLAGS', '(\\Seen)')
+            ingested[:] = []
+
+        def on_done(message):
+            ingested.append(message[0])
+            if len(ingested) >= batch_size:
+                flag_messages()
+
+        def on_error(message, ex):
+            if not isinstance(ex, IngestEmailError):
+                raise ex
+            failed.append(message[0])
+
+        yield from pipeline.IngestPipeline(
+            parse=parse,
+            dedup=lambda items: pipeline.dedup_events(parser, items, provider),
+            on_done=on_done,
+            on_error=on_error
+        ).run(fetch())
+
+        if ingested:
+            flag_messages()
+
+    def _get_sync_state(self, provider, imap):
+        """Get the last UID ingested from the selected mailbox
+
+        The UIDs are only valid as long as the UIDVALIDITY of the mailbox does not change,
+        if it does the mailbox is searched from the start.
+        """
+        sync = provider.get(EMAIL_SYNC) or {}
+        code, data = imap.response('UIDVALIDITY')
+        uidvalidity = int(data[0]) if data and data[0] else None
+        if uidvalidity is None or sync.get('uidvalidity') != uidvalidity:
+            return {'uidvalidity': uidvalidity, 'last_uid': 0}
+        return {'uidvalidity': uidvalidity, 'last_uid': sync.get('last_uid') or 0}
+
+    def _search(self, imap, config, sync):
+        """Get the UIDs of the messages received after the last UID ingested which match the filter"""
+        rv, data = imap.uid('SEARCH', 'UID', '{}:*'.format(sync['last_uid'] + 1), config.get('filter', '(UNSEEN)'))
+        if rv != 'OK' or not data:
+            return []
+        # `last:*` always matches the last message of the mailbox, even if it was already ingested
+        return sorted(uid for uid in (int(uid) for uid in (data[0] or b'').split()) if uid > sync['last_uid'])
+
+    def _fetch_attachments(self, imap, parser, uids):
+        """Fetch the attachments of a batch of messages
+
+        The BODYSTRUCTURE of all the messages is fetched with one command, then only the attachment
+        parts the parser can ingest are fetched, with one command for the messages having the same parts.
+
+        :return list: (uid, attachments) of every message, attachments having their decoded `content`
+        """
+        rv, data = imap.uid('FETCH', get_uid_set(uids), '(BODYSTRUCTURE)')
+        if rv != 'OK':
+            return []
+
+        structures = parse_fetch(data)
+        messages = []
+        for uid in uids:
+            if uid in structures:
+                attachments = []
+                for attachment in get_attachment_parts(structures[uid].get('BODYSTRUCTURE')):
+                    match = self._match_attachment(parser, attachment)
+                    if match is not False:
+                        attachment['sniff'] = match is None
+                        attachments.append(attachment)
+                messages.append((uid, attachments))
+
+        if not isinstance(parser, tuple(ATTACHMENT_TYPES)):
+            for uid, attachments in messages:
+                if attachments:
+                    rv, data = imap.uid('FETCH', str(uid), '(RFC822)')
+                    attachments[:] = [{'data': data}] if rv == 'OK' else []
+            return messages
+
+        self._sniff_attachments(imap, parser, messages)
+
+        groups = {}
+        for uid, attachments in messages:
+            if attachments:
+                groups.setdefault(tuple(attachment['part'] for attachment in attachments), []).append(uid)
+
+        contents = {}
+        for parts, group in groups.items():
+            items = ' '.join('BODY.PEEK[{}]'.format(part) for part in parts)
+            rv, data = imap.uid('FETCH', get_uid_set(group), '({})'.format(items))
+            if rv == 'OK':
+                contents.update(parse_fetch(data))
+
+        for uid, attachments in messages:
+            for attachment in attachments:
+                payload = contents.get(uid, {}).get('BODY[{}]'.format(attachment['part']))
+                attachment['content'] = decode_part(payload, attachment['encoding'])
+        return messages
+
+    def _match_attachment(self, parser, attachment):
+        """Check if an attachment can be ingested by the parser from its MIME type and filename
+
+        :return: True if it can, False if it can't and None if its content must be checked (i.e. octet-stream)
+        """
+        for parser_class, (content_types, extensions, sniffed_type) in ATTACHMENT_TYPES.items():
+            if isinstance(parser, parser_class):
+                if attachment['content_type'] in content_types or \
+                        get_extension(attachment['filename']) in extensions:
+                    return True
+                return None if attachment['content_type'] == 'application/octet-stream' else False
+        return True
+
+    def _sniff_attachments(self, imap, parser, messages):
+        """Only keep the attachments to check which start like the content ingested by the parser
+
+        Only the first bytes of these attachments are fetched, with one command for the messages having the
+        same attachments to check.
+        """
+        groups = {}
+        for uid, attachments in messages:
+            parts = tuple(attachment['part'] for attachment in attachments if attachment['sniff'])
+            if parts:
+                groups.setdefault(parts, []).append(uid)
+
+        heads = {}
+        for parts, group in groups.items():
+            items = ' '.join('BODY.PEEK[{}]<0.{}>'.format(part, SNIFF_SIZE) for part in parts)
+            rv, data = imap.uid('FETCH', get_uid_set(group), '({})'.format(items))
+            if rv == 'OK':
+                heads.update(parse_fetch(data))
+
+        sniffed_type = self._get_sniffed_type(parser)
+        for uid, attachments in messages:
+            attachments[:] = [
+                attachment for attachment in attachments
+                if not attachment['sniff'] or sniffed_type == sniff_content_type(decode_part(
+                    heads.get(uid, {}).get('BODY[{}]<0>'.format(attachment['part'])), attachment['encoding']))
+            ]
+
+    def _get_sniffed_type(self, parser):
+        for parser_class, (content_types, extensions, sniffed_type) in ATTACHMENT_TYPES.items():
+            if isinstance(parser, parser_class):
+                return sniffed_type
+
+    def _parse_attachment(self, parser, provider, attachment, dedup=True):
+        """Yield the items of an attachment in batches, without the ingested items if `dedup`"""
+        if 'data' in attachment:
+            logger.warn('Ingesting events with unknown parser')
+            yield parser.parse(attachment['data'], provider)
+            return
+
+        # the attachment is only parsed if it really is a calendar or an xml document
+        if sniff_content_type(attachment['content']) != self._get_sniffed_type(parser):
+            return
+
+        logger.info('Ingesting events with {} parser'.format(
+            'xml' if isinstance(parser, NTBEventXMLFeedParser) else 'ics'))
+        if dedup:
+            yield from parser.parse_stream(io.BytesIO(attachment['content']), provider)
+        else:
+            yield from pipeline.parse_events(parser, io.BytesIO(attachment['content']), provider)
 
     def prepare_href(self, href, mimetype=None):
         return url_for_media(href, mimetype)
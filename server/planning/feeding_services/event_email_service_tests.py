@@ -1,7 +1,28 @@
+import codecs
 import imaplib
+import os
+import socket
+import types
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 from mock import Mock, patch
-from planning.feeding_services.event_email_service import EventEmailFeedingService
+from planning.feeding_services.event_email_service import EventEmailFeedingService, EMAIL_SYNC, IMAPSession, \
+    sniff_content_type, wait_for_data, get_session, close_sessions, sessions
 from planning.tests import TestCase
+from planning.commands.local_imap import LocalIMAP
+
+
+def get_message(attachment=None, filename='events.ics', content_type='text/calendar'):
+    message = MIMEMultipart()
+    message['Subject'] = 'Events'
+    message.attach(MIMEText('See attached events'))
+    if attachment:
+        part = MIMEApplication(attachment, _subtype=content_type.split('/')[1])
+        part.replace_header('Content-Type', '{}; name="{}"'.format(content_type, filename))
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        message.attach(part)
+    return message.as_bytes()
 
 
 class EventEmailFeedingServiceTestCase(TestCase):
@@ -32,5 +53,163 @@ class EventEmailFeedingServiceTestCase(TestCase):
             mock_conn.search.return_value = ('OK', ['(UNSEEN SUBJECT "test subject")'])
             mock_conn.fetch.return_value = ('OK', [('1 (RFC822 {858569}', 'body of the message', ')')])
             mock_conn.store.return_value = ('OK', [])
+            mock_conn.response.return_value = ('UIDVALIDITY', [b'1'])
+            mock_conn.uid.return_value = ('OK', [b''])
             events = list(service._update(provider, None))
             self.assertEqual(len(events), 0)
+
+    def get_calendar(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(dir_path, '..', 'feed_parsers', 'events.ics'), 'rb') as f:
+            return f.read()
+
+    def get_provider(self, **kwargs):
+        provider = {
+            'feed_parser': 'ics20',
+            'config': {'server': 'localhost', 'user': 'user', 'password': 'pass', 'mailbox': 'INBOX',
+                       'filter': '(UNSEEN)'}
+        }
+        provider.update(kwargs)
+        return provider
+
+    def test_update_uid_sync(self):
+        imap = LocalIMAP([get_message(self.get_calendar()), get_message()])
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            provider = self.get_provider()
+            update = {}
+            items = list(EventEmailFeedingService()._update(provider, update))
+
+            self.assertTrue(len(items) > 0)
+            self.assertEqual({'uidvalidity': 1, 'last_uid': 2}, update[EMAIL_SYNC])
+            self.assertEqual({'\\Seen'}, imap.messages[1]['flags'])
+            self.assertEqual({'\\Seen'}, imap.messages[2]['flags'])
+
+            commands = [command for command in imap.commands if command[0] in ('FETCH', 'STORE')]
+            self.assertEqual([
+                ('FETCH', '1:2', '(BODYSTRUCTURE)'),
+                ('FETCH', '1', '(BODY.PEEK[2])'),
+                ('STORE', '1:2', '+FLAGS', '(\\Seen)'),
+            ], commands)
+
+            # only the new messages are fetched
+            imap.commands = []
+            imap.add_message(get_message())
+            provider[EMAIL_SYNC] = update[EMAIL_SYNC]
+            update = {}
+            self.assertEqual([], list(EventEmailFeedingService()._update(provider, update)))
+            self.assertEqual({'uidvalidity': 1, 'last_uid': 3}, update[EMAIL_SYNC])
+            self.assertIn(('FETCH', '3', '(BODYSTRUCTURE)'), imap.commands)
+
+    def test_update_flags_messages_once_saved(self):
+        imap = LocalIMAP([get_message(self.get_calendar()), get_message(self.get_calendar())])
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            self.app.config['PLANNING_EMAIL_FETCH_BATCH_SIZE'] = 1
+            items = EventEmailFeedingService()._update(self.get_provider(), {})
+
+            next(items)
+            self.assertEqual(set(), imap.messages[1]['flags'])
+            next(items)
+            self.assertEqual({'\\Seen'}, imap.messages[1]['flags'])
+            self.assertEqual(set(), imap.messages[2]['flags'])
+
+            # the message is ingested again on the next update if this one stops
+            items.close()
+            self.assertEqual(set(), imap.messages[2]['flags'])
+            self.assertIn(('LOGOUT',), imap.commands)
+
+    def test_update_uidvalidity_changed(self):
+        imap = LocalIMAP([get_message(self.get_calendar())], uidvalidity=2)
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            provider = self.get_provider(**{EMAIL_SYNC: {'uidvalidity': 1, 'last_uid': 10}})
+            update = {}
+            items = list(EventEmailFeedingService()._update(provider, update))
+
+            self.assertTrue(len(items) > 0)
+            self.assertEqual({'uidvalidity': 2, 'last_uid': 1}, update[EMAIL_SYNC])
+
+    def test_update_skips_other_attachments(self):
+        imap = LocalIMAP([get_message(b'%PDF-1.4', filename='agenda.pdf', content_type='application/pdf')])
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            self.assertEqual([], list(EventEmailFeedingService()._update(self.get_provider(), {})))
+            self.assertNotIn('(BODY.PEEK[2])', [command[-1] for command in imap.commands])
+
+    def test_update_sniffs_octet_stream_attachments(self):
+        imap = LocalIMAP([
+            get_message(self.get_calendar(), filename='invite', content_type='application/octet-stream'),
+            get_message(b'<!DOCTYPE html><html></html>', filename='page', content_type='application/octet-stream'),
+        ])
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            items = list(EventEmailFeedingService()._update(self.get_provider(), {}))
+
+            self.assertTrue(len(items) > 0)
+            commands = [command for command in imap.commands if command[0] == 'FETCH']
+            self.assertEqual([
+                ('FETCH', '1:2', '(BODYSTRUCTURE)'),
+                ('FETCH', '1:2', '(BODY.PEEK[2]<0.96>)'),
+                ('FETCH', '1', '(BODY.PEEK[2])'),
+            ], commands)
+
+    def test_sniff_content_type(self):
+        self.assertEqual('text/calendar', sniff_content_type(b'BEGIN:VCALENDAR\r\nVERSION:2.0'))
+        self.assertEqual('text/calendar', sniff_content_type(codecs.BOM_UTF8 + b'\r\nbegin:vcalendar'))
+        self.assertEqual('text/calendar',
+                         sniff_content_type(codecs.BOM_UTF16_LE + 'BEGIN:VCALENDAR'.encode('utf-16-le')))
+        self.assertEqual('text/xml', sniff_content_type(b'<?xml version="1.0"?><document/>'))
+        self.assertEqual('text/xml', sniff_content_type(b'  <document/>'))
+        self.assertIsNone(sniff_content_type(b'<!DOCTYPE html><html></html>'))
+        self.assertIsNone(sniff_content_type(b'%PDF-1.4'))
+        self.assertIsNone(sniff_content_type(b''))
+
+    def test_update_keep_alive(self):
+        self.addCleanup(close_sessions)
+        imap = LocalIMAP([get_message()])
+        with self.app.app_context(), patch.object(imaplib, 'IMAP4_SSL', imap):
+            self.app.config['PLANNING_EMAIL_KEEP_ALIVE'] = True
+            provider = self.get_provider(_id='keep_alive')
+            list(EventEmailFeedingService()._update(provider, {}))
+            list(EventEmailFeedingService()._update(provider, {}))
+
+            commands = [command[0] for command in imap.commands]
+            self.assertEqual(1, commands.count('LOGIN'))
+            self.assertEqual(2, commands.count('SELECT'))
+            self.assertNotIn('LOGOUT', commands)
+
+    @patch('planning.feeding_services.event_email_service.wait_for_data', lambda imap, timeout: bool(imap.lines))
+    def test_session_idle(self):
+        imap = LocalIMAP()
+        with patch.object(imaplib, 'IMAP4_SSL', imap):
+            session = IMAPSession(self.get_provider())
+            session.get_connection().select('INBOX')
+            self.assertTrue(session.supports_idle())
+            self.assertFalse(session.idle(1))
+
+            imap.add_message(get_message())
+            self.assertTrue(session.idle(1))
+            self.assertEqual([('IDLE',), ('DONE',), ('IDLE',), ('DONE',)],
+                             [command for command in imap.commands if command[0] in ('IDLE', 'DONE')])
+
+    def test_session_config_changed(self):
+        self.addCleanup(close_sessions)
+        session = get_session(self.get_provider(_id='p1'))
+        self.assertIs(session, get_session(self.get_provider(_id='p1')))
+
+        provider = self.get_provider(_id='p1')
+        provider['config']['user'] = 'other'
+        self.assertIsNot(session, get_session(provider))
+        self.assertEqual(1, len(sessions))
+
+    def test_wait_for_data(self):
+        server, client = socket.socketpair()
+        self.addCleanup(server.close)
+        self.addCleanup(client.close)
+        imap = types.SimpleNamespace(sock=client, file=client.makefile('rb'))
+        self.addCleanup(imap.file.close)
+
+        self.assertFalse(wait_for_data(imap, 0.01))
+        server.sendall(b'+ idling\r\n* 1 EXISTS\r\n')
+        self.assertTrue(wait_for_data(imap, 1))
+        self.assertEqual(b'+ idling\r\n', imap.file.readline())
+        # the untagged response was read along with the continuation, it is only in the buffer
+        self.assertTrue(wait_for_data(imap, 0.01))
+        self.assertEqual(b'* 1 EXISTS\r\n', imap.file.readline())
+        self.assertFalse(wait_for_data(imap, 0.01))
@@ -8,22 +8,35 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+import billiard
+import collections
+import hashlib
 import logging
 import os
+import pickle
 from datetime import datetime
-
 from xml.etree import ElementTree
+
+from icalendar import Event
 from superdesk.errors import ParserError, ProviderError
 from superdesk.io.feeding_services.file_service import FileFeedingService
-from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
-from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
+from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser, iter_events
+from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser, iter_vevent_blocks, BATCH_SIZE
+from planning.common import bulk_index_batches
+from planning.feeding_services import pipeline
+from superdesk.metadata.item import GUID_NEWSML
+from superdesk.metadata.utils import generate_guid
 from superdesk.notification import push_notification
 from superdesk.utc import utc
-from superdesk.utils import get_sorted_files, FileSortAttributes
-from icalendar import Calendar
+from superdesk import get_resource_service
+from flask import current_app as app
+from eve.utils import config
 
 logger = logging.getLogger(__name__)
 
+#: Provider field listing the files which failed to be ingested, with their size, modified time and hash
+SCAN_MANIFEST = 'scan_manifest'
+
 
 class EventFileFeedingService(FileFeedingService):
     """
@@ -46,6 +59,10 @@ class EventFileFeedingService(FileFeedingService):
     """
     service = 'events'
 
+    def update(self, provider, update):
+        # the events saved by the ingest are indexed in elastic once per batch, with bulk requests
+        return bulk_index_batches(self.service, super().update(provider, update))
+
     def _update(self, provider, update):
         self.provider = provider
         self.path = provider.get('config', {}).get('path', None)
@@ -56,44 +73,279 @@ class EventFileFeedingService(FileFeedingService):
             return []
 
         registered_parser = self.get_feed_parser(provider)
-        for filename in get_sorted_files(self.path, sort_by=FileSortAttributes.created):
+        workers = app.config.get('PLANNING_INGEST_FILE_WORKERS', 0)
+        self.manifest = {entry['name']: entry for entry in provider.get(SCAN_MANIFEST) or []}
+        try:
+            files = self._get_files(provider)
+            if pipeline.is_enabled() and isinstance(registered_parser, (NTBEventXMLFeedParser, IcsTwoFeedParser)):
+                yield from self._update_pipeline(provider, registered_parser, files)
+            elif workers > 1 and isinstance(registered_parser, (NTBEventXMLFeedParser, IcsTwoFeedParser)):
+                yield from self._update_parallel(provider, registered_parser, workers, files)
+            else:
+                yield from self._update_files(provider, registered_parser, files)
+        finally:
+            self._save_manifest(provider)
+
+        push_notification('ingest:update')
+
+    def _update_files(self, provider, registered_parser, files):
+        for filename, last_updated, stat in files:
             try:
-                last_updated = None
                 file_path = os.path.join(self.path, filename)
-                if os.path.isfile(file_path):
-                    stat = os.lstat(file_path)
-                    last_updated = datetime.fromtimestamp(stat.st_mtime, tz=utc)
-
-                    if self.is_latest_content(last_updated, provider.get('last_updated')):
-                        if isinstance(registered_parser, NTBEventXMLFeedParser):
-                            logger.info('Ingesting xml events')
-                            with open(file_path, 'rb') as f:
-                                xml = ElementTree.parse(f)
-                                parser = self.get_feed_parser(provider, xml.getroot())
-                                item = parser.parse(xml.getroot(), provider)
-                        elif isinstance(registered_parser, IcsTwoFeedParser):
-                            logger.info('Ingesting ics events')
-                            with open(file_path, 'rb') as f:
-                                cal = Calendar.from_ical(f.read())
-                                parser = self.get_feed_parser(provider, cal)
-                                item = parser.parse(cal, provider)
-                        else:
-                            logger.info('Ingesting events with unknown parser')
-                            parser = self.get_feed_parser(provider, file_path)
-                            item = parser.parse(file_path, provider)
-
-                        self.after_extracting(item, provider)
-                        self.move_file(self.path, filename, provider=provider, success=True)
-
-                        if isinstance(item, list):
-                            yield item
-                        else:
-                            yield [item]
-                    else:
-                        self.move_file(self.path, filename, provider=provider, success=True)
+                if isinstance(registered_parser, (NTBEventXMLFeedParser, IcsTwoFeedParser)):
+                    logger.info('Ingesting {} events'.format(
+                        'xml' if isinstance(registered_parser, NTBEventXMLFeedParser) else 'ics'))
+                    # the file is read and ingested in batches, it is moved once all are done
+                    with open(file_path, 'rb') as f:
+                        for items in registered_parser.parse_stream(f, provider):
+                            self.after_extracting(items, provider)
+                            yield items
+                    self.move_file(self.path, filename, provider=provider, success=True)
+                    continue
+                else:
+                    logger.info('Ingesting events with unknown parser')
+                    parser = self.get_feed_parser(provider, file_path)
+                    item = parser.parse(file_path, provider)
+
+                self.after_extracting(item, provider)
+                self.move_file(self.path, filename, provider=provider, success=True)
+
+                if isinstance(item, list):
+                    yield item
+                else:
+                    yield [item]
             except Exception as ex:
-                if last_updated and self.is_old_content(last_updated):
-                    self.move_file(self.path, filename, provider=provider, success=False)
+                self._on_file_error(provider, filename, last_updated, stat)
                 raise ParserError.parseFileError('{}-{}'.format(provider['name'], self.NAME), filename, ex, provider)
 
-        push_notification('ingest:update')
+    def _update_pipeline(self, provider, parser, files):
+        """Ingest the files with an :class:`IngestPipeline`, a file is moved once all its items were saved"""
+        def parse(file):
+            with open(os.path.join(self.path, file[0]), 'rb') as f:
+                yield from pipeline.parse_events(parser, f, provider)
+
+        def dedup(items):
+            items = pipeline.dedup_events(parser, items, provider)
+            self.after_extracting(items, provider)
+            return items
+
+        def on_done(file):
+            self.move_file(self.path, file[0], provider=provider, success=True)
+
+        def on_error(file, ex):
+            filename, last_updated, stat = file
+            self._on_file_error(provider, filename, last_updated, stat)
+            raise ParserError.parseFileError('{}-{}'.format(provider['name'], self.NAME), filename, ex, provider)
+
+        yield from pipeline.IngestPipeline(parse, dedup, on_done, on_error).run(files)
+
+    def _update_parallel(self, provider, parser, workers, files):
+        """Parse the files with a pool of `workers` processes
+
+        The files are split in chunks of ``PLANNING_INGEST_BATCH_SIZE`` raw events, parsed by the worker
+        processes, and up to ``2 * workers`` chunks are parsed at a time. The batches are yielded in the
+        created order of the files and checked against the ingested events just before, in this process,
+        so they see the events of the previous batches. A file is moved only once all its batches were saved.
+        """
+        batch_size = app.config.get('PLANNING_INGEST_BATCH_SIZE', BATCH_SIZE)
+        pending = collections.deque()
+        # billiard, unlike multiprocessing, can start processes from the daemonic celery workers
+        pool = billiard.Pool(processes=workers)
+        try:
+            for file in files:
+                failed = False
+                for chunk in self._get_event_chunks(parser, file, batch_size):
+                    failed = isinstance(chunk, Exception)
+                    result = None if failed else pool.apply_async(parse_events, (type(parser), chunk))
+                    pending.append((file, chunk, result))
+                    if len(pending) >= 2 * workers:
+                        yield from self._get_parsed_batches(provider, parser, pending)
+                if failed:
+                    break
+                pending.append((file, None, None))
+
+            while pending:
+                yield from self._get_parsed_batches(provider, parser, pending)
+        finally:
+            # only the chunks in flight are left to parse, terminating a pool just started may hang
+            pool.close()
+            pool.join()
+
+    def _get_event_chunks(self, parser, file, batch_size):
+        """Read a file in chunks of raw events, with the guids of the events without one
+
+        An error reading the file is the last chunk, so it is raised once the previous batches were saved.
+        """
+        try:
+            with open(os.path.join(self.path, file[0]), 'rb') as f:
+                if isinstance(parser, IcsTwoFeedParser):
+                    events = iter_vevent_blocks(f)
+                else:
+                    events = (ElementTree.tostring(element) for element in iter_events(f))
+
+                chunk = []
+                for event in events:
+                    chunk.append((generate_guid(type=GUID_NEWSML), event))
+                    if len(chunk) >= batch_size:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
+        except Exception as ex:
+            yield ex
+
+    def _get_parsed_batches(self, provider, parser, pending):
+        """Yield the batch of the first pending chunk, or move its file once all its chunks were saved"""
+        file, chunk, result = pending.popleft()
+        filename, last_updated, stat = file
+        if chunk is None:
+            self.move_file(self.path, filename, provider=provider, success=True)
+            return
+
+        try:
+            if isinstance(chunk, Exception):
+                raise chunk
+            items = result.get()
+            if items is None:
+                # the events can't be sent back by the worker, i.e. with the custom timezones of a calendar
+                items = parse_raw_events(parser, chunk)
+            if isinstance(parser, IcsTwoFeedParser):
+                items = parser.filter_items(items, provider)
+            self.after_extracting(items, provider)
+        except Exception as ex:
+            self._on_file_error(provider, filename, last_updated, stat)
+            raise ParserError.parseFileError('{}-{}'.format(provider['name'], self.NAME), filename, ex, provider)
+
+        yield items
+
+    def _get_files(self, provider):
+        """Get the files to ingest, in their created order
+
+        Files older than the last update of the provider are moved to _PROCESSED. Files which failed
+        to be ingested are recorded in the scan manifest of the provider, and skipped without being
+        opened as long as their size and modified time (or content) do not change.
+
+        :return list: (filename, last updated datetime, stat result) of the files to ingest
+        """
+        files = []
+        self.scanned = set()
+        for filename, stat in get_sorted_files(self.path):
+            self.scanned.add(filename)
+            last_updated = datetime.fromtimestamp(stat.st_mtime, tz=utc)
+            entry = self.manifest.get(filename)
+            if entry and not self._has_changed(entry, filename, stat):
+                if self.is_old_content(last_updated):
+                    self.move_file(self.path, filename, provider=provider, success=False)
+                    self.manifest.pop(filename)
+                continue
+
+            self.manifest.pop(filename, None)
+            if self.is_latest_content(last_updated, provider.get('last_updated')):
+                files.append((filename, last_updated, stat))
+            else:
+                self.move_file(self.path, filename, provider=provider, success=True)
+
+        return files
+
+    def _has_changed(self, entry, filename, stat):
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return False
+
+        # the file was touched or rewritten, it is only read if the size is the same
+        if entry['size'] != stat.st_size or entry['hash'] != get_file_hash(os.path.join(self.path, filename)):
+            return True
+
+        entry['mtime'] = stat.st_mtime
+        return False
+
+    def _on_file_error(self, provider, filename, last_updated, stat):
+        if self.is_old_content(last_updated):
+            self.move_file(self.path, filename, provider=provider, success=False)
+            return
+
+        try:
+            file_hash = get_file_hash(os.path.join(self.path, filename))
+        except OSError:
+            return
+
+        self.manifest[filename] = {
+            'name': filename,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': file_hash
+        }
+
+    def _save_manifest(self, provider):
+        """Save the scan manifest of the provider, without the files which are not in the directory anymore"""
+        scanned = getattr(self, 'scanned', set())
+        manifest = [self.manifest[name] for name in sorted(self.manifest) if name in scanned]
+        if manifest == (provider.get(SCAN_MANIFEST) or []):
+            return
+
+        provider[SCAN_MANIFEST] = manifest
+        if provider.get(config.ID_FIELD):
+            get_resource_service('ingest_providers').system_update(provider[config.ID_FIELD],
+                                                                   {SCAN_MANIFEST: manifest}, provider)
+
+
+def get_sorted_files(path):
+    """Get the files of a directory in their created order, with their stat result
+
+    The directory is listed once with `os.scandir`, and the stat result of every file is kept
+    for the checks of the scan manifest, so each file is stat'ed once per poll.
+
+    :param str path: path of the directory
+    :return list: (filename, stat result) of the files
+    """
+    files = []
+    for entry in os.scandir(path):
+        try:
+            if entry.is_file():
+                files.append((entry.name, entry.stat()))
+        except OSError:
+            # the file was removed since the directory was listed
+            continue
+    return sorted(files, key=lambda file: file[1].st_ctime)
+
+
+def get_file_hash(file_path):
+    """Get the sha1 hash of the content of a file"""
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def parse_raw_events(parser, events):
+    """Parse a chunk of raw events read by `EventFileFeedingService._get_event_chunks`
+
+    :param parser: IcsTwoFeedParser or NTBEventXMLFeedParser instance
+    :param list events: (guid, raw event) pairs, the guid is used for the events without one
+    :return list: parsed events, not checked against the ingested events
+    """
+    if isinstance(parser, IcsTwoFeedParser):
+        return [parser.parse_event(Event.from_ical(event), guid=guid) for guid, event in events]
+    return [parser.parse_event(ElementTree.fromstring(event), guid=guid) for guid, event in events]
+
+
+def parse_events(parser_class, events):
+    """Parse a chunk of raw events, run in the worker processes of `EventFileFeedingService`
+
+    The workers have no app context, the guids are generated by the main process.
+
+    :param parser_class: IcsTwoFeedParser or NTBEventXMLFeedParser
+    :param list events: (guid, raw event) pairs
+    :return list: parsed events, or None if they can't be sent back to the main process
+    """
+    try:
+        items = parse_raw_events(parser_class(), events)
+    except Exception as ex:
+        # superdesk errors can't be sent back from the worker process
+        raise RuntimeError('{}: {}'.format(type(ex).__name__, ex)) from None
+
+    try:
+        pickle.dumps(items)
+    except Exception:
+        return None
+    return items
@@ -1,5 +1,11 @@
+import tempfile
+from os import listdir, mkdir, stat
+from os.path import isfile, join
 from mock import patch
-from planning.feeding_services.event_file_service import EventFileFeedingService
+from superdesk.errors import ParserError
+from planning.feeding_services.event_file_service import EventFileFeedingService, SCAN_MANIFEST, \
+    get_sorted_files as get_files
+from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
 from planning.tests import TestCase
 
 
@@ -7,6 +13,11 @@ os = object()
 get_sorted_files = object()
 
 
+def files_in_order(filenames):
+    """Replace get_sorted_files, listing the given files of the directory in this order"""
+    return lambda path: [(filename, stat(join(path, filename))) for filename in filenames]
+
+
 class EventFileFeedingServiceTestCase(TestCase):
 
     def setUp(self):
@@ -29,3 +40,138 @@ class EventFileFeedingServiceTestCase(TestCase):
 
             events = list(service._update(provider, None))
             self.assertEqual(len(events), 0)
+
+    @patch('planning.feeding_services.event_file_service.get_sorted_files')
+    def test_update_parallel(self, mock_get_sorted_files):
+        xml = ('<document><guid>{0}</guid><title>{0}</title><content>{0}</content><location>Oslo</location>'
+               '<timeStart>2016-09-05T09:00:00</timeStart><timeEnd>2016-09-16T16:00:00</timeEnd></document>')
+        filenames = ['event{}.xml'.format(i) for i in range(5)]
+        with tempfile.TemporaryDirectory() as path, self.app.app_context():
+            for filename in filenames:
+                with open(join(path, filename), 'w') as f:
+                    f.write(xml.format(filename))
+            with open(join(path, 'broken.xml'), 'w') as f:
+                f.write('<document>')
+
+            self.app.config['PLANNING_INGEST_FILE_WORKERS'] = 2
+            provider = {'name': 'files', 'feed_parser': 'ntb_event_xml', 'config': {'path': path}}
+
+            mock_get_sorted_files.side_effect = files_in_order(list(reversed(filenames)))
+            events = list(EventFileFeedingService()._update(provider, None))
+            self.assertEqual(list(reversed(filenames)), [items[0]['guid'] for items in events])
+            self.assertEqual(sorted(filenames), sorted(listdir(join(path, '_PROCESSED'))))
+
+            mock_get_sorted_files.side_effect = files_in_order(['broken.xml'])
+            with self.assertRaises(ParserError):
+                list(EventFileFeedingService()._update(provider, None))
+            self.assertTrue(isfile(join(path, 'broken.xml')))
+
+    @patch('planning.feeding_services.event_file_service.get_sorted_files')
+    def test_update_parallel_batches(self, mock_get_sorted_files):
+        event = ('<event><guid>{0}</guid><title>{0}</title><content>{0}</content><location>Oslo</location>'
+                 '<timeStart>2016-09-05T09:00:00</timeStart><timeEnd>2016-09-16T16:00:00</timeEnd></event>')
+        with tempfile.TemporaryDirectory() as path, self.app.app_context():
+            with open(join(path, 'events.xml'), 'w') as f:
+                f.write('<events>{}</events>'.format(''.join(event.format('e{}'.format(i)) for i in range(5))))
+
+            self.app.config['PLANNING_INGEST_FILE_WORKERS'] = 2
+            self.app.config['PLANNING_INGEST_BATCH_SIZE'] = 2
+            provider = {'name': 'files', 'feed_parser': 'ntb_event_xml', 'config': {'path': path}}
+
+            mock_get_sorted_files.side_effect = files_in_order(['events.xml'])
+            events = EventFileFeedingService()._update(provider, None)
+            self.assertEqual(['e0', 'e1'], [item['guid'] for item in next(events)])
+            # the file is moved once all its batches are saved
+            self.assertTrue(isfile(join(path, 'events.xml')))
+            self.assertEqual([['e2', 'e3'], ['e4']], [[item['guid'] for item in items] for items in events])
+            self.assertEqual(['events.xml'], listdir(join(path, '_PROCESSED')))
+
+    @patch('planning.feeding_services.event_file_service.get_sorted_files')
+    def test_update_parallel_dedup(self, mock_get_sorted_files):
+        ics = ('BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:{0}\r\nSUMMARY:{0}\r\nDTSTART:20300101T100000Z\r\n'
+               'DTEND:20300101T110000Z\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        with tempfile.TemporaryDirectory() as path, self.app.app_context():
+            for filename in ('export1.ics', 'export2.ics'):
+                with open(join(path, filename), 'w') as f:
+                    f.write(ics.format('event'))
+
+            self.app.config['PLANNING_INGEST_FILE_WORKERS'] = 2
+            provider = {'name': 'files', 'feed_parser': 'ics20', 'config': {'path': path}}
+
+            mock_get_sorted_files.side_effect = files_in_order(['export1.ics', 'export2.ics'])
+            with patch.object(IcsTwoFeedParser, 'filter_items', side_effect=lambda items, provider: items) as dedup:
+                events = EventFileFeedingService()._update(provider, None)
+                self.assertEqual(['event'], [item['original_source'] for item in next(events)])
+                # the batch of the next file is checked once the previous one was saved
+                self.assertEqual(1, dedup.call_count)
+                self.assertEqual([['event']], [[item['original_source'] for item in items] for items in events])
+                self.assertEqual(2, dedup.call_count)
+
+            self.assertEqual(['export1.ics', 'export2.ics'], sorted(listdir(join(path, '_PROCESSED'))))
+
+    @patch('planning.feeding_services.event_file_service.get_sorted_files')
+    def test_update_pipeline(self, mock_get_sorted_files):
+        xml = ('<document><guid>{0}</guid><title>{0}</title><content>{0}</content><location>Oslo</location>'
+               '<timeStart>2016-09-05T09:00:00</timeStart><timeEnd>2016-09-16T16:00:00</timeEnd></document>')
+        filenames = ['event{}.xml'.format(i) for i in range(5)]
+        with tempfile.TemporaryDirectory() as path, self.app.app_context():
+            for filename in filenames:
+                with open(join(path, filename), 'w') as f:
+                    f.write(xml.format(filename))
+            with open(join(path, 'broken.xml'), 'w') as f:
+                f.write('<document>')
+
+            self.app.config['PLANNING_INGEST_PIPELINE'] = True
+            provider = {'name': 'files', 'feed_parser': 'ntb_event_xml', 'config': {'path': path}}
+
+            mock_get_sorted_files.side_effect = files_in_order(filenames)
+            events = EventFileFeedingService()._update(provider, None)
+            self.assertEqual('event0.xml', next(events)[0]['guid'])
+            # the file is moved once its items are saved
+            self.assertTrue(isfile(join(path, 'event0.xml')))
+            self.assertEqual(filenames[1:], [items[0]['guid'] for items in events])
+            self.assertEqual(sorted(filenames), sorted(listdir(join(path, '_PROCESSED'))))
+
+            mock_get_sorted_files.side_effect = files_in_order(['broken.xml'])
+            with self.assertRaises(ParserError):
+                list(EventFileFeedingService()._update(provider, None))
+            self.assertTrue(isfile(join(path, 'broken.xml')))
+
+    @patch('planning.feeding_services.event_file_service.get_sorted_files')
+    def test_update_skips_unchanged_failed_files(self, mock_get_sorted_files):
+        xml = ('<document><guid>{0}</guid><title>{0}</title><content>{0}</content><location>Oslo</location>'
+               '<timeStart>2016-09-05T09:00:00</timeStart><timeEnd>2016-09-16T16:00:00</timeEnd></document>')
+        with tempfile.TemporaryDirectory() as path, self.app.app_context():
+            with open(join(path, 'broken.xml'), 'w') as f:
+                f.write('<document>')
+            provider = {'name': 'files', 'feed_parser': 'ntb_event_xml', 'config': {'path': path}}
+
+            mock_get_sorted_files.side_effect = files_in_order(['broken.xml'])
+            with self.assertRaises(ParserError):
+                list(EventFileFeedingService()._update(provider, None))
+            self.assertEqual(['broken.xml'], [entry['name'] for entry in provider[SCAN_MANIFEST]])
+
+            with open(join(path, 'event.xml'), 'w') as f:
+                f.write(xml.format('event'))
+            mock_get_sorted_files.side_effect = files_in_order(['broken.xml', 'event.xml'])
+            events = list(EventFileFeedingService()._update(provider, None))
+            self.assertEqual(['event'], [items[0]['guid'] for items in events])
+            self.assertTrue(isfile(join(path, 'broken.xml')))
+
+            with open(join(path, 'broken.xml'), 'w') as f:
+                f.write(xml.format('fixed'))
+            mock_get_sorted_files.side_effect = files_in_order(['broken.xml'])
+            events = list(EventFileFeedingService()._update(provider, None))
+            self.assertEqual(['fixed'], [items[0]['guid'] for items in events])
+            self.assertEqual([], provider[SCAN_MANIFEST])
+
+    def test_get_sorted_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            for filename in ('b.xml', 'a.xml'):
+                with open(join(path, filename), 'w') as f:
+                    f.write(filename)
+            mkdir(join(path, '_PROCESSED'))
+
+            files = get_files(path)
+            self.assertEqual(['a.xml', 'b.xml'], sorted(filename for filename, _ in files))
+            self.assertEqual([len('a.xml')] * 2, [stat_result.st_size for _, stat_result in files])
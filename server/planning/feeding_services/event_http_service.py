@@ -9,18 +9,79 @@
 # at https://www.sourcefabric.org/superdesk/license
 
 import datetime
+import hashlib
+import json
 import requests
+import tempfile
+import threading
+import time
 import traceback
 
-import xml.etree.ElementTree as ET
 from superdesk.io.feeding_services.http_service import HTTPFeedingService
 from superdesk.errors import IngestApiError
 from superdesk.logging import logger
+from superdesk.stats import stats
 from superdesk.utc import utcnow
 from planning.feed_parsers.ntb_event_xml import NTBEventXMLFeedParser
 from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
+from planning.common import bulk_index_batches
+from planning.feeding_services import pipeline
 from flask import current_app as app
-from icalendar import Calendar
+
+#: Provider field storing the ETag, Last-Modified header and hash of the last ingested content
+HTTP_CACHE = 'http_cache'
+HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_SPOOL_SIZE = 1024 * 1024
+#: Default maximum size of a feed body, can be changed with the ``PLANNING_HTTP_MAX_BODY_SIZE`` setting
+HTTP_MAX_BODY_SIZE = 50 * 1024 * 1024
+HTTP_POOL_SIZE = 2
+
+#: Seconds after which the session of a provider not polled anymore is closed
+HTTP_SESSION_IDLE_TIMEOUT = 60 * 60
+
+# keep-alive sessions by provider, with the config they were created for and their last use
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(provider):
+    """Get the pooled HTTP session of a provider
+
+    The session keeps the connections to the feed alive between the polls and negotiates a compressed body.
+    It is created again when the config of the provider changed, and the sessions of the providers not
+    polled for `HTTP_SESSION_IDLE_TIMEOUT` seconds (i.e. deleted or closed providers) are closed.
+
+    :param dict provider: ingest provider
+    :return requests.Session: the session of the provider
+    """
+    config = provider.get('config') or {}
+    key = str(provider.get('_id') or config.get('url'))
+    config_key = json.dumps(config, sort_keys=True, default=str)
+    now = time.time()
+
+    with sessions_lock:
+        stale = [k for k, (session_config, _, last_used) in sessions.items()
+                 if (k == key and session_config != config_key) or last_used < now - HTTP_SESSION_IDLE_TIMEOUT]
+        for k in stale:
+            sessions.pop(k)[1].close()
+
+        if key in sessions:
+            session = sessions[key][1]
+        else:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+        sessions[key] = (config_key, session, now)
+    return session
+
+
+def close_sessions():
+    """Close all the sessions of this worker"""
+    with sessions_lock:
+        while sessions:
+            sessions.popitem()[1][1].close()
 
 
 class EventHTTPFeedingService(HTTPFeedingService):
@@ -43,6 +104,10 @@ class EventHTTPFeedingService(HTTPFeedingService):
     """
     service = 'events'
 
+    def update(self, provider, update):
+        # the events saved by the ingest are indexed in elastic once per batch, with bulk requests
+        return bulk_index_batches(self.service, super().update(provider, update))
+
     def _update(self, provider, update):
         updated = utcnow()
 
@@ -62,12 +127,27 @@ class EventHTTPFeedingService(HTTPFeedingService):
 
         parser = self.get_feed_parser(provider)
 
+        http_cache = provider.get(HTTP_CACHE) or {}
+        headers = {}
+        if http_cache.get('etag'):
+            headers['If-None-Match'] = http_cache['etag']
+        if http_cache.get('last_modified'):
+            headers['If-Modified-Since'] = http_cache['last_modified']
+
         try:
-            response = requests.get(self.URL, params=payload, timeout=15)
-            # TODO: check if file has been updated since provider last_updated
-            # although some ptovider do not include 'Last-Modified' in headers
-            # so unsure how to do this
-            logger.info('Http Headers: %s', response.headers)
+            start = time.time()
+            response = get_session(provider).get(self.URL, params=payload, headers=headers, timeout=15, stream=True)
+            logger.debug('Http Headers: %s', response.headers)
+
+            if response.status_code == 304:
+                logger.info('Feed %s not modified since last update', self.URL)
+                response.close()
+                return
+
+            if response.status_code == 404:
+                raise LookupError('Not found %s' % payload)
+
+            content, content_hash = self._download(response, start)
         except requests.exceptions.Timeout as ex:
             # Maybe set up for a retry, or continue in a retry loop
             raise IngestApiError.apiTimeoutError(ex, self.provider)
@@ -77,23 +157,74 @@ class EventHTTPFeedingService(HTTPFeedingService):
         except requests.exceptions.RequestException as ex:
             # catastrophic error. bail.
             raise IngestApiError.apiRequestError(ex, self.provider)
+        except LookupError:
+            raise
         except Exception as error:
             traceback.print_exc()
             raise IngestApiError.apiGeneralError(error, self.provider)
 
-        if response.status_code == 404:
-            raise LookupError('Not found %s' % payload)
-
-        logger.info('Ingesting: %s', str(response.content))
-
-        if isinstance(parser, NTBEventXMLFeedParser):
-            xml = ET.fromstring(response.content)
-            items = parser.parse(xml, provider)
-        elif isinstance(parser, IcsTwoFeedParser):
-            cal = Calendar.from_ical(response.content)
-            items = parser.parse(cal, provider)
-        else:
-            items = parser.parser(response.content)
+        with content:
+            if content_hash == http_cache.get('content_hash'):
+                logger.info('Feed %s content has not changed since last update', self.URL)
+            else:
+                yield from self._parse(parser, content, provider)
+
+        # saved with the provider once all the items are ingested, so a failed update is retried
+        if update is not None:
+            update[HTTP_CACHE] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': content_hash,
+            }
+
+    def _download(self, response, start):
+        """Download the (decompressed) response body, computing its hash
+
+        The body is spooled to disk once larger than `HTTP_SPOOL_SIZE`, so large feeds are not kept in memory.
+        Bodies larger than ``PLANNING_HTTP_MAX_BODY_SIZE`` are rejected.
+
+        :return tuple: the body as a file object and its hash
+        """
+        max_size = app.config.get('PLANNING_HTTP_MAX_BODY_SIZE', HTTP_MAX_BODY_SIZE)
+        content = tempfile.SpooledTemporaryFile(max_size=HTTP_SPOOL_SIZE)
+        content_hash = hashlib.sha1()
+        try:
+            if int(response.headers.get('Content-Length') or 0) > max_size:
+                raise ValueError('Feed {} is larger than {} bytes'.format(self.URL, max_size))
+
+            for chunk in response.iter_content(chunk_size=HTTP_CHUNK_SIZE):
+                content_hash.update(chunk)
+                content.write(chunk)
+                if content.tell() > max_size:
+                    raise ValueError('Feed {} is larger than {} bytes'.format(self.URL, max_size))
+        except Exception:
+            content.close()
+            raise
+        finally:
+            response.close()
+
+        self._log_download(content.tell(), start)
+        content.seek(0)
+        return content, content_hash.hexdigest()
+
+    def _log_download(self, size, start):
+        elapsed = time.time() - start
+        logger.info('Downloaded %d bytes from %s in %.3fs', size, self.URL, elapsed)
+        stats.incr('planning.ingest.http.bytes', size)
+        stats.timing('planning.ingest.http.download', elapsed * 1000)
+
+    def _parse(self, parser, content, provider):
+        if isinstance(parser, (NTBEventXMLFeedParser, IcsTwoFeedParser)):
+            if pipeline.is_enabled():
+                yield from pipeline.IngestPipeline(
+                    parse=lambda source: pipeline.parse_events(parser, source, provider),
+                    dedup=lambda items: pipeline.dedup_events(parser, items, provider)
+                ).run([content])
+            else:
+                yield from parser.parse_stream(content, provider)
+            return
+
+        items = parser.parser(content.read())
 
         if isinstance(items, list):
             yield items
@@ -1,6 +1,14 @@
-from planning.feeding_services.event_http_service import EventHTTPFeedingService
+import os
+import time
+from mock import patch
+import requests_mock
+from superdesk.errors import IngestApiError
+from planning.feeding_services.event_http_service import EventHTTPFeedingService, HTTP_CACHE, get_session, \
+    close_sessions, sessions, HTTP_SESSION_IDLE_TIMEOUT
 from planning.tests import TestCase
 
+URL = 'http://example.com/events.ics'
+
 
 class EventHTTPFeedingServiceTestCase(TestCase):
 
@@ -34,3 +42,76 @@ class EventHTTPFeedingServiceTestCase(TestCase):
             }
             events = list(service._update(provider, None))
             self.assertEqual(len(events), 1)
+
+    def get_calendar(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(dir_path, '..', 'feed_parsers', 'events.ics'), 'rb') as f:
+            return f.read()
+
+    def test_update_stores_http_cache(self):
+        with self.app.app_context(), requests_mock.Mocker() as mocker:
+            mocker.get(URL, content=self.get_calendar(),
+                       headers={'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+            provider = {'feed_parser': 'ics20', 'config': {'url': URL}}
+            update = {}
+            events = list(EventHTTPFeedingService()._update(provider, update))
+
+            self.assertEqual(1, len(events))
+            self.assertEqual('"v1"', update[HTTP_CACHE]['etag'])
+            self.assertEqual('Wed, 21 Oct 2015 07:28:00 GMT', update[HTTP_CACHE]['last_modified'])
+            self.assertTrue(update[HTTP_CACHE]['content_hash'])
+
+    def test_update_not_modified(self):
+        with self.app.app_context(), requests_mock.Mocker() as mocker:
+            mocker.get(URL, status_code=304)
+            provider = {
+                'feed_parser': 'ics20',
+                'config': {'url': URL},
+                HTTP_CACHE: {'etag': '"v1"', 'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+            }
+            update = {}
+            events = list(EventHTTPFeedingService()._update(provider, update))
+
+            self.assertEqual([], events)
+            self.assertNotIn(HTTP_CACHE, update)
+            self.assertEqual('"v1"', mocker.last_request.headers['If-None-Match'])
+            self.assertEqual('Wed, 21 Oct 2015 07:28:00 GMT', mocker.last_request.headers['If-Modified-Since'])
+
+    def test_update_content_not_changed(self):
+        with self.app.app_context(), requests_mock.Mocker() as mocker:
+            mocker.get(URL, content=self.get_calendar())
+            provider = {'feed_parser': 'ics20', 'config': {'url': URL}}
+            update = {}
+            list(EventHTTPFeedingService()._update(provider, update))
+
+            provider[HTTP_CACHE] = update[HTTP_CACHE]
+            events = list(EventHTTPFeedingService()._update(provider, {}))
+            self.assertEqual([], events)
+
+    def test_update_max_body_size(self):
+        with self.app.app_context(), requests_mock.Mocker() as mocker:
+            self.app.config['PLANNING_HTTP_MAX_BODY_SIZE'] = 100
+            mocker.get(URL, content=self.get_calendar())
+            provider = {'feed_parser': 'ics20', 'config': {'url': URL}}
+            with self.assertRaises(IngestApiError):
+                list(EventHTTPFeedingService()._update(provider, {}))
+
+    def test_session_per_provider(self):
+        self.addCleanup(close_sessions)
+        self.assertIs(get_session({'_id': 'p1'}), get_session({'_id': 'p1'}))
+        self.assertIsNot(get_session({'_id': 'p1'}), get_session({'_id': 'p2'}))
+
+    def test_session_config_changed(self):
+        self.addCleanup(close_sessions)
+        session = get_session({'_id': 'p1', 'config': {'url': URL}})
+        self.assertIsNot(session, get_session({'_id': 'p1', 'config': {'url': URL + '?v=2'}}))
+        self.assertEqual(1, len(sessions))
+
+    def test_idle_sessions_closed(self):
+        self.addCleanup(close_sessions)
+        session = get_session({'_id': 'p1'})
+        with patch('planning.feeding_services.event_http_service.time.time',
+                   return_value=time.time() + HTTP_SESSION_IDLE_TIMEOUT + 1):
+            get_session({'_id': 'p2'})
+        self.assertNotIn('p1', sessions)
+        self.assertIsNot(session, get_session({'_id': 'p1'}))
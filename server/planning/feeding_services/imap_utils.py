@@ -0,0 +1,172 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Helpers for reading the responses of :mod:`imaplib` UID commands"""
+
+import base64
+import os
+import quopri
+import re
+from email.header import decode_header, make_header
+
+TOKEN_RE = re.compile(rb'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<quoted>(?:[^"\\]|\\.)*)"|'
+                      rb'\{(?P<literal>\d+)\}$|(?P<atom>[^\s()"]+))')
+
+
+def parse_response(data):
+    """Parse the data returned by imaplib into nested lists
+
+    Parenthesized lists become python lists, strings and atoms become bytes and NIL becomes None.
+    Literals are given by imaplib as a (line, literal) tuple, the line ending with ``{size}``.
+
+    :param list data: data returned by imaplib, i.e. by ``imap.uid('FETCH', ...)``
+    :return list: the parsed tokens
+    """
+    stack = [[]]
+    for segment in data or []:
+        if segment is None:
+            continue
+        line, literal = segment if isinstance(segment, tuple) else (segment, None)
+        pos = 0
+        while pos < len(line):
+            match = TOKEN_RE.match(line, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+
+            if match.group('open'):
+                stack.append([])
+            elif match.group('close'):
+                if len(stack) > 1:
+                    value = stack.pop()
+                    stack[-1].append(value)
+            elif match.group('quoted') is not None:
+                stack[-1].append(re.sub(rb'\\(.)', rb'\1', match.group('quoted')))
+            elif match.group('literal') is not None:
+                stack[-1].append(literal)
+            else:
+                atom = match.group('atom')
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+
+    while len(stack) > 1:
+        value = stack.pop()
+        stack[-1].append(value)
+    return stack[0]
+
+
+def parse_fetch(data):
+    """Parse the response of a UID FETCH command
+
+    :param list data: data returned by ``imap.uid('FETCH', ...)``
+    :return dict: the fetched items of every message, by UID, i.e. ``{5: {'BODYSTRUCTURE': [...]}}``
+    """
+    messages = {}
+    for value in parse_response(data):
+        if not isinstance(value, list):
+            continue
+
+        items = {}
+        for key, item in zip(value[::2], value[1::2]):
+            if isinstance(key, bytes):
+                items[key.decode('ascii').upper()] = item
+        if items.get('UID'):
+            messages.setdefault(int(items.pop('UID')), {}).update(items)
+    return messages
+
+
+def get_attachment_parts(structure, prefix=''):
+    """List the attachments of a message from its BODYSTRUCTURE
+
+    :param list structure: parsed BODYSTRUCTURE of the message
+    :return list: dicts with the `part` number, `content_type`, `encoding` and `filename` of every attachment
+    """
+    if not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        # the parts of a multipart are followed by its subtype and extension data
+        parts = []
+        for index, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            parts.extend(get_attachment_parts(child, '{}{}.'.format(prefix, index + 1)))
+        return parts
+
+    content_type = '{}/{}'.format(_to_str(structure[0]), _to_str(structure[1])).lower()
+    params = _to_dict(structure[2])
+    encoding = _to_str(structure[5]).lower()
+
+    # the extension data of a part starts after its number of lines for text parts
+    # and after its envelope, body and number of lines for message parts
+    if content_type.startswith('text/'):
+        disposition_index = 9
+    elif content_type == 'message/rfc822':
+        disposition_index = 11
+    else:
+        disposition_index = 8
+
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    if not isinstance(disposition, list) or not disposition:
+        return []
+
+    filename = _to_dict(disposition[1] if len(disposition) > 1 else None).get('filename') or params.get('name')
+    if not filename:
+        return []
+
+    return [{
+        'part': prefix.rstrip('.') or '1',
+        'content_type': content_type,
+        'encoding': encoding,
+        'filename': _decode_filename(filename),
+    }]
+
+
+def get_extension(filename):
+    return os.path.splitext(filename or '')[1].lower()
+
+
+def decode_part(payload, encoding):
+    """Decode the content of a part fetched with BODY[part]"""
+    payload = payload or b''
+    if encoding == 'base64':
+        # the first bytes of a part may end with an incomplete group of 4 characters
+        payload = b''.join(payload.split())
+        return base64.b64decode(payload[:len(payload) - len(payload) % 4])
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(payload)
+    return payload
+
+
+def get_uid_set(uids):
+    """Get the shortest IMAP sequence set for the given UIDs, i.e. ``1:3,5,7:8``"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else '{}:{}'.format(start, end) for start, end in ranges)
+
+
+def _to_str(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else (value or '')
+
+
+def _to_dict(params):
+    if not isinstance(params, list):
+        return {}
+    return {_to_str(key).lower(): _to_str(value) for key, value in zip(params[::2], params[1::2])}
+
+
+def _decode_filename(filename):
+    try:
+        return str(make_header(decode_header(filename)))
+    except Exception:
+        return filename
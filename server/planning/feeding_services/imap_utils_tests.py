@@ -0,0 +1,41 @@
+from planning.feeding_services.imap_utils import parse_fetch, get_attachment_parts, get_uid_set, decode_part
+from planning.tests import TestCase
+
+
+class IMAPUtilsTestCase(TestCase):
+
+    def test_parse_fetch(self):
+        data = [
+            (b'1 (UID 5 BODY[2] {5}', b'hello'),
+            (b' BODY[3] {3}', b'foo'),
+            b')',
+            b'2 (UID 7 FLAGS (\\Seen) BODY[2] NIL)',
+            b'3 (FLAGS (\\Seen))',
+        ]
+        self.assertEqual({
+            5: {'BODY[2]': b'hello', 'BODY[3]': b'foo'},
+            7: {'FLAGS': [b'\\Seen'], 'BODY[2]': None},
+        }, parse_fetch(data))
+
+    def test_get_attachment_parts(self):
+        data = [b'1 (UID 1 BODYSTRUCTURE ((("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 10 1 NIL NIL NIL NIL)'
+                b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 20 1 NIL NIL NIL NIL) "alternative" '
+                b'("boundary" "b2") NIL NIL NIL)'
+                b'("text" "calendar" ("name" "events.ics") NIL NIL "base64" 100 2 NIL '
+                b'("attachment" ("filename" "events.ics")) NIL NIL)'
+                b'("application" "xml" NIL NIL NIL "quoted-printable" 50 NIL ("inline" ("filename" "ev \\"1\\".xml")) '
+                b'NIL NIL) "mixed" ("boundary" "b1") NIL NIL NIL))']
+        structure = parse_fetch(data)[1]['BODYSTRUCTURE']
+        self.assertEqual([
+            {'part': '2', 'content_type': 'text/calendar', 'encoding': 'base64', 'filename': 'events.ics'},
+            {'part': '3', 'content_type': 'application/xml', 'encoding': 'quoted-printable',
+             'filename': 'ev "1".xml'},
+        ], get_attachment_parts(structure))
+
+    def test_get_uid_set(self):
+        self.assertEqual('1:3,5,7:8', get_uid_set([8, 1, 2, 3, 5, 7, 2]))
+
+    def test_decode_part(self):
+        self.assertEqual(b'hello', decode_part(b'aGVsbG8=', 'base64'))
+        self.assertEqual(b'a=b', decode_part(b'a=3Db', 'quoted-printable'))
+        self.assertEqual(b'', decode_part(None, '7bit'))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Staged ingest pipeline for the event feeding services"""
+
+import logging
+import queue
+import threading
+from flask import current_app as app
+from planning.feed_parsers.ics_2_0 import IcsTwoFeedParser
+
+logger = logging.getLogger(__name__)
+
+#: Default number of entries waiting between two stages, can be changed with ``PLANNING_INGEST_QUEUE_SIZE``
+QUEUE_SIZE = 2
+
+# seconds between the checks of the stop event by threads waiting on a queue
+POLL_INTERVAL = 0.1
+
+END = object()
+
+
+class Stopped(Exception):
+    """Raised in the threads of a stopped pipeline"""
+
+
+class IngestPipeline:
+    """Bounded pipeline between the fetch, parse, dedup and persist stages of an ingest update
+
+    The fetch stage iterates over the units to ingest (files, messages, downloaded feeds) and the parse
+    stage parses every unit into batches of items. They run in their own threads, one for the fetch stage
+    and ``PLANNING_INGEST_PARSE_WORKERS`` for the parse stage, connected by queues of
+    ``PLANNING_INGEST_QUEUE_SIZE`` entries.
+
+    The persist stage is the consumer of :meth:`run`, i.e. superdesk saving every yielded batch.
+    When it is slow the queues fill up and the other stages wait, so only a few batches are in
+    memory whatever the size of the feed. The dedup stage, removing the items which were already
+    ingested, runs in the consumer just before a batch is yielded, so it sees the items saved
+    from all the previous batches.
+    """
+
+    def __init__(self, parse, dedup=None, on_done=None, on_error=None):
+        """Create the pipeline
+
+        :param parse: function parsing a unit into an iterable of batches
+        :param dedup: function removing the ingested items of a batch, returning the batch to save
+        :param on_done: function called with a unit once all its batches were saved
+        :param on_error: function called with a unit and the exception raised while parsing it,
+            the exception is raised again if not given
+        """
+        self.parse = parse
+        self.dedup = dedup
+        self.on_done = on_done
+        self.on_error = on_error
+        self.queue_size = app.config.get('PLANNING_INGEST_QUEUE_SIZE', QUEUE_SIZE)
+        self.parse_workers = app.config.get('PLANNING_INGEST_PARSE_WORKERS', 1)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.units = {}
+
+    def run(self, units):
+        """Yield the batches of the given units
+
+        A batch is saved once the next one is asked for, so `on_done` is called with a unit when
+        the batch after its last one is asked for. Batches of different units may be interleaved
+        if there are several parse workers.
+        """
+        flask_app = app._get_current_object()
+        fetched = queue.Queue(self.queue_size)
+        parsed = queue.Queue(self.queue_size)
+
+        threads = [self._start(flask_app, self._fetch, units, fetched)]
+        parse_counter = [self.parse_workers]
+        threads.extend(self._start(flask_app, self._work, self._parse_unit, fetched, parsed, parse_counter)
+                       for _ in range(self.parse_workers))
+
+        try:
+            yield from self._persist(parsed)
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+
+    def _persist(self, parsed):
+        saved = {}
+        expected = {}
+        failed = set()
+        while True:
+            entry = self._get(parsed)
+            if entry is END:
+                return
+
+            kind, token, value = entry
+            if kind == 'error':
+                raise value
+            if token in failed:
+                continue
+
+            if kind == 'batch' and self.dedup:
+                try:
+                    value = self.dedup(value)
+                except Exception as ex:
+                    kind, value = 'failed', ex
+
+            if kind == 'batch':
+                yield value
+                saved[token] = saved.get(token, 0) + 1
+            elif kind == 'done':
+                expected[token] = value
+            elif kind == 'failed':
+                failed.add(token)
+                if not self.on_error:
+                    raise value
+                self.on_error(self.units.pop(token), value)
+                continue
+
+            if token in expected and expected[token] == saved.get(token, 0):
+                del expected[token]
+                unit = self.units.pop(token)
+                if self.on_done:
+                    self.on_done(unit)
+
+    def _start(self, flask_app, target, *args):
+        def run():
+            with flask_app.app_context():
+                try:
+                    target(*args)
+                except Stopped:
+                    pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _fetch(self, units, output):
+        try:
+            for token, unit in enumerate(units):
+                self.units[token] = unit
+                self._put(output, ('unit', token, unit))
+        except Stopped:
+            raise
+        except Exception as ex:
+            self._put(output, ('error', None, ex))
+        self._put(output, END)
+
+    def _work(self, handle, source, output, counter):
+        """Handle the entries of a stage until the end, the last worker of the stage passes it on"""
+        while True:
+            entry = self._get(source)
+            if entry is END:
+                # let the other workers of the stage see the end as well
+                self._put(source, END)
+                break
+            handle(entry, output)
+
+        with self.lock:
+            counter[0] -= 1
+            last = not counter[0]
+        if last:
+            self._put(output, END)
+
+    def _parse_unit(self, entry, output):
+        kind, token, unit = entry
+        if kind != 'unit':
+            self._put(output, entry)
+            return
+
+        count = 0
+        try:
+            for items in self.parse(unit):
+                self._put(output, ('batch', token, items))
+                count += 1
+        except Stopped:
+            raise
+        except Exception as ex:
+            self._put(output, ('failed', token, ex))
+            return
+        self._put(output, ('done', token, count))
+
+    def _put(self, output, entry):
+        while not self.stopped.is_set():
+            try:
+                output.put(entry, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+        raise Stopped()
+
+    def _get(self, source):
+        while not self.stopped.is_set():
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        raise Stopped()
+
+
+def is_enabled():
+    """Check if the feeding services should use the pipeline, with the ``PLANNING_INGEST_PIPELINE`` setting"""
+    return app.config.get('PLANNING_INGEST_PIPELINE', False)
+
+
+def parse_events(parser, source, provider):
+    """Parse a file object into batches of events, without removing the events already ingested"""
+    if isinstance(parser, IcsTwoFeedParser):
+        return parser.parse_stream(source, provider, dedup=False)
+    return parser.parse_stream(source, provider)
+
+
+def dedup_events(parser, items, provider):
+    """Remove the events already ingested from a batch parsed with `parse_events`"""
+    if isinstance(parser, IcsTwoFeedParser):
+        return parser.filter_items(items, provider)
+    return items
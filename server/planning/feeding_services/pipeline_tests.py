@@ -0,0 +1,84 @@
+import threading
+import time
+from planning.feeding_services.pipeline import IngestPipeline
+from planning.tests import TestCase
+
+
+class IngestPipelineTestCase(TestCase):
+
+    def test_run(self):
+        done = []
+        with self.app.app_context():
+            pipeline = IngestPipeline(
+                parse=lambda unit: ([unit] * 2, [unit]),
+                dedup=lambda items: items[:1],
+                on_done=done.append
+            )
+            batches = pipeline.run(['a', 'b', 'c'])
+            self.assertEqual(['a'], next(batches))
+            self.assertEqual(['a'], next(batches))
+            self.assertEqual([], done)
+            # the last batch of a is saved when the next batch is asked for
+            self.assertEqual(['b'], next(batches))
+            self.assertEqual(['a'], done)
+            self.assertEqual([['b'], ['c'], ['c']], list(batches))
+            self.assertEqual(['a', 'b', 'c'], done)
+
+    def test_run_with_workers(self):
+        with self.app.app_context():
+            self.app.config['PLANNING_INGEST_PARSE_WORKERS'] = 3
+            done = []
+            batches = IngestPipeline(parse=lambda unit: [[unit]], on_done=done.append).run(range(100))
+            self.assertEqual(list(range(100)), sorted(items[0] for items in batches))
+            self.assertEqual(list(range(100)), sorted(done))
+
+    def test_dedup_sees_saved_batches(self):
+        saved = []
+        with self.app.app_context():
+            pipeline = IngestPipeline(
+                parse=lambda unit: [[unit]],
+                dedup=lambda items: [item for item in items if item not in saved]
+            )
+            for items in pipeline.run(['a', 'a', 'b', 'a']):
+                saved.extend(items)
+        self.assertEqual(['a', 'b'], saved)
+
+    def test_backpressure(self):
+        fetched = []
+
+        def units():
+            for unit in range(1000):
+                fetched.append(unit)
+                yield unit
+
+        with self.app.app_context():
+            batches = IngestPipeline(parse=lambda unit: [[unit]]).run(units())
+            next(batches)
+            # a slow consumer stops the other stages once the queues are full
+            time.sleep(0.5)
+            self.assertTrue(len(fetched) < 10)
+            batches.close()
+
+    def test_errors(self):
+        def parse(unit):
+            if unit == 'broken':
+                raise ValueError(unit)
+            return [[unit]]
+
+        with self.app.app_context():
+            errors = []
+            batches = IngestPipeline(parse=parse, on_error=lambda unit, ex: errors.append(unit)).run(
+                ['a', 'broken', 'b'])
+            self.assertEqual([['a'], ['b']], list(batches))
+            self.assertEqual(['broken'], errors)
+
+            with self.assertRaises(ValueError):
+                list(IngestPipeline(parse=parse).run(['a', 'broken', 'b']))
+
+    def test_close_stops_the_threads(self):
+        threads = threading.active_count()
+        with self.app.app_context():
+            batches = IngestPipeline(parse=lambda unit: [[unit]]).run(iter(range(1000)))
+            next(batches)
+            batches.close()
+        self.assertEqual(threads, threading.active_count())
@@ -0,0 +1,182 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014, 2015, 2016, 2017 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Geocoding proxy, caching the results of the geocoder for all the users"""
+
+import hashlib
+import json
+import logging
+import unicodedata
+from datetime import timedelta
+
+import requests
+import superdesk
+from eve.utils import config
+from flask import current_app as app
+from superdesk.errors import SuperdeskApiError
+from superdesk.utc import utcnow
+from superdesk.utils import ListCursor
+from .common import get_collection
+
+logger = logging.getLogger(__name__)
+
+#: Defaults of the cache, results are kept for `CACHE_TTL` seconds and at most `CACHE_SIZE` queries are kept
+CACHE_TTL = 30 * 24 * 60 * 60
+CACHE_SIZE = 10000
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/search'
+NOMINATIM_TIMEOUT = 10
+
+geocode_providers = {}
+
+
+def register_geocode_provider(name, provider_class):
+    """Register a geocoding provider, selected with the ``PLANNING_GEOCODE_PROVIDER`` setting
+
+    :param str name: name of the provider
+    :param provider_class: class implementing :class:`GeocodeProvider`
+    """
+    geocode_providers[name] = provider_class
+
+
+def get_geocode_provider():
+    name = app.config.get('PLANNING_GEOCODE_PROVIDER', 'nominatim')
+    try:
+        return geocode_providers[name]()
+    except KeyError:
+        raise SuperdeskApiError.internalError(message='Geocode provider {} is not registered.'.format(name))
+
+
+class GeocodeProvider:
+    """Base class of the geocoding providers"""
+
+    def geocode(self, query):
+        """Get the places matching the query
+
+        :param str query: address or name of the place
+        :return list: the places, in the format of the nominatim search results
+        """
+        raise NotImplementedError()
+
+
+class NominatimGeocodeProvider(GeocodeProvider):
+    """Search the places with nominatim, at ``PLANNING_NOMINATIM_URL``"""
+
+    def geocode(self, query):
+        params = {
+            'q': query,
+            'format': 'json',
+            'addressdetails': 1,
+            'extratags': 1,
+            'namedetails': 1,
+        }
+        headers = {'User-Agent': app.config.get('PLANNING_NOMINATIM_USER_AGENT', 'Superdesk Planning')}
+        try:
+            response = requests.get(app.config.get('PLANNING_NOMINATIM_URL', NOMINATIM_URL), params=params,
+                                    headers=headers, timeout=NOMINATIM_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            logger.warning('Failed to geocode {}: {}'.format(query, ex))
+            raise SuperdeskApiError.internalError(message='Geocoding failed.', exception=ex)
+
+
+register_geocode_provider('nominatim', NominatimGeocodeProvider)
+
+
+class GeocodeService(superdesk.Service):
+    """Geocode the query `q` with the configured provider
+
+    The results are cached in mongo by normalized query, so repeated lookups of the same place by
+    any user don't reach the provider. Entries expire after ``PLANNING_GEOCODE_CACHE_TTL`` seconds
+    and the least recently used ones are removed once there are more than ``PLANNING_GEOCODE_CACHE_SIZE``.
+    """
+
+    def get(self, req, lookup):
+        args = getattr(req, 'args', None) or {}
+        query = normalize_query(args.get('q'))
+        if not query:
+            raise SuperdeskApiError.badRequestError(message='q is required.')
+
+        provider = app.config.get('PLANNING_GEOCODE_PROVIDER', 'nominatim')
+        key = get_cache_key(provider, query)
+        results = get_cached_results(key)
+        if results is None:
+            results = get_geocode_provider().geocode(query)
+            set_cached_results(key, provider, query, results)
+        return ListCursor(results)
+
+
+def normalize_query(query):
+    """Casefold the query and collapse its whitespaces, so the variants of a query share their results"""
+    return ' '.join(unicodedata.normalize('NFKC', str(query or '')).casefold().split())
+
+
+def get_cache_key(provider, query):
+    return hashlib.sha1('{}|{}'.format(provider, query).encode('utf-8')).hexdigest()
+
+
+def get_cached_results(key):
+    """Get the results cached for the key, or None if not cached or expired"""
+    now = utcnow()
+    entry = get_collection('geocode_cache').find_one_and_update(
+        {config.ID_FIELD: key, 'expiry': {'$gt': now}},
+        {'$set': {'last_used': now}},
+        projection={'results': 1}
+    )
+    return json.loads(entry['results']) if entry else None
+
+
+def set_cached_results(key, provider, query, results):
+    """Cache the results, then remove the least recently used entries over the cache size
+
+    Results are stored as json, as the keys of the places may not be valid mongo field names.
+    """
+    now = utcnow()
+    collection = get_collection('geocode_cache')
+    result = collection.update_one({config.ID_FIELD: key}, {'$set': {
+        'provider': provider,
+        'query': query,
+        'results': json.dumps(results),
+        'expiry': now + timedelta(seconds=app.config.get('PLANNING_GEOCODE_CACHE_TTL', CACHE_TTL)),
+        'last_used': now,
+    }}, upsert=True)
+
+    size = app.config.get('PLANNING_GEOCODE_CACHE_SIZE', CACHE_SIZE)
+    if result.upserted_id is not None and collection.count() > size:
+        oldest = list(collection.find({}, {'last_used': 1}).sort('last_used', -1).skip(size).limit(1))
+        if oldest:
+            collection.delete_many({'last_used': {'$lte': oldest[0]['last_used']}})
+
+
+class GeocodeResource(superdesk.Resource):
+    url = 'geocode'
+    schema = {}
+    datasource = {'source': 'geocode_cache'}
+    resource_methods = ['GET']
+    item_methods = []
+
+
+class GeocodeCacheResource(superdesk.Resource):
+    schema = {
+        'provider': {'type': 'string'},
+        'query': {'type': 'string'},
+        'results': {'type': 'string'},
+        'expiry': {'type': 'datetime'},
+        'last_used': {'type': 'datetime'},
+    }
+    internal_resource = True
+    resource_methods = []
+    item_methods = []
+    mongo_indexes = {
+        # expired entries are removed by mongo
+        'expiry_1': ([('expiry', 1)], {'expireAfterSeconds': 0}),
+        'last_used_1': [('last_used', 1)],
+    }
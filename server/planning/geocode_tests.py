@@ -0,0 +1,70 @@
+from datetime import timedelta
+from eve.utils import ParsedRequest
+from mock import patch
+from superdesk import get_resource_service
+from superdesk.errors import SuperdeskApiError
+from superdesk.utc import utcnow
+from planning.common import get_collection
+from planning.geocode import register_geocode_provider, normalize_query
+from planning.tests import TestCase
+from planning.tests.local_geocoder import LocalGeocodeProvider
+
+PLACES = [
+    {'display_name': 'Stortinget, Karl Johans gate 22, Oslo, Norway', 'lat': '59.9128', 'lon': '10.7404'},
+    {'display_name': 'Oslo Rådhus, Rådhusplassen 1, Oslo, Norway', 'lat': '59.9119', 'lon': '10.7336'},
+]
+
+
+def get_request(**args):
+    req = ParsedRequest()
+    req.args = args
+    return req
+
+
+class GeocodeTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        register_geocode_provider('local', LocalGeocodeProvider)
+        LocalGeocodeProvider.reset(PLACES)
+        self.app.config['PLANNING_GEOCODE_PROVIDER'] = 'local'
+
+    def geocode(self, query):
+        return list(get_resource_service('geocode').get(get_request(q=query), {}))
+
+    def test_normalize_query(self):
+        self.assertEqual('karl johans gate 22', normalize_query('  Karl  JOHANS gate\t22 '))
+        self.assertEqual('', normalize_query(None))
+
+    def test_geocode_caches_results(self):
+        with self.app.app_context():
+            self.assertEqual([PLACES[0]], self.geocode('Stortinget'))
+            self.assertEqual([PLACES[0]], self.geocode(' stortinget  '))
+            self.assertEqual([], self.geocode('Nowhere'))
+            self.assertEqual([], self.geocode('nowhere'))
+            self.assertEqual(['stortinget', 'nowhere'], LocalGeocodeProvider.queries)
+
+            with self.assertRaises(SuperdeskApiError):
+                self.geocode(' ')
+
+    def test_geocode_cache_expires(self):
+        with self.app.app_context():
+            self.app.config['PLANNING_GEOCODE_CACHE_TTL'] = -1
+            self.geocode('Stortinget')
+            self.geocode('Stortinget')
+            self.assertEqual(['stortinget', 'stortinget'], LocalGeocodeProvider.queries)
+
+    def test_geocode_cache_evicts_least_recently_used(self):
+        now = utcnow()
+        times = (now + timedelta(seconds=seconds) for seconds in range(100))
+        with self.app.app_context(), patch('planning.geocode.utcnow', side_effect=lambda: next(times)):
+            self.app.config['PLANNING_GEOCODE_CACHE_SIZE'] = 2
+            self.geocode('Stortinget')
+            self.geocode('Oslo')
+            self.geocode('Stortinget')
+            self.geocode('Rådhus')
+
+            queries = {entry['query'] for entry in get_collection('geocode_cache').find()}
+            self.assertEqual({'stortinget', 'rådhus'}, queries)
+            self.geocode('Stortinget')
+            self.assertEqual(['stortinget', 'oslo', 'rådhus'], LocalGeocodeProvider.queries)
@@ -38,6 +38,23 @@ class HistoryService(Service):
     def on_unspike(self, updates, original):
         self.on_item_updated(updates, original, 'unspiked')
 
+    def on_items_updated(self, updates, originals, operation=None):
+        """Save the history of the same updates applied to many items with a single write"""
+        if originals:
+            self.post([self._get_history(original, updates, operation or 'update') for original in originals])
+
+    def on_items_spiked(self, updates, originals):
+        self.on_items_updated(updates, originals, 'spiked')
+
+    def on_items_unspiked(self, updates, originals):
+        self.on_items_updated(updates, originals, 'unspiked')
+
+    def _save_history(self, item, update, operation):
+        self.post([self._get_history(item, update, operation)])
+
+    def _get_history(self, item, update, operation):
+        raise NotImplementedError()
+
     def get_user_id(self):
         user = getattr(g, 'user', None)
         if user:
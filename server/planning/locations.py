@@ -9,13 +9,75 @@
 """Superdesk Locations"""
 
 import superdesk
+import copy
+import hashlib
 import logging
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from eve.utils import config
+from flask import current_app as app
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import Conflict
+from superdesk import get_resource_service
+from superdesk.errors import SuperdeskApiError
 from superdesk.metadata.utils import generate_guid
 from superdesk.metadata.item import GUID_NEWSML
+from superdesk.utils import ListCursor
 from apps.archive.common import set_original_creator
+from .common import LRUCache, bulk_index_items, get_collection
 
 logger = logging.getLogger(__name__)
 
+#: Field of the ``[longitude, latitude]`` pair of a location, derived from its position
+GEO_FIELD = 'geo'
+
+#: Default number of locations returned by the nearest search
+NEAREST_SIZE = 10
+
+#: Field of the normalized address key, unique for every location
+ADDRESS_KEY_FIELD = 'address_key'
+
+#: Number of decimals the coordinates are rounded to in the address key, 3 is about 100 metres
+ADDRESS_KEY_PRECISION = 3
+
+ADDRESS_FIELDS = ('locality', 'area', 'country', 'postal_code')
+TOKEN_RE = re.compile(r'\w+')
+NUMBER_RE = re.compile(r'\d+\w*$')
+
+#: Field counting the events using a location, to rank the autocomplete suggestions
+USAGE_FIELD = 'usage_count'
+
+#: Defaults of the autocomplete, the number of suggestions and the number of prefixes
+#: kept in the cache for `AUTOCOMPLETE_CACHE_TTL` seconds
+AUTOCOMPLETE_SIZE = 10
+AUTOCOMPLETE_CACHE_SIZE = 1000
+AUTOCOMPLETE_CACHE_TTL = 60
+
+#: Edge ngrams of the words of the name and address lines, matched by the prefixes typed
+AUTOCOMPLETE_ANALYSIS = {
+    'filter': {
+        'location_autocomplete': {'type': 'edge_ngram', 'min_gram': 1, 'max_gram': 20},
+    },
+    'analyzer': {
+        'location_autocomplete': {
+            'type': 'custom',
+            'tokenizer': 'standard',
+            'filter': ['lowercase', 'asciifolding', 'location_autocomplete'],
+        },
+        'location_autocomplete_search': {
+            'type': 'custom',
+            'tokenizer': 'standard',
+            'filter': ['lowercase', 'asciifolding'],
+        },
+    },
+}
+AUTOCOMPLETE_MAPPING = {
+    'type': 'string',
+    'analyzer': 'location_autocomplete',
+    'search_analyzer': 'location_autocomplete_search',
+}
+
 not_analyzed = {'type': 'string', 'index': 'not_analyzed'}
 not_indexed = {'type': 'string', 'index': 'no'}
 venue_types = {
@@ -31,6 +93,370 @@ class LocationsService(superdesk.Service):
         for doc in docs:
             doc['guid'] = generate_guid(type=GUID_NEWSML)
             set_original_creator(doc)
+            doc[GEO_FIELD] = get_geo_point(doc.get('position'))
+            # locations without key are left out of the unique index
+            key = get_address_key(doc)
+            if key:
+                doc[ADDRESS_KEY_FIELD] = key
+            else:
+                doc.pop(ADDRESS_KEY_FIELD, None)
+
+    def create(self, docs, **kwargs):
+        """Insert the new locations, the ones with the address key of an existing location get its data
+
+        This makes the creation of a location an upsert on its address key, so the variants of an address
+        end in one location.
+        """
+        new_docs = []
+        created = {}
+        for doc in docs:
+            key = doc.get(ADDRESS_KEY_FIELD)
+            existing = self.find_one(req=None, **{ADDRESS_KEY_FIELD: key}) if key else None
+            if existing:
+                doc.clear()
+                doc.update(existing)
+            elif key and key in created:
+                created[key].append(doc)
+            else:
+                new_docs.append(doc)
+                created.setdefault(key, [])
+
+        for doc in new_docs:
+            self.insert_unique(doc, **kwargs)
+
+        # the duplicates within the request get the location created for their key
+        for doc in new_docs:
+            for duplicate in created.get(doc.get(ADDRESS_KEY_FIELD)) or []:
+                duplicate.clear()
+                duplicate.update(doc)
+
+        return [doc[config.ID_FIELD] for doc in docs]
+
+    def insert_unique(self, doc, **kwargs):
+        """Insert a new location, or get the location with its address key inserted meanwhile by another request"""
+        key = doc.get(ADDRESS_KEY_FIELD)
+        try:
+            super().create([doc], **kwargs)
+        except (DuplicateKeyError, Conflict):
+            existing = self.find_one(req=None, **{ADDRESS_KEY_FIELD: key}) if key else None
+            if not existing:
+                raise
+            doc.clear()
+            doc.update(existing)
+
+    def on_update(self, updates, original):
+        if 'position' in updates:
+            updates[GEO_FIELD] = get_geo_point(updates['position'])
+        if any(field in updates for field in ('name', 'address', 'position')):
+            updated = original.copy()
+            updated.update(updates)
+            updates[ADDRESS_KEY_FIELD] = get_address_key(updated)
+            self.validate_address_key(updates[ADDRESS_KEY_FIELD], original)
+
+    def on_replace(self, document, original):
+        document[GEO_FIELD] = get_geo_point(document.get('position'))
+        document[ADDRESS_KEY_FIELD] = get_address_key(document)
+        document[USAGE_FIELD] = original.get(USAGE_FIELD, 0)
+        self.validate_address_key(document[ADDRESS_KEY_FIELD], original)
+
+    def validate_address_key(self, key, original):
+        """Make sure an updated location does not get the address of another one
+
+        :raises SuperdeskApiError.badRequestError: If another location has the same address key
+        """
+        if not key or key == original.get(ADDRESS_KEY_FIELD):
+            return
+
+        existing = self.find_one(req=None, **{ADDRESS_KEY_FIELD: key})
+        if existing and existing.get(config.ID_FIELD) != original.get(config.ID_FIELD):
+            raise SuperdeskApiError.badRequestError(
+                message='Location with the same address already exists: {}.'.format(existing.get('name')))
+
+    def on_created(self, docs):
+        clear_autocomplete_cache()
+
+    def on_updated(self, updates, original):
+        clear_autocomplete_cache()
+
+    def on_replaced(self, document, original):
+        clear_autocomplete_cache()
+
+    def on_deleted(self, doc):
+        clear_autocomplete_cache()
+
+
+class LocationsAutocompleteService(superdesk.Service):
+    """Suggest the locations with a name or address line starting with the words typed in `q`
+
+    The suggestions are ranked by the number of events using them, and kept in an in-process cache
+    by prefix which is cleared on every write to the locations.
+    """
+
+    def __init__(self, datasource=None, backend=None):
+        """Create the service, its cache is created on the first search to use the app config"""
+        super().__init__(datasource=datasource, backend=backend)
+        self.cache = None
+
+    def get(self, req, lookup):
+        args = getattr(req, 'args', None) or {}
+        prefix = ' '.join(str(args.get('q') or '').casefold().split())
+        if not prefix:
+            raise SuperdeskApiError.badRequestError(message='q is required.')
+
+        size = get_max_results(req, app.config.get('PLANNING_LOCATIONS_AUTOCOMPLETE_SIZE', AUTOCOMPLETE_SIZE))
+        cache = self.get_cache()
+        docs = cache.get((prefix, size))
+        if docs is None:
+            docs = self.search(self.get_query(prefix, size)).docs
+            cache.set((prefix, size), copy.deepcopy(docs))
+        else:
+            # eve adds its meta fields to the returned docs, the cached ones are kept as found
+            docs = copy.deepcopy(docs)
+        return ListCursor(list(docs))
+
+    def get_query(self, prefix, size):
+        return {
+            'query': {
+                'multi_match': {
+                    'query': prefix,
+                    'fields': ['name.autocomplete^2', 'address.line.autocomplete'],
+                    'operator': 'and',
+                }
+            },
+            'sort': [{USAGE_FIELD: {'order': 'desc', 'missing': '_last'}}, '_score'],
+            'size': size,
+        }
+
+    def get_cache(self):
+        if self.cache is None:
+            self.cache = LRUCache(app.config.get('PLANNING_LOCATIONS_AUTOCOMPLETE_CACHE_SIZE', AUTOCOMPLETE_CACHE_SIZE),
+                                  app.config.get('PLANNING_LOCATIONS_AUTOCOMPLETE_CACHE_TTL', AUTOCOMPLETE_CACHE_TTL))
+        return self.cache
+
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+
+class LocationsGeoService(superdesk.Service):
+    """Base service for the geo searches of locations
+
+    The locations found are sorted by their distance to the origin of the search,
+    which is set in kilometres in the `distance` of every location.
+    """
+
+    def get(self, req, lookup):
+        args = getattr(req, 'args', None) or {}
+        origin = self.get_origin(args)
+        source = {
+            'query': {'filtered': {'filter': self.get_filter(args, origin)}},
+            'sort': [{'_geo_distance': {GEO_FIELD: origin, 'order': 'asc', 'unit': 'km'}}],
+        }
+        self.set_page(source, req)
+
+        cursor = self.search(source)
+        for doc, hit in zip(cursor.docs, cursor.hits['hits']['hits']):
+            doc['distance'] = hit.get('sort', [None])[0]
+        return cursor
+
+    def get_origin(self, args):
+        """Get the ``[longitude, latitude]`` the distances are computed from"""
+        return [get_float_arg(args, 'lon', -180, 180), get_float_arg(args, 'lat', -90, 90)]
+
+    def get_filter(self, args, origin):
+        return {'exists': {'field': GEO_FIELD}}
+
+    def set_page(self, source, req):
+        max_results = getattr(req, 'max_results', None) or app.config.get('PAGINATION_DEFAULT', 25)
+        source['size'] = max_results
+        source['from'] = (max((getattr(req, 'page', 1) or 1), 1) - 1) * max_results
+
+
+class LocationsRadiusService(LocationsGeoService):
+    """Search the locations within `radius` kilometres of `lat` and `lon`"""
+
+    def get_filter(self, args, origin):
+        radius = get_float_arg(args, 'radius', 0)
+        return {'geo_distance': {'distance': '{}km'.format(radius), GEO_FIELD: origin}}
+
+
+class LocationsBoundingBoxService(LocationsGeoService):
+    """Search the locations within the `top`, `left`, `bottom` and `right` bounds
+
+    The locations are sorted by their distance to `lat` and `lon` if given, or to the center of the box.
+    """
+
+    def get_origin(self, args):
+        if 'lat' in args or 'lon' in args:
+            return super().get_origin(args)
+
+        top, left, bottom, right = self.get_bounds(args)
+        # a box crossing the antimeridian has its left bound east of its right bound
+        center = (left + right + (360 if left > right else 0)) / 2
+        return [center - 360 if center > 180 else center, (top + bottom) / 2]
+
+    def get_filter(self, args, origin):
+        top, left, bottom, right = self.get_bounds(args)
+        return {'geo_bounding_box': {GEO_FIELD: {'top_left': [left, top], 'bottom_right': [right, bottom]}}}
+
+    def get_bounds(self, args):
+        top = get_float_arg(args, 'top', -90, 90)
+        bottom = get_float_arg(args, 'bottom', -90, 90)
+        if bottom > top:
+            raise SuperdeskApiError.badRequestError(message='bottom must be lower than top.')
+        return top, get_float_arg(args, 'left', -180, 180), bottom, get_float_arg(args, 'right', -180, 180)
+
+
+class LocationsNearestService(LocationsGeoService):
+    """Get the `max_results` locations nearest to `lat` and `lon`"""
+
+    def get(self, req, lookup):
+        return ListCursor(super().get(req, lookup).docs)
+
+    def set_page(self, source, req):
+        source['size'] = get_max_results(req, app.config.get('PLANNING_LOCATIONS_NEAREST_SIZE', NEAREST_SIZE))
+
+
+def clear_autocomplete_cache():
+    get_resource_service('locations_autocomplete').clear_cache()
+
+
+def increment_usage(guids):
+    """Count a use of the locations with the given guids for every time they are listed
+
+    :param list guids: guids of the locations, i.e. the qcodes of the locations of new events
+    """
+    counts = Counter(guid for guid in guids if guid)
+    if not counts:
+        return
+
+    # one update for all the locations used the same number of times
+    guids_by_count = defaultdict(list)
+    for guid, count in counts.items():
+        guids_by_count[count].append(guid)
+
+    collection = get_collection('locations')
+    for count, group in guids_by_count.items():
+        collection.update_many({'guid': {'$in': group}}, {'$inc': {USAGE_FIELD: count}})
+
+    ids = [doc[config.ID_FIELD] for doc in collection.find({'guid': {'$in': list(counts)}}, {config.ID_FIELD: 1})]
+    bulk_index_items('locations', ids)
+    clear_autocomplete_cache()
+
+
+def get_autocomplete_properties():
+    """Get the elastic mapping of the location fields with an autocomplete sub-field"""
+    return {
+        'name': locations_schema['name']['mapping'],
+        'address': {'properties': {'line': locations_schema['address']['schema']['line']['mapping']}},
+    }
+
+
+def get_location_qcodes(doc):
+    """Get the qcodes of the locations of an event, which are the guids of the locations"""
+    return [location.get('qcode') for location in doc.get('location') or [] if location.get('qcode')]
+
+
+def set_autocomplete_settings(settings):
+    """Add the analyzers of the autocomplete to the elastic index settings
+
+    The settings are only used when the index is created, an existing index gets the analyzers and
+    the autocomplete fields with the ``planning:update_locations_mapping`` command.
+    """
+    analysis = settings.setdefault('settings', {}).setdefault('analysis', {})
+    for key, values in AUTOCOMPLETE_ANALYSIS.items():
+        analysis.setdefault(key, {}).update(values)
+
+
+def get_max_results(req, default):
+    """Get the `max_results` given in the request, or `default`
+
+    Eve always sets the `max_results` of the request, to ``PAGINATION_DEFAULT`` if not given,
+    so it is read from the arguments instead.
+    """
+    args = getattr(req, 'args', None) or {}
+    try:
+        max_results = int(args.get('max_results') or 0)
+    except (TypeError, ValueError):
+        raise SuperdeskApiError.badRequestError(message='max_results must be a number.')
+    if max_results <= 0:
+        return default
+    return min(max_results, app.config.get('PAGINATION_LIMIT', max_results))
+
+
+def get_geo_point(position):
+    """Get the ``[longitude, latitude]`` pair of a position, or None if it has no valid coordinates"""
+    try:
+        latitude = float(position['latitude'])
+        longitude = float(position['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return None
+    return [longitude, latitude]
+
+
+def get_address_tokens(text):
+    """Get the casefolded words of a part of an address, with a leading number after the street
+
+    Only the street number vs number street variants are normalized: "12 Karl Johans gate" and
+    "Karl Johans gate 12" get the same words in the same order, while the order of any other words
+    is kept, so "10 Main St Apt 2" and "2 Main St Apt 10" are different addresses.
+
+    :param str text: part of an address, between commas
+    :return list: words
+    """
+    tokens = TOKEN_RE.findall(unicodedata.normalize('NFKC', text).casefold())
+    if len(tokens) > 1 and NUMBER_RE.match(tokens[0]):
+        end = 1
+        while end < len(tokens) and not NUMBER_RE.match(tokens[end]):
+            end += 1
+        tokens = tokens[1:end] + tokens[:1] + tokens[end:]
+    return tokens
+
+
+def get_address_key(doc):
+    """Get the normalized address key of a location
+
+    The words of its name and address are casefolded, in order with a leading street number moved
+    after the street and without the words already seen, so that the variants of the same address
+    get the same key, then the coordinates rounded to `PLANNING_LOCATIONS_ADDRESS_KEY_PRECISION`
+    decimals are added.
+
+    :param dict doc: location
+    :return str: sha1 of the normalized address, or None if the location has no name nor address
+    """
+    address = doc.get('address') or {}
+    parts = [doc.get('name')] + list(address.get('line') or []) + [address.get(field) for field in ADDRESS_FIELDS]
+
+    tokens = []
+    for part in parts:
+        if not part:
+            continue
+        for text in str(part).split(','):
+            tokens.extend(token for token in get_address_tokens(text) if token not in tokens)
+    if not tokens:
+        return None
+
+    key = ' '.join(tokens)
+    geo = get_geo_point(doc.get('position'))
+    if geo:
+        precision = app.config.get('PLANNING_LOCATIONS_ADDRESS_KEY_PRECISION', ADDRESS_KEY_PRECISION)
+        # adding 0.0 turns the -0.0 of rounded small negative values into 0.0
+        key += '|' + ','.join('{:.{}f}'.format(round(value, precision) + 0.0, precision) for value in geo)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_float_arg(args, name, minimum=None, maximum=None):
+    try:
+        value = float(args[name])
+    except (KeyError, TypeError, ValueError):
+        raise SuperdeskApiError.badRequestError(message='{} must be a number.'.format(name))
+
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise SuperdeskApiError.badRequestError(message='{} is out of range.'.format(name))
+    return value
 
 
 locations_schema = {
@@ -56,6 +482,11 @@ locations_schema = {
         'type': 'string',
         'mapping': not_analyzed
     },
+    USAGE_FIELD: {
+        'type': 'integer',
+        'readonly': True,
+        'default': 0
+    },
 
     # Audit Information
     'original_creator': superdesk.Resource.rel('users'),
@@ -86,12 +517,19 @@ locations_schema = {
     # NewsML-G2 Event properties See:
     #    https://iptc.org/std/NewsML-G2/2.23/specification/XML-Schema-Doc-Core/ConceptItem.html#LinkC5
     #
-    # IMPORTANT: name needs to be unique to ensure we don't save duplicate addresses, however this is also
-    # the field where we store the formatted address, which can have variations (street number vs number street)
-    # for the same address
+    # name is the field where we store the formatted address, which can have variations
+    # (street number vs number street) for the same address, so the locations are unique by their
+    # address_key instead, normalized from the name, address and position
     'name': {
         'type': 'string',
-        'unique': True,
+        'mapping': {
+            'type': 'string',
+            'fields': {'autocomplete': AUTOCOMPLETE_MAPPING}
+        }
+    },
+    ADDRESS_KEY_FIELD: {
+        'type': 'string',
+        'mapping': not_analyzed
     },
 
     # NewsML-G2 poiDetails properties See IPTC-G2-Implementation_Guide 12.6.3
@@ -105,12 +543,21 @@ locations_schema = {
             'gps_datum': {'type': 'string'},
         }
     },
+    # [longitude, latitude] of the position, maintained by the service for the geo searches
+    GEO_FIELD: {
+        'type': 'list',
+        'nullable': True,
+        'mapping': {'type': 'geo_point'}
+    },
     'address': {
         'type': 'dict',
         'schema': {
             'line': {
                 'type': 'list',
-                'mapping': {'type': 'string'}
+                'mapping': {
+                    'type': 'string',
+                    'fields': {'autocomplete': AUTOCOMPLETE_MAPPING}
+                }
             },
             'locality': {'type': 'string'},
             'area': {'type': 'string'},
@@ -162,6 +609,50 @@ class LocationsResource(superdesk.Resource):
     }
     item_methods = ['GET', 'PATCH', 'PUT', 'DELETE']
     public_methods = ['GET']
+    mongo_indexes = {
+        'geo_2dsphere': [(GEO_FIELD, '2dsphere')],
+        # null keys, i.e. of locations without name nor address, are not unique
+        'address_key_1': ([(ADDRESS_KEY_FIELD, 1)], {
+            'unique': True,
+            'partialFilterExpression': {ADDRESS_KEY_FIELD: {'$type': 'string'}},
+        }),
+    }
     privileges = {'POST': 'planning',
                   'PATCH': 'planning',
                   'DELETE': 'planning'}
+
+
+class LocationsRadiusResource(LocationsResource):
+    url = 'locations/radius'
+    resource_title = endpoint_name = 'locations_radius'
+
+    resource_methods = ['GET']
+    item_methods = []
+    privileges = {}
+
+
+class LocationsBoundingBoxResource(LocationsResource):
+    url = 'locations/bbox'
+    resource_title = endpoint_name = 'locations_bbox'
+
+    resource_methods = ['GET']
+    item_methods = []
+    privileges = {}
+
+
+class LocationsAutocompleteResource(LocationsResource):
+    url = 'locations/autocomplete'
+    resource_title = endpoint_name = 'locations_autocomplete'
+
+    resource_methods = ['GET']
+    item_methods = []
+    privileges = {}
+
+
+class LocationsNearestResource(LocationsResource):
+    url = 'locations/nearest'
+    resource_title = endpoint_name = 'locations_nearest'
+
+    resource_methods = ['GET']
+    item_methods = []
+    privileges = {}
@@ -0,0 +1,218 @@
+from types import SimpleNamespace
+from eve.utils import ParsedRequest
+from mock import patch
+from pymongo.errors import DuplicateKeyError
+from superdesk import get_resource_service
+from superdesk.errors import SuperdeskApiError
+from planning.tests import TestCase
+from planning.locations import LocationsService, LocationsRadiusService, LocationsBoundingBoxService, \
+    LocationsNearestService, get_geo_point, get_address_key, increment_usage
+from planning.common import get_collection
+
+
+def get_search_result(distances):
+    return SimpleNamespace(
+        docs=[{'name': 'location {}'.format(index)} for index in range(len(distances))],
+        hits={'hits': {'total': 50, 'hits': [{'sort': [distance]} for distance in distances]}},
+    )
+
+
+def get_request(max_results=None, page=1, **args):
+    req = ParsedRequest()
+    req.args = dict(args, max_results=str(max_results)) if max_results else args
+    # like eve, max_results is set whether given or not
+    req.max_results = max_results or 25
+    req.page = page
+    return req
+
+
+class LocationsTestCase(TestCase):
+
+    def test_get_geo_point(self):
+        self.assertEqual([10.75, 59.91], get_geo_point({'latitude': 59.91, 'longitude': 10.75}))
+        self.assertEqual([10.75, 59.91], get_geo_point({'latitude': '59.91', 'longitude': '10.75'}))
+        self.assertIsNone(get_geo_point({'latitude': 91, 'longitude': 10}))
+        self.assertIsNone(get_geo_point({'latitude': 59.91}))
+        self.assertIsNone(get_geo_point(None))
+
+    def test_geo_follows_position(self):
+        service = LocationsService()
+        doc = {'name': 'Oslo', 'position': {'latitude': 59.91, 'longitude': 10.75}}
+        with self.app.app_context():
+            service.on_create([doc])
+        self.assertEqual([10.75, 59.91], doc['geo'])
+
+        updates = {'position': {'latitude': 60.39, 'longitude': 5.32}}
+        service.on_update(updates, doc)
+        self.assertEqual([5.32, 60.39], updates['geo'])
+
+        updates = {'name': 'Bergen'}
+        service.on_update(updates, doc)
+        self.assertNotIn('geo', updates)
+
+    def test_get_address_key(self):
+        with self.app.app_context():
+            key = get_address_key({'name': '12 Karl Johans gate, Oslo', 'position': {'latitude': 59.9127,
+                                                                                     'longitude': 10.7461}})
+            self.assertEqual(key, get_address_key({'name': 'karl johans gate 12 OSLO',
+                                                   'position': {'latitude': 59.91274, 'longitude': 10.74608}}))
+            self.assertEqual(key, get_address_key({'name': 'Karl Johans gate 12',
+                                                   'address': {'locality': 'Oslo'},
+                                                   'position': {'latitude': 59.9127, 'longitude': 10.7461}}))
+            self.assertNotEqual(key, get_address_key({'name': 'Karl Johans gate 12 Oslo'}))
+            self.assertNotEqual(key, get_address_key({'name': 'Karl Johans gate 14 Oslo',
+                                                      'position': {'latitude': 59.9127, 'longitude': 10.7461}}))
+            self.assertIsNone(get_address_key({'name': ' , '}))
+
+            # only the street number vs number street variants get the same key
+            self.assertEqual(get_address_key({'name': '10 Main St, Apt 2'}),
+                             get_address_key({'name': 'Main St 10, Apt 2'}))
+            self.assertNotEqual(get_address_key({'name': '10 Main St Apt 2'}),
+                                get_address_key({'name': '2 Main St Apt 10'}))
+            self.assertNotEqual(get_address_key({'name': 'Karl Johans gate 12'}),
+                                get_address_key({'name': 'gate Karl Johans 12'}))
+
+    def test_create_upserts_on_address_key(self):
+        service = LocationsService('locations')
+        existing = {'_id': 'existing', 'name': 'Karl Johans gate 12, Oslo', 'guid': 'existing-guid',
+                    'address_key': get_address_key({'name': 'Karl Johans gate 12, Oslo'})}
+
+        def find_one(req, address_key):
+            return existing if address_key == existing['address_key'] else None
+
+        def create(docs, **kwargs):
+            for index, doc in enumerate(docs):
+                doc['_id'] = 'new{}'.format(index)
+            return [doc['_id'] for doc in docs]
+
+        docs = [{'name': '12 Karl Johans gate, Oslo'}, {'name': 'Stortinget'}, {'name': 'stortinget'}]
+        with self.app.app_context():
+            for doc in docs:
+                doc['address_key'] = get_address_key(doc)
+            with patch.object(service, 'find_one', side_effect=find_one), \
+                    patch('superdesk.Service.create', side_effect=create) as created:
+                ids = service.create(docs)
+
+        self.assertEqual(['existing', 'new0', 'new0'], ids)
+        self.assertEqual(1, len(created.call_args[0][0]))
+        self.assertEqual('existing-guid', docs[0]['guid'])
+        self.assertEqual('Stortinget', docs[2]['name'])
+
+    def test_create_returns_location_inserted_concurrently(self):
+        service = LocationsService('locations')
+        doc = {'name': 'Stortinget'}
+        with self.app.app_context():
+            doc['address_key'] = get_address_key(doc)
+            winner = {'_id': 'winner', 'name': 'Stortinget', 'address_key': doc['address_key']}
+            # the other request inserts the location between the lookup and the insert
+            with patch.object(service, 'find_one', side_effect=[None, winner]), \
+                    patch('superdesk.Service.create', side_effect=DuplicateKeyError('address_key')):
+                ids = service.create([doc])
+
+        self.assertEqual(['winner'], ids)
+        self.assertEqual(winner, doc)
+
+    def test_update_rejects_address_of_other_location(self):
+        service = LocationsService('locations')
+        original = {'_id': 'first', 'name': 'Stortinget'}
+        with self.app.app_context():
+            original['address_key'] = get_address_key(original)
+            other = {'_id': 'second', 'name': 'Karl Johans gate 22'}
+            with patch.object(service, 'find_one', return_value=other):
+                with self.assertRaises(SuperdeskApiError):
+                    service.on_update({'name': 'Karl Johans gate 22'}, original)
+
+            with patch.object(service, 'find_one', return_value=None):
+                updates = {'name': 'Karl Johans gate 22'}
+                service.on_update(updates, original)
+                self.assertEqual(get_address_key(other), updates['address_key'])
+
+    def test_search_radius(self):
+        service = LocationsRadiusService('locations_radius')
+        result = get_search_result([0.5, 1.25])
+        with self.app.app_context(), patch.object(service, 'search', return_value=result) as search:
+            cursor = service.get(get_request(lat='59.91', lon='10.75', radius='5', max_results=2, page=2), {})
+
+            source = search.call_args[0][0]
+            self.assertEqual({'geo_distance': {'distance': '5.0km', 'geo': [10.75, 59.91]}},
+                             source['query']['filtered']['filter'])
+            self.assertEqual([{'_geo_distance': {'geo': [10.75, 59.91], 'order': 'asc', 'unit': 'km'}}],
+                             source['sort'])
+            self.assertEqual((2, 2), (source['size'], source['from']))
+            self.assertEqual([0.5, 1.25], [doc['distance'] for doc in cursor.docs])
+
+            with self.assertRaises(SuperdeskApiError):
+                service.get(get_request(lat='59.91', lon='10.75'), {})
+            with self.assertRaises(SuperdeskApiError):
+                service.get(get_request(lat='95', lon='10.75', radius='5'), {})
+
+    def test_search_bounding_box(self):
+        service = LocationsBoundingBoxService('locations_bbox')
+        result = get_search_result([])
+        with self.app.app_context(), patch.object(service, 'search', return_value=result) as search:
+            service.get(get_request(top='60', left='10', bottom='59', right='12'), {})
+
+            source = search.call_args[0][0]
+            self.assertEqual({'geo_bounding_box': {'geo': {'top_left': [10, 60], 'bottom_right': [12, 59]}}},
+                             source['query']['filtered']['filter'])
+            self.assertEqual([11, 59.5], source['sort'][0]['_geo_distance']['geo'])
+
+            # a box crossing the antimeridian
+            service.get(get_request(top='10', left='170', bottom='0', right='-160'), {})
+            self.assertEqual([-175, 5], search.call_args[0][0]['sort'][0]['_geo_distance']['geo'])
+
+            with self.assertRaises(SuperdeskApiError):
+                service.get(get_request(top='59', left='10', bottom='60', right='12'), {})
+
+    def test_search_nearest(self):
+        service = LocationsNearestService('locations_nearest')
+        result = get_search_result([0.1, 2])
+        with self.app.app_context(), patch.object(service, 'search', return_value=result) as search:
+            cursor = service.get(get_request(lat='59.91', lon='10.75', max_results=2), {})
+
+            source = search.call_args[0][0]
+            self.assertEqual({'exists': {'field': 'geo'}}, source['query']['filtered']['filter'])
+            self.assertEqual(2, source['size'])
+            self.assertEqual(2, cursor.count())
+            self.assertEqual([0.1, 2], [doc['distance'] for doc in cursor])
+
+            service.get(get_request(lat='59.91', lon='10.75'), {})
+            self.assertEqual(10, search.call_args[0][0]['size'])
+
+    def test_autocomplete_caches_prefixes(self):
+        result = get_search_result([1])
+        with self.app.app_context():
+            service = get_resource_service('locations_autocomplete')
+            with patch.object(service, 'search', return_value=result) as search:
+                cursor = service.get(get_request(q='Karl  JOH', max_results=5), {})
+                self.assertEqual(['location 0'], [doc['name'] for doc in cursor])
+
+                query = search.call_args[0][0]
+                self.assertEqual('karl joh', query['query']['multi_match']['query'])
+                self.assertEqual({'usage_count': {'order': 'desc', 'missing': '_last'}}, query['sort'][0])
+                self.assertEqual(5, query['size'])
+
+                # the docs returned are copies, changed by eve without changing the cache
+                cursor[0]['_links'] = {}
+                cursor = service.get(get_request(q='karl joh', max_results=5), {})
+                self.assertEqual(1, search.call_count)
+                self.assertEqual({'name': 'location 0'}, cursor[0])
+
+                # writes to the locations clear the cache
+                LocationsService('locations').on_updated({'name': 'Karl Johans gate'}, {})
+                service.get(get_request(q='karl joh', max_results=5), {})
+                self.assertEqual(2, search.call_count)
+
+                with self.assertRaises(SuperdeskApiError):
+                    service.get(get_request(q=' '), {})
+
+    def test_increment_usage(self):
+        with self.app.app_context():
+            collection = get_collection('locations')
+            collection.insert_many([{'guid': 'first'}, {'guid': 'second', 'usage_count': 3}, {'guid': 'third'}])
+            with patch('planning.locations.bulk_index_items') as bulk_index_items:
+                increment_usage(['first', 'second', 'first', None])
+
+            counts = {doc['guid']: doc.get('usage_count') for doc in collection.find()}
+            self.assertEqual({'first': 2, 'second': 4, 'third': None}, counts)
+            self.assertEqual(2, len(bulk_index_items.call_args[0][1]))
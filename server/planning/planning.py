@@ -287,6 +287,10 @@ class PlanningResource(superdesk.Resource):
     resource_methods = ['GET', 'POST']
     item_methods = ['GET', 'PATCH', 'PUT', 'DELETE']
     public_methods = ['GET']
+    mongo_indexes = {
+        'event_item': [('event_item', 1)],
+        'state_1_expiry_1': [('state', 1), ('expiry', 1)],
+    }
     privileges = {'POST': 'planning_planning_management',
                   'PATCH': 'planning_planning_management',
                   'DELETE': 'planning'}
@@ -35,14 +35,13 @@ class PlanningHistoryService(HistoryService):
     """Service for keeping track of the history of a planning entries
     """
 
-    def _save_history(self, planning, update, operation):
-        history = {
+    def _get_history(self, planning, update, operation):
+        return {
             'planning_id': planning[config.ID_FIELD],
             'user_id': self.get_user_id(),
             'operation': operation,
             'update': self._remove_unwanted_fields(update)
         }
-        self.post([history])
 
     def on_spike(self, updates, original):
         """Spike event
@@ -65,3 +64,30 @@ class PlanningHistoryService(HistoryService):
             get_resource_service('agenda_history').on_item_updated({'planning_items': original['_id']}, agenda,
                                                                    operation='item unspiked')
         super().on_unspike(updates, original)
+
+    def on_items_spiked(self, updates, originals):
+        self._on_agenda_items_updated(originals, 'item spiked')
+        super().on_items_spiked(updates, originals)
+
+    def on_items_unspiked(self, updates, originals):
+        self._on_agenda_items_updated(originals, 'item unspiked')
+        super().on_items_unspiked(updates, originals)
+
+    def _on_agenda_items_updated(self, originals, operation):
+        """Add one entry to the history of every agenda containing any of the planning items
+
+        All the agendas are fetched with one query and their history is saved with one write.
+        """
+        planning_ids = [original[config.ID_FIELD] for original in originals]
+        if not planning_ids:
+            return
+
+        history = []
+        agenda_history_service = get_resource_service('agenda_history')
+        for agenda in get_resource_service('agenda').find(where={'planning_items': {'$in': planning_ids}}):
+            for planning_id in set(agenda['planning_items']).intersection(planning_ids):
+                history.append(agenda_history_service._get_history(agenda, {'planning_items': planning_id},
+                                                                   operation))
+
+        if history:
+            agenda_history_service.post(history)
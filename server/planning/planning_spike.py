@@ -10,10 +10,11 @@
 
 from .planning import PlanningResource
 from .common import ITEM_EXPIRY, ITEM_STATE, ITEM_SPIKED, ITEM_ACTIVE, set_item_expiry
+from .bulk_spike import bulk_spike_schema, BulkSpikeService, BulkUnspikeService
 from superdesk.services import BaseService
 from superdesk.notification import push_notification
 from apps.auth import get_user
-from superdesk import config
+from superdesk import config, Resource
 
 
 class PlanningSpikeResource(PlanningResource):
@@ -58,3 +59,37 @@ class PlanningUnspikeService(BaseService):
         item = self.backend.update(self.datasource, id, updates, original)
         push_notification('planning:unspiked', item=str(id), user=str(user.get(config.ID_FIELD)))
         return item
+
+
+class PlanningBulkSpikeResource(Resource):
+    url = 'planning/bulk_spike'
+    resource_title = endpoint_name = 'planning_bulk_spike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_planning_spike'}
+
+
+class PlanningBulkSpikeService(BulkSpikeService):
+    resource = 'planning'
+    lookup = {'planning_type': {'$ne': 'agenda'}}
+    history_service = 'planning_history'
+    notification = 'planning:spiked:bulk'
+
+
+class PlanningBulkUnspikeResource(Resource):
+    url = 'planning/bulk_unspike'
+    resource_title = endpoint_name = 'planning_bulk_unspike'
+
+    schema = bulk_spike_schema
+    resource_methods = ['POST']
+    item_methods = []
+    privileges = {'POST': 'planning_planning_unspike'}
+
+
+class PlanningBulkUnspikeService(BulkUnspikeService):
+    resource = 'planning'
+    lookup = {'planning_type': {'$ne': 'agenda'}}
+    history_service = 'planning_history'
+    notification = 'planning:unspiked:bulk'
@@ -0,0 +1,96 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Sequence numbers reserved in blocks"""
+
+import threading
+from superdesk import get_resource_service
+
+#: Default number of sequence numbers reserved at once
+DEFAULT_BLOCK_SIZE = 100
+
+
+class SequenceBlocks:
+    """Sequence numbers of the `sequences` resource, reserved in blocks
+
+    A block of numbers is reserved with one atomic increment of the sequence, then its numbers are
+    handed out locally. Every worker reserves its own blocks, so the numbers are unique (until the
+    sequence wraps) but not in order across the workers, and the numbers left in a block are not
+    used once the process stops.
+    """
+
+    def __init__(self):
+        """Create the blocks, none is reserved until a number is needed"""
+        self.lock = threading.Lock()
+        self.blocks = {}
+
+    def get_next_sequence_number(self, key_name, max_seq_number=None, min_seq_number=1,
+                                 block_size=DEFAULT_BLOCK_SIZE):
+        """Get the next number of a sequence, reserving a new block if needed
+
+        Like :meth:`superdesk.sequences.SequencesService.get_next_sequence_number`, the sequence
+        goes back to `min_seq_number` after `max_seq_number`.
+
+        :param str key_name: key of the sequence
+        :param int max_seq_number: maximal value, None means no upper limit
+        :param int min_seq_number: minimal value
+        :param int block_size: number of values reserved at once
+        :return int: sequence number
+        """
+        if not key_name:
+            raise KeyError('Sequence key cannot be empty')
+
+        with self.lock:
+            block = self.blocks.get(key_name)
+            if not block or block[0] > block[1]:
+                block = self.blocks[key_name] = list(self.reserve(key_name, block_size, max_seq_number,
+                                                                  min_seq_number))
+            number = block[0]
+            block[0] += 1
+
+        return wrap_sequence_number(number, max_seq_number, min_seq_number)
+
+    def reserve(self, key_name, size, max_seq_number=None, min_seq_number=1):
+        """Reserve `size` numbers of a sequence with one atomic increment
+
+        :return tuple: first and last reserved numbers, before wrapping them
+        """
+        service = get_resource_service('sequences')
+        last = service.find_and_modify(
+            query={'key': key_name},
+            update={'$inc': {'sequence_number': size}},
+            upsert=True,
+            new=True
+        ).get('sequence_number')
+
+        if max_seq_number and last > max_seq_number:
+            # bring the stored value back in range, at the same position in the cycle. The condition
+            # keeps concurrent workers which also went past the maximal value from doing it twice.
+            service.find_and_modify(
+                query={'key': key_name, 'sequence_number': {'$gt': max_seq_number}},
+                update={'$inc': {'sequence_number': -(max_seq_number - min_seq_number + 1)}}
+            )
+
+        return last - size + 1, last
+
+    def clear(self):
+        """Forget the reserved blocks, i.e. when the sequences were reset"""
+        with self.lock:
+            self.blocks.clear()
+
+
+def wrap_sequence_number(number, max_seq_number=None, min_seq_number=1):
+    """Bring a reserved number back between `min_seq_number` and `max_seq_number`"""
+    if not max_seq_number or min_seq_number <= number <= max_seq_number:
+        return number
+    return min_seq_number + (number - min_seq_number) % (max_seq_number - min_seq_number + 1)
+
+
+sequence_blocks = SequenceBlocks()
@@ -0,0 +1,78 @@
+import threading
+from superdesk import get_resource_service
+from planning.sequences import SequenceBlocks, wrap_sequence_number
+from planning.tests import TestCase
+
+
+class SequenceBlocksTestCase(TestCase):
+
+    def get_stored_number(self, key_name):
+        return get_resource_service('sequences').find_one(req=None, key=key_name)['sequence_number']
+
+    def test_numbers_are_reserved_in_blocks(self):
+        with self.app.app_context():
+            blocks = SequenceBlocks()
+            numbers = [blocks.get_next_sequence_number('test', block_size=3) for _ in range(5)]
+            self.assertEqual([1, 2, 3, 4, 5], numbers)
+            self.assertEqual(6, self.get_stored_number('test'))
+
+            # another worker gets the next block
+            self.assertEqual(7, SequenceBlocks().get_next_sequence_number('test', block_size=3))
+            self.assertEqual(6, blocks.get_next_sequence_number('test', block_size=3))
+
+    def test_numbers_wrap_at_max_value(self):
+        with self.app.app_context():
+            blocks = SequenceBlocks()
+            numbers = [blocks.get_next_sequence_number('test', max_seq_number=5, block_size=3) for _ in range(12)]
+            self.assertEqual([1, 2, 3, 4, 5, 1, 2, 3, 4, 5, 1, 2], numbers)
+            self.assertTrue(self.get_stored_number('test') <= 5)
+
+    def test_concurrent_workers(self):
+        numbers = []
+
+        def worker():
+            with self.app.app_context():
+                blocks = SequenceBlocks()
+                drawn = [blocks.get_next_sequence_number('test', max_seq_number=1000, block_size=7)
+                         for _ in range(50)]
+                numbers.extend(drawn)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(200, len(numbers))
+        self.assertEqual(200, len(set(numbers)))
+        self.assertTrue(all(1 <= number <= 1000 for number in numbers))
+
+    def test_concurrent_workers_wrap(self):
+        numbers = []
+
+        def worker():
+            with self.app.app_context():
+                blocks = SequenceBlocks()
+                numbers.extend(blocks.get_next_sequence_number('test', max_seq_number=100, block_size=10)
+                               for _ in range(20))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 8 blocks of 10 numbers within a cycle of 100 numbers
+        self.assertEqual(80, len(set(numbers)))
+        with self.app.app_context():
+            blocks = SequenceBlocks()
+            numbers = [blocks.get_next_sequence_number('test', max_seq_number=100, block_size=10)
+                       for _ in range(30)]
+        self.assertEqual(list(range(81, 101)) + list(range(1, 11)), numbers)
+
+    def test_wrap_sequence_number(self):
+        self.assertEqual(5, wrap_sequence_number(5, 10))
+        self.assertEqual(1, wrap_sequence_number(11, 10))
+        self.assertEqual(3, wrap_sequence_number(23, 10))
+        self.assertEqual(5, wrap_sequence_number(11, 10, min_seq_number=5))
+        self.assertEqual(1234, wrap_sequence_number(1234))
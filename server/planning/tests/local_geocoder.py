@@ -0,0 +1,35 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013, 2014 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""A local stand-in for the geocoding providers, used by the tests of the geocoding proxy
+
+It answers from a list of places in the format of the nominatim search results, matching the places
+with a `display_name` containing all the words of the query. The queries received are recorded
+in `queries` so the tests can check which lookups reached the provider.
+"""
+
+from planning.geocode import GeocodeProvider
+
+
+class LocalGeocodeProvider(GeocodeProvider):
+    """Geocoder answering from `places`, shared by all the instances like the places of a real geocoder"""
+
+    places = []
+    queries = []
+
+    @classmethod
+    def reset(cls, places=None):
+        cls.places = list(places or [])
+        cls.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        words = query.casefold().split()
+        return [place for place in self.places if all(word in place['display_name'].casefold() for word in words)]